@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of split_message_into_chunks (how long agent outputs are split into Discord messages) on multi-MB
+outputs, compared to the previous slicing loop, which is quadratic in the output size.
+
+Usage: python bench/bench_chunker.py [--sizes-mb 0.5,1,2,4,8] [--legacy-max-mb 2]
+"""
+import argparse
+import random
+
+from bench_utils import import_bot, time_call
+
+bot = import_bot()
+
+
+def generate_output(size: int, seed: int = 0) -> str:
+    """Agent-like output: prose, fenced code blocks, and the occasional huge single line (e.g. minified JSON)."""
+    rng = random.Random(seed)
+    lines: list[str] = []
+    length = 0
+    while length < size:
+        r = rng.random()
+        if r < 0.1:
+            block = ["```python"]
+            block += [f"    value_{i} = compute({i}, {'x' * rng.randint(0, 60)!r})" for i in range(rng.randint(5, 200))]
+            block.append("```")
+        elif r < 0.12:
+            block = ["{" + ",".join(f'"k{i}": {i}' for i in range(rng.randint(200, 2000))) + "}"]
+        else:
+            block = [" ".join(rng.choice(("the", "agent", "changed", "file", "tests", "pass")) for _ in range(rng.randint(0, 25)))]
+        lines.extend(block)
+        length += sum(len(line) + 1 for line in block)
+    return "\n".join(lines)
+
+
+def legacy_split(msg: str, limit: int) -> list[str]:
+    """The chunking loop send_notification used before (with the 'lines left' counter enabled)."""
+    pieces = []
+    while msg:
+        piece = bot.close_unterminated_code_blocks(msg[:limit]) + (
+            f"\n\n... ({len(msg[limit:].splitlines())} lines left)" if len(msg) >= limit else ""
+        )
+        msg = msg[limit:]
+        pieces.append(piece)
+    return pieces
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", default="0.5,1,2,4,8", help="Comma separated output sizes in MB")
+    parser.add_argument("--legacy-max-mb", type=float, default=2.0, help="Skip the quadratic legacy loop above this size")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    limit = bot.DISCORD_CHARACTER_LIMIT
+    print(f"{'size':>8} {'chunks':>7} {'chunker':>10} {'MB/s':>8} {'legacy':>10} {'speedup':>8}")
+    for size_mb in map(float, args.sizes_mb.split(",")):
+        msg = generate_output(int(size_mb * 1024 * 1024))
+        chunks = bot.split_message_into_chunks(msg, limit, True)
+        assert all(len(chunk) <= limit for chunk in chunks)
+        seconds = time_call(bot.split_message_into_chunks, msg, limit, True, repeat=args.repeat)
+        row = f"{size_mb:>6.1f}MB {len(chunks):>7} {seconds * 1000:>8.1f}ms {size_mb / seconds:>8.1f}"
+        if size_mb <= args.legacy_max_mb:
+            legacy_seconds = time_call(legacy_split, msg, limit, repeat=1)
+            row += f" {legacy_seconds * 1000:>8.1f}ms {legacy_seconds / seconds:>7.1f}x"
+        else:
+            row += f" {'skipped':>10} {'-':>8}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark of the codex event path of the reader: decoding stdout lines into CodexEvents with each installed JSON
+backend, plus dispatching them to the notification handlers. Reports events/sec.
+
+Usage: python bench/bench_event_decoding.py [--stream recorded.jsonl] [--events 200000] [--verbosity verbose]
+
+A recorded stream is the stdout of `codex exec --json ...`. Without one, a synthetic stream with a realistic mix of
+events (mostly tool calls with their output) is generated.
+"""
+import argparse
+import json
+
+from bench_utils import import_bot, time_call
+from fake_codex import generate_events
+
+bot = import_bot()
+
+
+def generate_stream(num_events: int, seed: int = 0) -> list[bytes]:
+    return [json.dumps(event).encode() + b"\n" for event in generate_events(num_events, seed=seed)]
+
+
+def legacy_decode(lines: list[bytes]):
+    """What the reader did per line before: strip, decode to str, json.loads."""
+    for line in lines:
+        line = line.strip().decode("utf-8", errors="replace")
+        if line:
+            json.loads(line)
+
+
+def decode(lines: list[bytes], loads):
+    for line in lines:
+        bot.decode_codex_event(line, loads)
+
+
+def decode_and_dispatch(lines: list[bytes], loads, verbosity: str):
+    """Everything the reader does per line except the actual sending to Discord."""
+    handlers = bot.CODEX_EVENT_NOTIFICATION_HANDLERS
+    for line in lines:
+        event = bot.decode_codex_event(line, loads)
+        if event is None:
+            continue
+        bot.extract_codex_session_id_from_event(event)
+        handler = handlers.get(event.type)
+        if handler is not None:
+            handler(event, verbosity)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", help="Recorded `codex exec --json` output (one event per line)")
+    parser.add_argument("--events", type=int, default=200000, help="Size of the synthetic stream")
+    parser.add_argument("--verbosity", choices=bot.VALID_AGENT_VERBOSITIES, default="verbose")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.stream:
+        with open(args.stream, "rb") as f:
+            lines = f.readlines()
+    else:
+        lines = generate_stream(args.events)
+    num_bytes = sum(map(len, lines))
+    print(f"{len(lines)} events, {num_bytes / 1024 / 1024:.1f}MB, verbosity={args.verbosity}")
+
+    seconds = time_call(legacy_decode, lines, repeat=args.repeat)
+    print(f"{'legacy json.loads(str)':<28} decode: {len(lines) / seconds:>12,.0f} events/s")
+    for backend in ("json", "orjson", "msgspec"):
+        try:
+            name, loads = bot.get_json_loads(backend)
+        except ImportError:
+            print(f"{backend:<28} not installed")
+            continue
+        decode_seconds = time_call(decode, lines, loads, repeat=args.repeat)
+        dispatch_seconds = time_call(decode_and_dispatch, lines, loads, args.verbosity, repeat=args.repeat)
+        print(
+            f"{name:<28} decode: {len(lines) / decode_seconds:>12,.0f} events/s"
+            f"   decode+dispatch: {len(lines) / dispatch_seconds:>12,.0f} events/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark of the whole event pipeline of a turn, without network: a stand-in `codex` (fake_codex.py) writes a
+recorded or synthetic event stream, which goes through the reader, the agent's event bus, send_codex_notification,
+extract_attachment_directives, the chunker and send_notification into the outbound queue and finally to
+channel.send of a fake Discord channel. Agents are spawned with /spawn and prompted through on_message.
+
+Reports events/sec, p50/p99 latency from the moment codex wrote an event until the message containing it was sent,
+and peak memory.
+
+Usage: python bench/bench_event_pipeline.py [--stream recorded.jsonl] [--events 5000] [--rate 0] [--agents 1]
+                                            [--verbosity verbose] [--send-latency 0] [--discord-rate-limit 0]
+
+By default, Discord's rate limit is lifted (--discord-rate-limit 0) so the bot itself is measured; with
+--discord-rate-limit 5 (messages per 5s and channel, the bot's default) the latency includes queueing for the limit.
+"""
+import argparse
+import asyncio
+import os
+import re
+import time
+import tracemalloc
+
+from bench_utils import (
+    FakeChannel,
+    FakeContext,
+    get_peak_rss_mb,
+    import_bot,
+    install_fake_codex,
+    make_fake_message,
+    percentile,
+    set_fake_bot_user,
+    wait_until_bot_idle,
+)
+
+MARKER_PATTERN = re.compile(r"\[bench:(\d+\.\d+)\]")
+SKIPPED_PATTERN = re.compile(r"Skipped (\d+) message\(s\)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", help="Recorded `codex exec --json` output to replay (one event per line)")
+    parser.add_argument("--events", type=int, default=5000, help="Size of the synthetic stream per agent")
+    parser.add_argument("--rate", type=float, default=0, help="Events per second per agent (0 = as fast as possible)")
+    parser.add_argument("--output-lines", type=int, default=60, help="Max. lines of output of a synthetic tool call")
+    parser.add_argument("--agents", type=int, default=1, help="Agents that run a turn at the same time")
+    parser.add_argument("--verbosity", choices=("answers", "verbose", "live"), default="verbose")
+    parser.add_argument("--send-latency", type=float, default=0, help="Seconds a fake channel.send takes")
+    parser.add_argument("--discord-rate-limit", type=int, default=0, help="Messages per 5s and channel (0 = no limit)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the peak of Python allocations (slower)")
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["DISCORD_SEND_RATE_LIMIT_MESSAGES"] = str(args.discord_rate_limit or 1_000_000)
+os.environ["DISCORD_SEND_RATE_LIMIT_PERIOD"] = "5" if args.discord_rate_limit else "1"
+os.environ.setdefault("MAX_CONCURRENT_TURNS", "0")
+# the checkpoint of the working dir before every turn is not part of the event pipeline
+os.environ.setdefault("WORKSPACE_CHECKPOINTS", "0")
+bot = import_bot()
+
+
+def count_stream_events() -> int:
+    if args.stream:
+        with open(args.stream, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    return args.events
+
+
+async def run(channels: list[FakeChannel]) -> tuple[float, float]:
+    """Returns the seconds until all turns finished and until all messages were sent."""
+    set_fake_bot_user(bot)
+    for i, channel in enumerate(channels):
+        spawn_id = f"bench-{i}"
+        working_dir = os.path.join(os.getcwd(), spawn_id)
+        await bot.spawn(FakeContext(channel), spawn_id, working_dir, execution_mode="host", verbosity=args.verbosity)
+        assert spawn_id in bot.spawns, "spawning failed"
+
+    start = time.perf_counter()
+    for i, channel in enumerate(channels):
+        await bot.on_message(make_fake_message(channel, f"bench-{i}", "run the benchmark"))
+    while bot.agent_inboxes or bot.active_turn_spawn_ids or bot.queued_turns:
+        await asyncio.sleep(0.005)
+    turns_seconds = time.perf_counter() - start
+    await wait_until_bot_idle(bot)
+    return turns_seconds, time.perf_counter() - start
+
+
+def main():
+    fake_codex_args = ["--events", str(args.events), "--rate", str(args.rate), "--output-lines", str(args.output_lines), "--markers"]
+    if args.stream:
+        fake_codex_args.extend(["--stream", os.path.abspath(args.stream)])
+    install_fake_codex(*fake_codex_args)
+
+    # one channel per agent, like agents that are talked to in different channels
+    channels = [FakeChannel(i, args.send_latency) for i in range(args.agents)]
+    if args.tracemalloc:
+        tracemalloc.start()
+    turns_seconds, seconds = bot.bot.loop.run_until_complete(run(channels))
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+
+    num_events = count_stream_events() * args.agents
+    latencies = []
+    num_sends = skipped = 0
+    for channel in channels:
+        for send_time, content, _ in channel.sends:
+            num_sends += 1
+            latencies.extend(send_time - float(ts) for ts in MARKER_PATTERN.findall(content))
+            skipped += sum(int(n) for n in SKIPPED_PATTERN.findall(content))
+    num_edits = sum(len(channel.edits) for channel in channels)
+
+    print(
+        f"{args.agents} agent(s) x {num_events // args.agents} events, verbosity={args.verbosity}, "
+        f"rate={'max' if not args.rate else f'{args.rate:g}/s'}, json={bot.codex_event_json_backend}"
+    )
+    print(
+        f"throughput:   {num_events / turns_seconds:>10,.0f} events/s "
+        f"(turns finished after {turns_seconds:.2f}s, all messages sent after {seconds:.2f}s)"
+    )
+    print(f"sends:        {num_sends:>10,} messages, {num_edits:,} edits, {skipped:,} messages skipped")
+    print(
+        f"event->send:  p50 {percentile(latencies, 50) * 1000:>8.1f}ms   p99 {percentile(latencies, 99) * 1000:>8.1f}ms"
+        f"   max {max(latencies, default=float('nan')) * 1000:.1f}ms ({len(latencies):,} events sent)"
+    )
+    memory = f"peak memory:  {get_peak_rss_mb():>10.1f}MB RSS"
+    if traced_peak is not None:
+        memory += f", {traced_peak / 1024 / 1024:.1f}MB peak Python allocations"
+    print(memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Fleet-scale load test of the agent lifecycle: for growing numbers of agents, spawns them all at once with /spawn,
+prompts all of them through on_message, kills their running turns with /kill (kill_impl) and finally tears everything
+down with /delete_all_agents. Runs against a fake docker CLI (fake_docker.py, container state kept in files, `docker
+exec` runs on the host) and a fake codex (fake_codex.py), so neither docker nor codex nor network are needed.
+
+Reports per agent count: spawn time, time to deploy (prompt -> "DEPLOYED" message), time to the first codex event,
+time to kill all turns, teardown time and the bot's RSS with all agents running and after the teardown.
+
+Usage: python bench/bench_fleet.py [--agents 10,50,100,200] [--mode docker] [--docker-latency 0.02]
+                                   [--max-concurrent-turns 0] [--turn-seconds 5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from bench_utils import (
+    FakeChannel,
+    FakeContext,
+    get_rss_mb,
+    import_bot,
+    install_fake_codex,
+    install_fake_docker,
+    make_fake_message,
+    percentile,
+    set_fake_bot_user,
+    wait_until_bot_idle,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", default="10,50,100,200", help="Comma-separated agent counts to test")
+    parser.add_argument("--mode", choices=("docker", "host"), default="docker", help="Execution mode of the agents")
+    parser.add_argument("--docker-latency", type=float, default=0.02, help="Seconds every fake docker command takes")
+    parser.add_argument("--max-concurrent-turns", type=int, default=0, help="MAX_CONCURRENT_TURNS (0 = no limit)")
+    parser.add_argument("--turn-seconds", type=float, default=5, help="How long a turn would run if it was not killed")
+    parser.add_argument("--verbosity", choices=("answers", "verbose", "live"), default="answers")
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["ALLOW_DOCKER_EXECUTION"] = "1" if args.mode == "docker" else "0"
+os.environ["DEFAULT_EXECUTION_MODE"] = args.mode
+os.environ.setdefault("CODEX_DOCKER_IMAGE_NAME", "codexmaster-bench")
+# the fake docker is a CLI, not a daemon with an Engine API socket
+os.environ["DOCKER_ENGINE_API"] = "0"
+os.environ["MAX_CONCURRENT_TURNS"] = str(args.max_concurrent_turns)
+# agents in different channels, so Discord's rate limit does not throttle the fleet
+os.environ.setdefault("DISCORD_SEND_RATE_LIMIT_MESSAGES", "1000000")
+os.environ.setdefault("DISCORD_SEND_RATE_LIMIT_PERIOD", "1")
+bot = import_bot()
+
+# spawn id -> time its first codex event was published
+first_event_times: dict[str, float] = {}
+
+
+def record_first_event(spawn_id: str, event):
+    if not event.type.startswith("codexmaster.") and spawn_id not in first_event_times:
+        first_event_times[spawn_id] = time.perf_counter()
+
+
+async def wait_for(condition, poll_interval: float = 0.005):
+    while not condition():
+        await asyncio.sleep(poll_interval)
+
+
+def format_distribution(values: list[float]) -> str:
+    return f"p50 {percentile(values, 50):6.2f}s p99 {percentile(values, 99):6.2f}s"
+
+
+async def timed(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def run_round(num_agents: int, round_index: int) -> dict:
+    spawn_ids = [f"fleet{round_index}-{i}" for i in range(num_agents)]
+    channels = {spawn_id: FakeChannel(i) for i, spawn_id in enumerate(spawn_ids)}
+    ctx = FakeContext(FakeChannel(-1))
+    result = {}
+
+    # /spawn, all at once
+    start = time.perf_counter()
+    spawn_seconds = await asyncio.gather(*(
+        timed(bot.spawn(FakeContext(channels[spawn_id]), spawn_id, os.path.join(os.getcwd(), spawn_id), execution_mode=args.mode, verbosity=args.verbosity))
+        for spawn_id in spawn_ids
+    ))
+    result["spawn"] = time.perf_counter() - start
+    result["spawn_per_agent"] = spawn_seconds
+    missing = [spawn_id for spawn_id in spawn_ids if spawn_id not in bot.spawns]
+    assert not missing, f"spawning failed for {len(missing)} agent(s), e.g. {missing[0]}: {ctx.responses}"
+
+    # prompt every agent, then wait until every turn is deployed and has produced its first event
+    prompt_times = {}
+    for spawn_id in spawn_ids:
+        prompt_times[spawn_id] = time.perf_counter()
+        await bot.on_message(make_fake_message(channels[spawn_id], spawn_id, "start working"))
+
+    def get_deploy_time(spawn_id: str):
+        for send_time, content, _ in channels[spawn_id].sends:
+            if "DEPLOYED" in content:
+                return send_time
+        return None
+
+    await wait_for(lambda: all(get_deploy_time(spawn_id) is not None for spawn_id in spawn_ids))
+    await wait_for(lambda: all(spawn_id in first_event_times for spawn_id in spawn_ids))
+    # DEPLOYED send times are wall clock times
+    wall_clock_offset = time.time() - time.perf_counter()
+    result["deploy"] = [get_deploy_time(s) - wall_clock_offset - prompt_times[s] for s in spawn_ids]
+    result["first_event"] = [first_event_times[s] - prompt_times[s] for s in spawn_ids]
+    result["rss_running"] = get_rss_mb()
+
+    # /kill every running turn at once (turns that already finished, e.g. because deploying took longer than a turn,
+    # have nothing to kill)
+    num_responses = len(ctx.responses)
+    result["kill"] = await timed(asyncio.gather(*(bot.kill_impl(ctx, spawn_id) for spawn_id in spawn_ids)))
+    result["killed"] = sum(response.startswith("✅ Killed") for response in ctx.responses[num_responses:])
+    await wait_until_bot_idle(bot)
+
+    # /delete_all_agents
+    result["teardown"] = await timed(bot.del_spawns_file(ctx, "CONFIRM"))
+    assert not bot.spawns, "agents left after /delete_all_agents"
+    result["rss_after"] = get_rss_mb()
+    return result
+
+
+async def main():
+    set_fake_bot_user(bot)
+    bot.register_agent_event_sink("fleet_first_event", record_first_event, lossless=True)
+    agent_counts = [int(n) for n in args.agents.split(",")]
+    print(
+        f"mode={args.mode}, docker latency={args.docker_latency}s, "
+        f"MAX_CONCURRENT_TURNS={args.max_concurrent_turns or 'unlimited'}, rss at start={get_rss_mb():.1f}MB"
+    )
+    for round_index, num_agents in enumerate(agent_counts):
+        result = await run_round(num_agents, round_index)
+        print(
+            f"{num_agents:>5} agents | spawn {result['spawn']:6.2f}s ({format_distribution(result['spawn_per_agent'])})"
+            f" | deploy {format_distribution(result['deploy'])}"
+            f" | first event {format_distribution(result['first_event'])}"
+            f" | kill {result['kill']:6.2f}s ({result['killed']} turns) | teardown {result['teardown']:6.2f}s"
+            f" | rss {result['rss_running']:6.1f}MB running, {result['rss_after']:6.1f}MB after"
+        )
+
+
+if __name__ == "__main__":
+    install_fake_docker(tempfile.mkdtemp(prefix="codexmaster-bench-docker-"), args.docker_latency)
+    # a turn that keeps producing events until it is killed
+    install_fake_codex("--events", "1000", "--rate", str(1000 / args.turn_seconds))
+    bot.bot.loop.run_until_complete(main())
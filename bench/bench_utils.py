@@ -0,0 +1,159 @@
+"""Shared helpers for the benchmarks in this directory."""
+import asyncio
+import os
+import shlex
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# The Discord user id of the fake bot (messages to agents start with <@BOT_USER_ID>) and of the fake user
+BOT_USER_ID = 99
+USER_ID = 1
+
+
+def import_bot():
+    """
+    Imports bot.py with a throwaway host-only configuration. The bot keeps state (spawns.json, ~/.codex, checkpoints)
+    relative to the working dir and $HOME, so both point to a fresh temp dir to leave the real installation alone.
+    """
+    bench_dir = tempfile.mkdtemp(prefix="codexmaster-bench-")
+    os.environ["HOME"] = bench_dir
+    os.environ.setdefault("ALLOW_DOCKER_EXECUTION", "0")
+    os.environ.setdefault("ALLOW_HOST_EXECUTION", "1")
+    os.environ.setdefault("DEFAULT_EXECUTION_MODE", "host")
+    os.environ.setdefault("CODEX_ENV_FILE", "")
+    os.environ.setdefault("LOG_LEVEL", "0")
+    os.environ.setdefault("ALLOWED_USER_IDS", str(USER_ID))
+    os.chdir(bench_dir)
+    sys.path.insert(0, REPO_DIR)
+    import bot
+    return bot
+
+
+def time_call(func, *args, repeat: int = 3) -> float:
+    """Best wall time of `repeat` calls, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def install_fake_executable(name: str, script: str, *script_args: str) -> str:
+    """
+    Puts an executable `name` that runs the given script of this directory with the given arguments first on $PATH
+    and returns its dir. The arguments are baked into the executable because host agents only inherit a few env vars.
+    """
+    bin_dir = tempfile.mkdtemp(prefix="codexmaster-bench-bin-")
+    command = [sys.executable, os.path.join(BENCH_DIR, script), *script_args]
+    path = os.path.join(bin_dir, name)
+    with open(path, "w") as f:
+        f.write(f'#!/bin/sh\nexec {shlex.join(command)} "$@"\n')
+    os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    return bin_dir
+
+
+def install_fake_codex(*fake_codex_args: str) -> str:
+    return install_fake_executable("codex", "fake_codex.py", *fake_codex_args)
+
+
+def install_fake_docker(state_dir: str, latency: float = 0.0) -> str:
+    return install_fake_executable("docker", "fake_docker.py", "--state-dir", state_dir, "--latency", str(latency), "--")
+
+
+class FakeSentMessage:
+    def __init__(self, channel: "FakeChannel", content: str):
+        self.channel = channel
+        self.content = content
+        self.id = len(channel.sends)
+
+    async def edit(self, content=None, **kwargs):
+        self.channel.edits.append((time.time(), content or ""))
+        self.content = content
+
+
+class FakeChannel:
+    """Records everything the bot sends, optionally taking `send_latency` seconds per send like a real channel."""
+
+    def __init__(self, channel_id: int = 1, send_latency: float = 0.0):
+        self.id = channel_id
+        self.send_latency = send_latency
+        # (unix time, content, number of files)
+        self.sends: list[tuple[float, str, int]] = []
+        self.edits: list[tuple[float, str]] = []
+
+    async def send(self, content=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sends.append((time.time(), content or "", len(kwargs.get("files") or ())))
+        return FakeSentMessage(self, content or "")
+
+
+class FakeContext:
+    """Enough of a discord.ApplicationContext to call the slash commands directly."""
+
+    def __init__(self, channel: FakeChannel):
+        self.channel = channel
+        self.author = make_fake_user()
+        self.responses: list[str] = []
+
+    async def respond(self, content=None, **kwargs):
+        self.responses.append(content or "")
+
+
+def make_fake_user():
+    return SimpleNamespace(id=USER_ID, name="bench", bot=False, mention=f"<@{USER_ID}>")
+
+
+def make_fake_message(channel: FakeChannel, spawn_id: str, prompt: str):
+    return SimpleNamespace(
+        channel=channel, author=make_fake_user(), content=f"<@{BOT_USER_ID}> to {spawn_id}: {prompt}", attachments=[]
+    )
+
+
+def set_fake_bot_user(bot):
+    """on_message only reacts to messages that mention the bot's user, which is only known once logged in."""
+    bot.bot._connection.user = SimpleNamespace(id=BOT_USER_ID, name="codexmaster")
+
+
+def is_bot_idle(bot) -> bool:
+    """No turn is waiting or running and every message has been sent."""
+    if bot.agent_inboxes or bot.active_turn_spawn_ids or bot.queued_turns:
+        return False
+    return all(
+        not state["items"] and (state["task"] is None or state["task"].done())
+        for state in bot.outbound_channel_queues.values()
+    )
+
+
+async def wait_until_bot_idle(bot, poll_interval: float = 0.005):
+    while not is_bot_idle(bot):
+        await asyncio.sleep(poll_interval)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def get_peak_rss_mb() -> float:
+    import resource
+    # ru_maxrss is in KB on Linux (but bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def get_rss_mb() -> float:
+    """Current RSS (Linux only, falls back to the peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return get_peak_rss_mb()
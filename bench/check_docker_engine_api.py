@@ -0,0 +1,185 @@
+"""
+Checks the Docker Engine API path of the bot (the benchmarks use the docker CLI fallback) against the fake Engine API
+server of fake_docker_engine.py: creating and starting a container (attach before start, waiting for the entrypoint's
+sentinel), exec with the demultiplexing of the hijacked stdout/stderr stream, the Pid and exit code lookups, detaching
+from a running exec, that a slow consumer stops the bot from reading the socket instead of buffering all output, and
+claiming containers from the pool (including the fallback when claiming fails).
+
+Usage: python bench/check_docker_engine_api.py (exits with an error if a check fails)
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from bench_utils import import_bot
+from fake_docker_engine import EXEC_PID, FakeDockerEngine
+
+socket_dir = tempfile.mkdtemp(prefix="codexmaster-bench-engine-")
+os.environ["DOCKER_HOST"] = f"unix://{os.path.join(socket_dir, 'docker.sock')}"
+os.environ["DOCKER_ENGINE_API"] = "1"
+os.environ["ALLOW_DOCKER_EXECUTION"] = "1"
+os.environ.setdefault("CODEX_DOCKER_IMAGE_NAME", "codexmaster-bench")
+os.environ["DOCKER_POOL_SIZE"] = "2"
+os.environ["DOCKER_POOL_WORKSPACES_ROOT"] = os.path.join(socket_dir, "workspaces")
+bot = import_bot()
+
+# Output of the exec in check_exec: a line split across frames, stderr between stdout, and an empty frame
+EXEC_FRAMES = [(1, b'{"type": "turn.star'), (1, b'ted"}\n'), (2, b"warning: something\n"), (1, b""), (1, b"done\n")]
+EXEC_EXIT_CODE = 3
+BACKPRESSURE_OUTPUT_BYTES = 32 * 1024 * 1024
+BACKPRESSURE_FRAME_BYTES = 64 * 1024
+# what may pile up in the socket buffers and the StreamReaders while the consumer does not read
+BACKPRESSURE_MAX_BUFFERED_BYTES = 8 * 1024 * 1024
+
+
+class ExecOutput:
+    """Frames of `size` bytes (forever if size is None), counting what was produced."""
+
+    def __init__(self, size=None):
+        self.size = size
+        self.produced = 0
+
+    async def __aiter__(self):
+        while self.size is None or self.produced < self.size:
+            self.produced += BACKPRESSURE_FRAME_BYTES
+            yield 1, b"x" * (BACKPRESSURE_FRAME_BYTES - 1) + b"\n"
+            # let the loop breathe, like a process writing to a pipe
+            await asyncio.sleep(0)
+
+
+exec_outputs = {}
+
+
+def exec_handler(cmd: list[str]):
+    if cmd[0] == "backpressure":
+        return exec_outputs["backpressure"], 0
+    if cmd[0] == "forever":
+        return exec_outputs["forever"], 0
+    if cmd[:3] == ["sh", "-c", bot.DOCKER_POOL_LINK_SCRIPT]:
+        return [], 0
+    return EXEC_FRAMES, EXEC_EXIT_CODE
+
+
+async def read_all(stream: asyncio.StreamReader) -> bytes:
+    output = bytearray()
+    while chunk := await stream.read(bot.CODEX_EVENT_READ_CHUNK_BYTES):
+        output += chunk
+    return bytes(output)
+
+
+async def check_create_and_start(engine: FakeDockerEngine, working_dir: str):
+    await bot.create_docker_container("bench-container", working_dir, working_dir)
+    container = engine.containers.get("bench-container")
+    assert container is not None, "container was not created"
+    assert f"{working_dir}:{working_dir}" in container["spec"]["HostConfig"]["Binds"], container["spec"]
+    assert container["spec"]["WorkingDir"] == working_dir
+    assert not await bot.docker_api_is_container_running("bench-container")
+
+    await asyncio.wait_for(bot.start_docker_container("bench-container"), 5)
+    assert await bot.docker_api_is_container_running("bench-container")
+    paths = [(method, path) for method, path, _, _ in engine.requests]
+    attach = paths.index(("POST", "/containers/bench-container/attach"))
+    assert attach < paths.index(("POST", "/containers/bench-container/start")), "attached after starting"
+    print("ok: create, attach and start the container, wait for the entrypoint's sentinel")
+
+
+async def check_exec(engine: FakeDockerEngine, working_dir: str):
+    proc = await bot.docker_api_exec("bench-container", ["codex", "exec"], working_dir)
+    assert proc.pid == EXEC_PID, proc.pid
+    output = await asyncio.wait_for(read_all(proc.stdout), 5)
+    assert output == b"".join(data for _, data in EXEC_FRAMES), output
+    assert await asyncio.wait_for(proc.wait(), 5) == EXEC_EXIT_CODE
+    exec_config = next(exec_["config"] for exec_ in engine.execs.values() if exec_["config"]["Cmd"][0] == "codex")
+    assert exec_config["WorkingDir"] == working_dir and exec_config["AttachStdin"], exec_config
+    print("ok: exec demultiplexes stdout and stderr, reports the Pid and the exit code")
+
+    await bot.docker_api_exec("bench-container", ["kill", "-KILL", "--", "-1"], attach=False)
+    assert any(exec_["config"]["Cmd"][0] == "kill" and exec_["exit_code"] == 0 for exec_ in engine.execs.values())
+    print("ok: detached exec")
+
+
+async def check_backpressure():
+    output = exec_outputs["backpressure"] = ExecOutput(BACKPRESSURE_OUTPUT_BYTES)
+    proc = await bot.docker_api_exec("bench-container", ["backpressure"])
+    # a consumer that does not read for a while
+    await asyncio.sleep(1)
+    assert output.produced < BACKPRESSURE_MAX_BUFFERED_BYTES, (
+        f"{output.produced / 1024 / 1024:.1f}MB were read from the socket while nothing was consumed"
+    )
+    buffered = output.produced
+    received = len(await asyncio.wait_for(read_all(proc.stdout), 30))
+    assert received == BACKPRESSURE_OUTPUT_BYTES, received
+    assert await asyncio.wait_for(proc.wait(), 5) == 0
+    print(f"ok: backpressure, {buffered / 1024 / 1024:.1f}MB buffered while the consumer did not read")
+
+
+async def check_kill():
+    exec_outputs["forever"] = ExecOutput()
+    proc = await bot.docker_api_exec("bench-container", ["forever"])
+    await proc.stdout.read(BACKPRESSURE_FRAME_BYTES)
+    # the consumer stops reading and detaches, like on /kill
+    await asyncio.sleep(0.2)
+    proc.kill()
+    start = time.perf_counter()
+    assert await asyncio.wait_for(proc.wait(), 5) == -9
+    print(f"ok: detaching from a running exec, wait() returned after {time.perf_counter() - start:.2f}s")
+
+
+async def wait_for_ready_pool_containers(num_containers: int):
+    bot.refill_docker_pool()
+    while len(bot.docker_pool_ready_containers) < num_containers:
+        await asyncio.sleep(0.01)
+
+
+async def check_pool(engine: FakeDockerEngine):
+    await asyncio.wait_for(wait_for_ready_pool_containers(bot.DOCKER_POOL_SIZE), 5)
+    container_name = bot.docker_pool_ready_containers[0]
+    workspace = bot.get_docker_pool_workspace(container_name)
+    assert engine.containers[container_name]["spec"]["HostConfig"]["Binds"][0] == f"{workspace}:{workspace}"
+
+    working_dir = os.path.join(bot.DOCKER_POOL_WORKSPACES_ROOT, "agent")
+    os.makedirs(working_dir)
+    assert not bot.is_docker_pool_eligible_working_dir(bot.DOCKER_POOL_WORKSPACES_ROOT)
+    assert await bot.claim_docker_pool_container("pool-agent", working_dir), "claiming failed"
+    assert bot.get_docker_container_name("pool-agent") in engine.containers
+    assert os.path.realpath(working_dir) == workspace, "the working dir is not linked to the pool workspace"
+    link_cmd = next(exec_["config"]["Cmd"] for exec_ in engine.execs.values() if exec_["config"]["Cmd"][:1] == ["sh"])
+    assert link_cmd[-2:] == [workspace, working_dir], link_cmd
+    # a working dir with files cannot become the link
+    with open(os.path.join(working_dir, "file"), "w"):
+        pass
+    assert not bot.is_docker_pool_eligible_working_dir(working_dir)
+    print("ok: pool containers mount their own workspace, claiming links the working dir to it")
+
+    # renaming fails because the name is taken: the pool container is removed and a new container has to be created
+    await wait_for_ready_pool_containers(bot.DOCKER_POOL_SIZE)
+    container_name = bot.docker_pool_ready_containers[0]
+    engine.containers[bot.get_docker_container_name("taken")] = {"running": False, "spec": None, "attached": []}
+    assert not await bot.claim_docker_pool_container("taken", os.path.join(bot.DOCKER_POOL_WORKSPACES_ROOT, "taken"))
+    assert container_name not in engine.containers, "the pool container was not removed"
+    assert not os.path.exists(bot.get_docker_pool_workspace(container_name))
+    assert bot.docker_pool_stats["failed_claims"] == 1
+    print("ok: a failed claim removes the pool container and falls back to creating one")
+    await asyncio.wait_for(wait_for_ready_pool_containers(bot.DOCKER_POOL_SIZE), 5)
+
+
+async def main():
+    engine = FakeDockerEngine(bot.get_docker_socket_path(), exec_handler)
+    await engine.start()
+    assert bot.use_docker_engine_api(), "the bot does not use the Engine API"
+    working_dir = os.path.join(os.getcwd(), "workspace")
+    os.makedirs(working_dir)
+    try:
+        await check_create_and_start(engine, working_dir)
+        await check_exec(engine, working_dir)
+        await check_backpressure()
+        await check_kill()
+        await check_pool(engine)
+    finally:
+        await bot.shutdown_docker_containers()
+        await engine.close()
+
+
+if __name__ == "__main__":
+    bot.bot.loop.run_until_complete(main())
@@ -0,0 +1,105 @@
+"""
+Checks that /interrupt reverts the interrupted turn of a docker agent before its messages are re-sent: prompts an agent
+running in a fake docker container (fake_docker.py, whose `docker exec` takes --docker-latency seconds like a real
+daemon, so the turn's codex dies while the kill is still in flight), interrupts the turn once it is running and checks
+that the session file recorded by the fake codex only contains the turns that completed, i.e. every prompt exactly once
+and no partial turn.
+
+Usage: python bench/check_interrupt_revert.py [--rounds 10] [--docker-latency 0.05] (exits with an error if a check fails)
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+
+from bench_utils import (
+    FakeChannel,
+    FakeContext,
+    import_bot,
+    install_fake_codex,
+    install_fake_docker,
+    make_fake_message,
+    set_fake_bot_user,
+    wait_until_bot_idle,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10, help="How many turns to interrupt")
+    parser.add_argument("--docker-latency", type=float, default=0.05, help="Seconds every fake docker command takes")
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["ALLOW_DOCKER_EXECUTION"] = "1"
+os.environ["DEFAULT_EXECUTION_MODE"] = "docker"
+os.environ.setdefault("CODEX_DOCKER_IMAGE_NAME", "codexmaster-bench")
+# the fake docker is a CLI, not a daemon with an Engine API socket
+os.environ["DOCKER_ENGINE_API"] = "0"
+os.environ["MAX_CONCURRENT_TURNS"] = "0"
+bot = import_bot()
+
+SPAWN_ID = "interrupted"
+# where the fake codex records the session, picked up by the bot's session file index
+SESSION_DIR = os.path.join(bot.CODEX_SESSIONS_DIR, "2025", "01", "01")
+
+
+def read_session() -> list[dict]:
+    session_path = os.path.join(SESSION_DIR, os.listdir(SESSION_DIR)[0]) if os.path.isdir(SESSION_DIR) else None
+    if session_path is None:
+        return []
+    with open(session_path, "rb") as f:
+        return [json.loads(line) for line in f]
+
+
+def count_turns(session: list[dict]) -> tuple[int, int]:
+    """Returns how many turns the session contains and how many of them completed."""
+    prompts = sum(event["type"] == "user_message" for event in session)
+    return prompts, sum(event["type"] == "turn.completed" for event in session)
+
+
+async def wait_until_turn_is_running(prompt: str):
+    while True:
+        session = read_session()
+        prompt_indices = [i for i, event in enumerate(session) if event["type"] == "user_message" and prompt in event["text"]]
+        # the prompt and a few events of the turn are recorded
+        if prompt_indices and len(session) - prompt_indices[-1] > 3 and SPAWN_ID in bot.running_turn_messages:
+            return
+        await asyncio.sleep(0.005)
+
+
+async def main():
+    set_fake_bot_user(bot)
+    channel = FakeChannel()
+    ctx = FakeContext(channel)
+    await bot.spawn(ctx, SPAWN_ID, os.path.join(os.getcwd(), SPAWN_ID), execution_mode="docker")
+    assert SPAWN_ID in bot.spawns, f"spawning failed: {ctx.responses}"
+
+    reverted = 0
+    for i in range(args.rounds):
+        await bot.on_message(make_fake_message(channel, SPAWN_ID, f"turn {i}"))
+        await asyncio.wait_for(wait_until_turn_is_running(f"turn {i}"), 10)
+        await bot.interrupt(ctx, SPAWN_ID)
+        assert ctx.responses[-1].startswith("✅ Interrupted"), ctx.responses[-1]
+        # the re-sent turn runs to completion
+        await asyncio.wait_for(wait_until_bot_idle(bot), 30)
+
+        session = read_session()
+        prompts, completed = count_turns(session)
+        texts = [event["text"] for event in session if event["type"] == "user_message"]
+        if prompts == completed == i + 1 and sum(f"turn {i}" in text for text in texts) == 1:
+            reverted += 1
+        else:
+            print(f"round {i}: the session has {prompts} prompt(s) and {completed} completed turn(s) after {i + 1} turn(s)")
+    await bot.del_spawns_file(ctx, "CONFIRM")
+    assert reverted == args.rounds, f"only {reverted} of {args.rounds} interrupted turns were reverted"
+    print(f"ok: {reverted} of {args.rounds} interrupted docker turns were reverted before their messages were re-sent")
+
+
+if __name__ == "__main__":
+    install_fake_docker(tempfile.mkdtemp(prefix="codexmaster-bench-docker-"), args.docker_latency)
+    # turns that run for a second unless they are interrupted
+    install_fake_codex("--events", "50", "--rate", "50", "--session-dir", SESSION_DIR)
+    bot.bot.loop.run_until_complete(main())
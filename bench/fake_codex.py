@@ -0,0 +1,103 @@
+"""
+Stand-in for the codex CLI used by the benchmarks: ignores the `codex exec ...` arguments and writes a recorded or
+synthetic JSONL event stream to stdout, optionally at a fixed rate.
+
+Usage: fake_codex.py [--stream recorded.jsonl] [--events 1000] [--rate 0] [--output-lines 60] [--markers]
+                     [--session-dir DIR] -- <codex args>
+
+With --markers, the text or command of every item gets a `[bench:<unix time>]` prefix with the time the event was
+written, so the benchmark can measure how long it took until a message containing it was sent.
+
+With --session-dir, the prompt (the last codex argument) and every event are also appended to the session file of the
+thread in that dir, like codex records a session, so reverting killed turns can be checked.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+THREAD_ID = "0199a213-81c0-7800-8aa1-bbab2a035a53"
+SESSION_FILENAME = f"rollout-2025-01-01T00-00-00-{THREAD_ID}.jsonl"
+
+
+def generate_events(num_events: int, max_output_lines: int = 60, seed: int = 0) -> list[dict]:
+    """A realistic mix of events: mostly tool calls with their output, some thoughts and a few answers."""
+    rng = random.Random(seed)
+    events = [
+        {"type": "thread.started", "thread_id": THREAD_ID},
+        {"type": "turn.started"},
+    ]
+    while len(events) < num_events:
+        r = rng.random()
+        item_id = f"item_{len(events)}"
+        if r < 0.7:
+            command = f"bash -lc 'rg -n {rng.choice(('TODO', 'def ', 'import'))} src/'"
+            output = "\n".join(f"src/module_{i}.py:{i}: some matching line" for i in range(rng.randint(0, max_output_lines)))
+            events.append({"type": "item.started", "item": {"id": item_id, "type": "command_execution", "command": command, "aggregated_output": "", "status": "in_progress"}})
+            events.append({"type": "item.completed", "item": {"id": item_id, "type": "command_execution", "command": command, "aggregated_output": output, "exit_code": 0, "status": "completed"}})
+        elif r < 0.9:
+            events.append({"type": "item.completed", "item": {"id": item_id, "type": "reasoning", "text": "**Planning** " + "thinking " * rng.randint(5, 80)}})
+        else:
+            events.append({"type": "item.completed", "item": {"id": item_id, "type": "agent_message", "text": "Done. " * rng.randint(5, 200)}})
+    events.append({"type": "turn.completed", "usage": {"input_tokens": 24763, "cached_input_tokens": 24448, "output_tokens": 122}})
+    return events
+
+
+def add_marker(event: dict) -> dict:
+    item = event.get("item")
+    if not isinstance(item, dict):
+        return event
+    marker = f"[bench:{time.time():.6f}] "
+    for key in ("text", "command"):
+        if isinstance(item.get(key), str):
+            return {**event, "item": {**item, key: marker + item[key]}}
+    return event
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", help="Recorded `codex exec --json` output to replay (one event per line)")
+    parser.add_argument("--events", type=int, default=1000, help="Size of the synthetic stream")
+    parser.add_argument("--rate", type=float, default=0, help="Events per second (0 = as fast as possible)")
+    parser.add_argument("--output-lines", type=int, default=60, help="Max. lines of output of a synthetic tool call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--markers", action="store_true", help="Prefix items with the time they were written")
+    parser.add_argument("--session-dir", help="Dir to record the session file in")
+    # everything else are the arguments the bot passes to codex
+    args, codex_args = parser.parse_known_args()
+
+    if args.stream:
+        with open(args.stream, "rb") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = generate_events(args.events, args.output_lines, args.seed)
+
+    session_file = None
+    if args.session_dir:
+        os.makedirs(args.session_dir, exist_ok=True)
+        session_file = open(os.path.join(args.session_dir, SESSION_FILENAME), "ab")
+        session_file.write(json.dumps({"type": "user_message", "text": codex_args[-1]}).encode() + b"\n")
+        session_file.flush()
+
+    out = sys.stdout.buffer
+    start = time.perf_counter()
+    for i, event in enumerate(events):
+        if args.rate:
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if args.markers:
+            event = add_marker(event)
+        line = json.dumps(event).encode() + b"\n"
+        if session_file is not None:
+            session_file.write(line)
+            session_file.flush()
+        out.write(line)
+        # codex writes every event as it happens
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
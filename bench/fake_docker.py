@@ -0,0 +1,134 @@
+"""
+Stand-in for the docker CLI used by the load test: keeps the state of the containers as files in a state dir and runs
+`docker exec` commands directly on the host. Only the commands and flags the bot uses are understood.
+
+Usage: fake_docker.py --state-dir DIR [--latency 0] -- <docker args>
+
+--latency adds that many seconds to every command, like the round trip to a real docker daemon would.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# The bot writes the pid of the running codex process to this path inside the agent's container. All fake containers
+# share the host's /tmp, so every container gets its own pid file instead.
+AGENT_TURN_PID_FILE = "/tmp/codexmaster-turn.pid"
+
+
+def get_container_path(state_dir: str, name: str) -> str:
+    return os.path.join(state_dir, "containers", f"{name}.json")
+
+
+def read_container(state_dir: str, name: str):
+    try:
+        with open(get_container_path(state_dir, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_container(state_dir: str, name: str, container: dict):
+    path = get_container_path(state_dir, name)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(container, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def fail(message: str, exit_code: int = 1):
+    print(f"Error response from daemon: {message}", file=sys.stderr)
+    sys.exit(exit_code)
+
+
+def get_option(args: list[str], name: str):
+    return args[args.index(name) + 1] if name in args else None
+
+
+def docker_exec(state_dir: str, args: list[str]):
+    i = 0
+    working_dir = None
+    while args[i].startswith("-"):
+        if args[i] == "-w":
+            working_dir = args[i + 1]
+            i += 1
+        i += 1
+    name, cmd = args[i], args[i + 1:]
+    container = read_container(state_dir, name)
+    if container is None:
+        fail(f"No such container: {name}")
+    if not container["running"]:
+        fail(f"container {name} is not running")
+    pid_file = os.path.join(state_dir, f"{name}.pid")
+    cmd = [arg.replace(AGENT_TURN_PID_FILE, pid_file) for arg in cmd]
+    if working_dir and os.path.isdir(working_dir):
+        os.chdir(working_dir)
+    os.execvp(cmd[0], cmd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--state-dir", required=True)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("docker_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    state_dir = args.state_dir
+    docker_args = args.docker_args[1:] if args.docker_args[:1] == ["--"] else args.docker_args
+    os.makedirs(os.path.join(state_dir, "containers"), exist_ok=True)
+    if args.latency:
+        time.sleep(args.latency)
+
+    command, rest = docker_args[0], docker_args[1:]
+    if command == "create":
+        name = get_option(rest, "--name")
+        if read_container(state_dir, name) is not None:
+            fail(f'Conflict. The container name "/{name}" is already in use')
+        write_container(state_dir, name, {"running": False, "working_dir": get_option(rest, "-w")})
+    elif command == "start":
+        name = rest[-1]
+        container = read_container(state_dir, name)
+        if container is None:
+            fail(f"No such container: {name}")
+        write_container(state_dir, name, {**container, "running": True})
+        # what the entrypoint of the agent image prints once the firewall is set up
+        print("[==== DONE ====]", flush=True)
+    elif command == "stop":
+        name = rest[-1]
+        container = read_container(state_dir, name)
+        if container is not None:
+            write_container(state_dir, name, {**container, "running": False})
+    elif command == "rm":
+        for name in (arg for arg in rest if not arg.startswith("-")):
+            try:
+                os.remove(get_container_path(state_dir, name))
+            except FileNotFoundError:
+                fail(f"No such container: {name}")
+    elif command == "rename":
+        old_name, new_name = rest
+        container = read_container(state_dir, old_name)
+        if container is None:
+            fail(f"No such container: {old_name}")
+        os.replace(get_container_path(state_dir, old_name), get_container_path(state_dir, new_name))
+    elif command == "inspect":
+        container = read_container(state_dir, rest[-1])
+        if container is None:
+            fail(f"No such object: {rest[-1]}")
+        print("true" if container["running"] else "false")
+    elif command == "ps":
+        name_filter = (get_option(rest, "--filter") or "name=").partition("=")[2]
+        for filename in sorted(os.listdir(os.path.join(state_dir, "containers"))):
+            name = filename[:-len(".json")] if filename.endswith(".json") else None
+            container = read_container(state_dir, name) if name is not None and name_filter in name else None
+            if container is not None:
+                print(f"{name}\t{'running' if container['running'] else 'exited'}")
+    elif command == "exec":
+        docker_exec(state_dir, rest)
+    elif command in ("run", "volume"):
+        # maintenance containers and cache volumes have nothing to do here
+        pass
+    else:
+        fail(f"fake docker does not support `docker {command}`")
+
+
+if __name__ == "__main__":
+    main()
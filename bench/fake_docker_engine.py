@@ -0,0 +1,221 @@
+"""
+Stand-in for the Docker Engine API on a unix socket, for exercising the bot's Engine API path without a docker daemon.
+Speaks just enough HTTP/1.1 for aiohttp's requests and for the hijacked (upgraded) connections of attach and exec
+start, and keeps the containers and execs in memory. Only the endpoints the bot uses are understood.
+
+The output of an exec is produced by `exec_handler(cmd)`, which returns the frames to send as (stream, data) tuples
+(stream 1 = stdout, 2 = stderr) and the exit code. The frames may be an async iterable, for output that is produced
+over time; the exec keeps running if the client detaches before it is exhausted.
+
+Usage: fake_docker_engine.py SOCKET_PATH (serves until interrupted; execs echo their command)
+"""
+import asyncio
+import itertools
+import json
+import re
+import sys
+import urllib.parse
+
+# What the entrypoint of the agent image prints once the firewall is set up
+ENTRYPOINT_OUTPUT = [b"Applying firewall rules...\n", b"[==== DO", b"NE ====]\n"]
+EXEC_PID = 4242
+
+
+def frame(data: bytes, stream: int = 1) -> bytes:
+    """A frame of a multiplexed stdout/stderr stream: stream type, 3 zero bytes, big endian payload size, payload."""
+    return bytes([stream, 0, 0, 0]) + len(data).to_bytes(4, "big") + data
+
+
+def echo_exec_handler(cmd: list[str]):
+    return [(1, " ".join(cmd).encode("utf-8") + b"\n")], 0
+
+
+class FakeDockerEngine:
+    def __init__(self, socket_path: str, exec_handler=echo_exec_handler):
+        self.socket_path = socket_path
+        self.exec_handler = exec_handler
+        self.containers: dict[str, dict] = {}
+        self.execs: dict[str, dict] = {}
+        # every request as (method, path, query params, json body)
+        self.requests: list[tuple] = []
+        self._ids = itertools.count(1)
+        self._server = None
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle_connection, self.socket_path)
+
+    async def close(self):
+        self._server.close()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while request := await self._read_request(reader):
+                if await self._handle_request(writer, *request):
+                    # the connection was hijacked and is done
+                    return
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            del self._connections[task]
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while (header_line := await reader.readline()) not in (b"\r\n", b""):
+            key, _, value = header_line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        body = b""
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            while size := int((await reader.readline()).strip(), 16):
+                body += (await reader.readexactly(size + 2))[:-2]
+            await reader.readline()
+        url = urllib.parse.urlsplit(target)
+        # API version prefix, e.g. /v1.43/containers/json
+        path = re.sub(r"^/v[\d.]+(?=/)", "", url.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        data = json.loads(body) if body else None
+        self.requests.append((method, path, params, data))
+        return method, path, params, data
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: int, obj=None):
+        payload = json.dumps(obj).encode("utf-8") if obj is not None else b""
+        writer.write(
+            f"HTTP/1.1 {status} Fake\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+
+    @staticmethod
+    def _upgrade(writer: asyncio.StreamWriter):
+        writer.write(
+            b"HTTP/1.1 101 UPGRADED\r\nContent-Type: application/vnd.docker.multiplexed-stream\r\n"
+            b"Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n"
+        )
+
+    def _get_container(self, writer: asyncio.StreamWriter, name: str):
+        container = self.containers.get(name)
+        if container is None:
+            self._respond(writer, 404, {"message": f"No such container: {name}"})
+        return container
+
+    async def _handle_request(self, writer: asyncio.StreamWriter, method: str, path: str, params: dict, data) -> bool:
+        """Returns whether the connection was hijacked."""
+        if path == "/containers/create":
+            if params["name"] in self.containers:
+                self._respond(writer, 409, {"message": f'Conflict. The container name "/{params["name"]}" is already in use'})
+                return False
+            self.containers[params["name"]] = {"running": False, "spec": data, "attached": []}
+            self._respond(writer, 201, {"Id": params["name"]})
+        elif path == "/containers/json":
+            name_filters = json.loads(params.get("filters", "{}")).get("name", [])
+            self._respond(writer, 200, [
+                {"Names": [f"/{name}"], "State": "running" if container["running"] else "exited"}
+                for name, container in self.containers.items()
+                if all(re.search(name_filter, name) for name_filter in name_filters)
+            ])
+        elif m := re.fullmatch(r"/containers/([^/]+)/attach", path):
+            if (container := self._get_container(writer, m[1])) is None:
+                return False
+            self._upgrade(writer)
+            await writer.drain()
+            container["attached"].append(writer)
+            # the output of the entrypoint is written by /start; keep the connection until the client closes it
+            await writer.wait_closed()
+            return True
+        elif m := re.fullmatch(r"/containers/([^/]+)/start", path):
+            if (container := self._get_container(writer, m[1])) is None:
+                return False
+            container["running"] = True
+            self._respond(writer, 204)
+            for attached_writer in container["attached"]:
+                attached_writer.write(b"".join(frame(data) for data in ENTRYPOINT_OUTPUT))
+        elif m := re.fullmatch(r"/containers/([^/]+)/stop", path):
+            if (container := self._get_container(writer, m[1])) is None:
+                return False
+            container["running"] = False
+            self._respond(writer, 204)
+        elif m := re.fullmatch(r"/containers/([^/]+)/rename", path):
+            if self._get_container(writer, m[1]) is None:
+                return False
+            if params["name"] in self.containers:
+                self._respond(writer, 409, {"message": f'Conflict. The container name "/{params["name"]}" is already in use'})
+                return False
+            self.containers[params["name"]] = self.containers.pop(m[1])
+            self._respond(writer, 204)
+        elif m := re.fullmatch(r"/containers/([^/]+)/json", path):
+            if (container := self._get_container(writer, m[1])) is None:
+                return False
+            self._respond(writer, 200, {"State": {"Running": container["running"]}})
+        elif (m := re.fullmatch(r"/containers/([^/]+)", path)) and method == "DELETE":
+            if self.containers.pop(m[1], None) is None:
+                self._respond(writer, 404, {"message": f"No such container: {m[1]}"})
+                return False
+            self._respond(writer, 204)
+        elif m := re.fullmatch(r"/containers/([^/]+)/exec", path):
+            if (container := self._get_container(writer, m[1])) is None:
+                return False
+            if not container["running"]:
+                self._respond(writer, 409, {"message": f"Container {m[1]} is not running"})
+                return False
+            exec_id = f"exec{next(self._ids)}"
+            self.execs[exec_id] = {"container": m[1], "config": data, "running": False, "exit_code": None}
+            self._respond(writer, 201, {"Id": exec_id})
+        elif m := re.fullmatch(r"/exec/([^/]+)/start", path):
+            exec_ = self.execs[m[1]]
+            exec_["running"] = True
+            if data.get("Detach"):
+                self._respond(writer, 200)
+                exec_["running"] = False
+                exec_["exit_code"] = 0
+                return False
+            self._upgrade(writer)
+            await self._run_exec(writer, exec_)
+            return True
+        elif m := re.fullmatch(r"/exec/([^/]+)/json", path):
+            exec_ = self.execs[m[1]]
+            self._respond(writer, 200, {"Pid": EXEC_PID, "Running": exec_["running"], "ExitCode": exec_["exit_code"]})
+        else:
+            self._respond(writer, 404, {"message": f"fake docker engine does not support {method} {path}"})
+        return False
+
+    async def _run_exec(self, writer: asyncio.StreamWriter, exec_: dict):
+        frames, exit_code = self.exec_handler(exec_["config"]["Cmd"])
+        try:
+            if hasattr(frames, "__aiter__"):
+                async for stream, data in frames:
+                    if writer.is_closing():
+                        # the client detached, the process keeps running
+                        return
+                    writer.write(frame(data, stream))
+                    await writer.drain()
+            else:
+                for stream, data in frames:
+                    writer.write(frame(data, stream))
+                    await writer.drain()
+        except ConnectionError:
+            return
+        exec_["running"] = False
+        exec_["exit_code"] = exit_code
+
+async def main(socket_path: str):
+    engine = FakeDockerEngine(socket_path)
+    await engine.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1]))
@@ -3,22 +3,39 @@ import re
 import json
 import ast
 import asyncio
+import atexit
+import bisect
+import collections
+import cProfile
 import sys
+import time
 import traceback
 import datetime
 import getpass
+import inspect
+import gzip
+import io
+import logging
+import logging.handlers
+import marshal
+import pstats
+import queue
+import random
 import functools
+import shutil
 import string
-import glob
+import threading
+import uuid
+import zlib
 import aiohttp
 import aiofiles
+from aiohttp import web
 
 import discord
 from discord import option
 from discord.ext import commands
 from dotenv import load_dotenv, dotenv_values
 from typing import Optional, Callable, Awaitable
-from copy import deepcopy
 from werkzeug.utils import secure_filename
 from werkzeug.security import safe_join
 
@@ -30,10 +47,83 @@ VALID_SPAWN_ID_CHARS_REGEX_ENUM = string.ascii_letters + string.digits + "\\-_"
 # Only allow these Discord user IDs to interact with the bot.
 # You can list them in the ALLOWED_USER_IDS env var (comma-separated).
 allowed_ids_env = os.getenv("ALLOWED_USER_IDS", "")
+# 0: no logs, 1: logs, 2: also log every raw event line of the codex processes
 LOG_LEVEL = int(os.getenv("LOG_LEVEL", 0))
+# text (the message, prefixed with its agent/turn/event fields) or json (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+assert LOG_FORMAT in ("text", "json")
+# Fraction of the log lines of a category that is kept, e.g. "raw_event=0.05,entrypoint=0.5" (unlisted = 1)
+LOG_SAMPLE_RATES: dict[str, float] = {}
+for log_sample_rate in os.getenv("LOG_SAMPLE_RATES", "").split(","):
+    if log_sample_rate.strip():
+        log_sample_rate_category, _, log_sample_rate_value = log_sample_rate.strip().partition("=")
+        LOG_SAMPLE_RATES[log_sample_rate_category.strip()] = float(log_sample_rate_value)
+        assert 0 <= LOG_SAMPLE_RATES[log_sample_rate_category.strip()] <= 1
+# JSON library used to decode the codex event stream: auto (orjson or msgspec if installed, else json), orjson, msgspec
+# or json
+CODEX_EVENT_JSON_BACKEND = os.getenv("CODEX_EVENT_JSON_BACKEND", "auto").strip().lower()
+assert CODEX_EVENT_JSON_BACKEND in ("auto", "msgspec", "orjson", "json")
+# Codex event lines longer than this are not held in memory: they are streamed to a file in CODEX_EVENT_SPILL_DIR
+# (if set) and replaced by a truncated version of the event
+CODEX_EVENT_MAX_LINE_BYTES = int(os.getenv("CODEX_EVENT_MAX_LINE_BYTES", 2 * 1024 * 1024))
+CODEX_EVENT_SPILL_DIR = os.getenv("CODEX_EVENT_SPILL_DIR", "event_spills").strip()
+CODEX_EVENT_SPILL_DIR = os.path.abspath(os.path.expanduser(CODEX_EVENT_SPILL_DIR)) if CODEX_EVENT_SPILL_DIR else None
+CODEX_EVENT_READ_CHUNK_BYTES = 64 * 1024
+# How much of an oversized event is kept to build its truncated version from
+CODEX_EVENT_TRUNCATED_HEAD_BYTES = 64 * 1024
+assert CODEX_EVENT_MAX_LINE_BYTES >= CODEX_EVENT_TRUNCATED_HEAD_BYTES
+# Size of the event queue of each subscriber of an agent's event bus. Lossy subscribers (e.g. the Discord notifications)
+# drop events when their queue is full instead of stalling the reading of the codex output.
+AGENT_EVENT_QUEUE_SIZE = int(os.getenv("AGENT_EVENT_QUEUE_SIZE", 1000))
+assert AGENT_EVENT_QUEUE_SIZE >= 1
+# Archive of all codex events per agent (one gzip member per turn plus a turn -> offset index), used by /replay.
+# Blank = no archive.
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR", "event_archive").strip()
+EVENT_ARCHIVE_DIR = os.path.abspath(os.path.expanduser(EVENT_ARCHIVE_DIR)) if EVENT_ARCHIVE_DIR else None
+# The token usage of every turn is recorded in a ledger per agent and day here, see /usage. Blank = no ledger.
+USAGE_LEDGER_DIR = os.getenv("USAGE_LEDGER_DIR", "usage_ledger").strip()
+USAGE_LEDGER_DIR = os.path.abspath(os.path.expanduser(USAGE_LEDGER_DIR)) if USAGE_LEDGER_DIR else None
+# USD per 1M input/cached input/output tokens per model for the cost estimates of /usage,
+# e.g. "gpt-5=1.25/0.125/10,gpt-5-mini=0.25/0.025/2" (use "default" for agents with model=default)
+MODEL_PRICES: dict[str, tuple[float, float, float]] = {}
+for model_price in os.getenv("MODEL_PRICES", "").split(","):
+    if model_price.strip():
+        model_price_name, _, model_price_values = model_price.strip().partition("=")
+        model_price_values = tuple(float(p) for p in model_price_values.split("/"))
+        assert model_price_name and len(model_price_values) == 3
+        MODEL_PRICES[model_price_name.strip()] = model_price_values
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics (0 = disabled). Only bind to a public
+# interface if you have to, the metrics contain the spawn IDs.
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
 ALLOWED_USER_IDS = {int(u) for u in allowed_ids_env.split(",") if u.strip()}
+# Users that may run admin commands like /profile (comma-separated, must also be in ALLOWED_USER_IDS)
+ADMIN_USER_IDS = {int(u) for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+# A heartbeat task checks every LOOP_LAG_CHECK_INTERVAL seconds how late it runs (0 = disabled). When the event loop is
+# blocked for more than LOOP_LAG_STALL_THRESHOLD seconds, the stall is logged with the stack of the blocking code.
+LOOP_LAG_CHECK_INTERVAL = float(os.getenv("LOOP_LAG_CHECK_INTERVAL", 0.1))
+LOOP_LAG_STALL_THRESHOLD = float(os.getenv("LOOP_LAG_STALL_THRESHOLD", 0.5))
+assert LOOP_LAG_CHECK_INTERVAL >= 0 and LOOP_LAG_STALL_THRESHOLD > 0
+PROFILE_MAX_SECONDS = 300
 
 DISCORD_CHARACTER_LIMIT = 1950
+# Agent notifications are sent through one queue per channel: small adjacent messages are merged (up to the character
+# limit), at most DISCORD_SEND_RATE_LIMIT_MESSAGES messages are sent per DISCORD_SEND_RATE_LIMIT_PERIOD seconds and
+# channel, and once more than DISCORD_SEND_QUEUE_MAX_MESSAGES are waiting, the oldest thoughts and tool calls are
+# dropped and summarized.
+DISCORD_SEND_RATE_LIMIT_MESSAGES = int(os.getenv("DISCORD_SEND_RATE_LIMIT_MESSAGES", 5))
+DISCORD_SEND_RATE_LIMIT_PERIOD = float(os.getenv("DISCORD_SEND_RATE_LIMIT_PERIOD", 5.0))
+DISCORD_SEND_QUEUE_MAX_MESSAGES = int(os.getenv("DISCORD_SEND_QUEUE_MAX_MESSAGES", 50))
+assert DISCORD_SEND_RATE_LIMIT_MESSAGES >= 1 and DISCORD_SEND_RATE_LIMIT_PERIOD > 0
+# At least one message stays queued, which the summary of the dropped ones is sent with
+assert DISCORD_SEND_QUEUE_MAX_MESSAGES >= 1
+# Notifications longer than this many characters are sent as one message with a head/tail preview (of
+# DISCORD_SPILL_PREVIEW_CHARS characters each) and the full text as a file attachment, which is gzip-compressed if it
+# is larger than DISCORD_SPILL_GZIP_THRESHOLD_BYTES. 0 disables spilling (long messages are split into many messages).
+DISCORD_SPILL_THRESHOLD_CHARS = int(os.getenv("DISCORD_SPILL_THRESHOLD_CHARS", 8000))
+DISCORD_SPILL_PREVIEW_CHARS = int(os.getenv("DISCORD_SPILL_PREVIEW_CHARS", 700))
+DISCORD_SPILL_GZIP_THRESHOLD_BYTES = int(os.getenv("DISCORD_SPILL_GZIP_THRESHOLD_BYTES", 1024 * 1024))
+assert DISCORD_SPILL_PREVIEW_CHARS * 2 < DISCORD_CHARACTER_LIMIT - 200
 
 ALLOWED_PROVIDERS = list(map(str.strip, os.getenv("ALLOWED_PROVIDERS", "openai").split(',')))
 DEFAULT_WORKING_DIR = os.path.expanduser(os.getenv("DEFAULT_WORKING_DIR", os.getcwd()))
@@ -42,9 +132,14 @@ DEFAULT_PROVIDER = os.getenv("DEFAULT_PROVIDER", "openai").strip()
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-5.3-codex").strip()
 DEFAULT_AGENT_VERBOSITY = os.getenv("DEFAULT_AGENT_VERBOSITY", "answers").strip().lower()
 VALID_REASONING_EFFORTS = ("default", "none", "minimal", "low", "medium", "high", "xhigh")
+# answers: responses + token usage, verbose: also every thought and tool call,
+# live: responses + one status message per turn that is edited in place (current tool, elapsed time, tokens)
+VALID_AGENT_VERBOSITIES = ("answers", "verbose", "live")
 DEFAULT_REASONING_EFFORT = os.getenv("DEFAULT_REASONING_EFFORT", "default").strip().lower()
 assert DEFAULT_PROVIDER in ALLOWED_PROVIDERS
-assert DEFAULT_AGENT_VERBOSITY in ("answers", "verbose")
+assert DEFAULT_AGENT_VERBOSITY in VALID_AGENT_VERBOSITIES
+# How often (in seconds) the status message of a turn is edited at most in live verbosity mode
+LIVE_STATUS_EDIT_INTERVAL = float(os.getenv("LIVE_STATUS_EDIT_INTERVAL", 3.0))
 assert DEFAULT_REASONING_EFFORT in VALID_REASONING_EFFORTS
 
 ALLOW_DOCKER_EXECUTION = int(int(os.getenv("ALLOW_DOCKER_EXECUTION", 1)))
@@ -65,9 +160,61 @@ assert CODEX_ENV_FILE is None or os.path.exists(CODEX_ENV_FILE)
 
 ALLOW_LEAK_ENV = int(os.getenv("ALLOW_LEAK_ENV", False))
 
+# Per-turn checkpoints of the Codex session and the working dir (used by /rewind)
+# Off by default: the first checkpoint copies the whole working dir into git objects, and every turn waits for its
+# snapshot before it starts
+WORKSPACE_CHECKPOINTS = int(os.getenv("WORKSPACE_CHECKPOINTS", 0))
+WORKSPACE_CHECKPOINTS_DIR = os.path.abspath(os.path.expanduser(os.getenv("WORKSPACE_CHECKPOINTS_DIR", "checkpoints")))
+MAX_CHECKPOINTS_PER_AGENT = int(os.getenv("MAX_CHECKPOINTS_PER_AGENT", 20))
+assert MAX_CHECKPOINTS_PER_AGENT >= 1
+
+# Agent persistence: a snapshot plus an append-only journal of changed agents that gets compacted periodically
+SPAWNS_FILE = "spawns.json"
+SPAWNS_JOURNAL_FILE = "spawns.journal.jsonl"
+SPAWNS_JOURNAL_COMPACTION_THRESHOLD = int(os.getenv("SPAWNS_JOURNAL_COMPACTION_THRESHOLD", 1000))
+SPAWNS_JOURNAL_FSYNC = int(os.getenv("SPAWNS_JOURNAL_FSYNC", False))
+
+# Talk to the Docker Engine API over its unix socket instead of forking the docker CLI (which is the fallback if
+# this is disabled or no socket is found). The socket is taken from DOCKER_HOST=unix://..., the rootless socket or
+# /var/run/docker.sock.
+DOCKER_ENGINE_API = int(os.getenv("DOCKER_ENGINE_API", 1))
+# Containers are kept running between turns and only stopped after being idle for this many seconds
+DOCKER_CONTAINER_IDLE_TIMEOUT = float(os.getenv("DOCKER_CONTAINER_IDLE_TIMEOUT", 600))
+# Pool of pre-created, already started containers that /spawn can claim. Every pool container only mounts its own
+# workspace below DOCKER_POOL_WORKSPACES_ROOT, which becomes the agent's working dir when it is claimed, so only agents
+# with a new (empty) working dir below it can use the pool.
+DOCKER_POOL_SIZE = int(os.getenv("DOCKER_POOL_SIZE", 0))
+DOCKER_POOL_REFILL_CONCURRENCY = int(os.getenv("DOCKER_POOL_REFILL_CONCURRENCY", 2))
+DOCKER_POOL_WORKSPACES_ROOT = (os.getenv("DOCKER_POOL_WORKSPACES_ROOT") or "").strip() or None
+if DOCKER_POOL_WORKSPACES_ROOT is not None:
+    DOCKER_POOL_WORKSPACES_ROOT = os.path.abspath(os.path.expanduser(DOCKER_POOL_WORKSPACES_ROOT))
+    assert ':' not in DOCKER_POOL_WORKSPACES_ROOT
+assert not DOCKER_POOL_SIZE or (ALLOW_DOCKER_EXECUTION and DOCKER_POOL_WORKSPACES_ROOT is not None)
+assert DOCKER_POOL_REFILL_CONCURRENCY >= 1
+# Named volumes for package caches that are shared by all agent containers, e.g. "pip,npm:20,cargo,apt"
+# (pip, npm, cargo and apt are supported, optionally with a size cap in GB that overrides the default one).
+# When a volume grows above its cap, the least recently accessed files are evicted every DOCKER_CACHE_PRUNE_INTERVAL seconds.
+DOCKER_CACHE_VOLUME_MAX_SIZE_GB = float(os.getenv("DOCKER_CACHE_VOLUME_MAX_SIZE_GB", 10.0))
+DOCKER_CACHE_VOLUMES: dict[str, float] = {}
+for docker_cache_volume in os.getenv("DOCKER_CACHE_VOLUMES", "").split(","):
+    if docker_cache_volume.strip():
+        docker_cache_volume_name, _, docker_cache_volume_max_size_gb = docker_cache_volume.strip().partition(":")
+        assert docker_cache_volume_name in ("pip", "npm", "cargo", "apt")
+        DOCKER_CACHE_VOLUMES[docker_cache_volume_name] = float(docker_cache_volume_max_size_gb or DOCKER_CACHE_VOLUME_MAX_SIZE_GB)
+DOCKER_CACHE_PRUNE_INTERVAL = float(os.getenv("DOCKER_CACHE_PRUNE_INTERVAL", 3600))
+# How many containers are stopped/removed/created concurrently by bulk operations (startup, /delete_all_agents, shutdown)
+DOCKER_BULK_PARALLELISM = int(os.getenv("DOCKER_BULK_PARALLELISM", 8))
+assert DOCKER_BULK_PARALLELISM >= 1
+# Inside the agent container, the pid (= process group id) of the running codex process is written here
+AGENT_TURN_PID_FILE = "/tmp/codexmaster-turn.pid"
+
 # performance settings
 MAX_CPU_USAGE = float(os.getenv("MAX_CPU_USAGE", 1.0))
 MAX_RAM_USAGE_GB = float(os.getenv("MAX_RAM_USAGE_GB", 4.0))
+# How many agent turns may run at the same time (over all agents), further turns are queued. 0 = no limit.
+# Independently of this, every agent only ever runs one turn at a time.
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", 4))
+assert MAX_CONCURRENT_TURNS >= 0
 
 DISCORD_RESPONSE_NO_REFERENCE_USER_COMMAND = int(os.getenv("DISCORD_RESPONSE_NO_REFERENCE_USER_COMMAND", False))
 DISCORD_LONG_RESPONSE_BULK_AS_CODEBLOCK = int(os.getenv("DISCORD_LONG_RESPONSE_BULK_AS_CODEBLOCK", False))
@@ -83,6 +230,61 @@ ATTACH_DIRECTIVE_PATTERN = re.compile(
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="", intents=intents)
 
+# Structured fields that can be passed to log()
+LOG_FIELDS = ("agent", "turn", "event_type", "category")
+
+
+class LogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        fields = {name: getattr(record, name) for name in LOG_FIELDS if getattr(record, name, None) is not None}
+        if LOG_FORMAT == "json":
+            return json.dumps({
+                "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "level": record.levelname.lower(),
+                "message": message,
+                **fields,
+            }, default=str)
+        if record.levelno >= logging.WARNING:
+            message = f"{record.levelname}: {message}"
+        if fields:
+            message = "[" + " ".join(f"{name}={value}" for name, value in fields.items()) + "] " + message
+        return message
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler, don't format here: str() of the arguments (e.g. whole codex events) and the write to
+        # stderr both happen on the listener thread instead of the event loop
+        return record
+
+
+# log() only puts records into a queue, a background thread formats them and writes them to stderr
+logger = logging.getLogger("codexmaster")
+logger.propagate = False
+logger.setLevel(logging.DEBUG if LOG_LEVEL else logging.CRITICAL + 1)
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_stream_handler = logging.StreamHandler(sys.stderr)
+log_stream_handler.setFormatter(LogFormatter())
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler)
+if LOG_LEVEL:
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    log_listener.start()
+    # flushes the queue on exit
+    atexit.register(log_listener.stop)
+
+
+def log(*args, level: int = logging.INFO, category: Optional[str] = None, **fields):
+    """
+    Logs the arguments like print() would, with optional structured fields (agent, turn, event_type). Lines of a
+    category are sampled according to LOG_SAMPLE_RATES.
+    """
+    if not LOG_LEVEL:
+        return
+    if category is not None and random.random() >= LOG_SAMPLE_RATES.get(category, 1.0):
+        return
+    logger.log(level, " ".join(["%s"] * len(args)), *args, extra={"category": category, **fields})
+
 
 # Mapping of spawn IDs to channel, user, and active processes
 spawns: dict[str, dict] = {}
@@ -137,8 +339,8 @@ def normalize_persisted_spawn(spawn_id: str, entry: dict) -> dict:
         raise ValueError("reasoning_effort must be a string")
 
     normalized_verbosity = str(entry["verbosity"]).strip().lower()
-    if normalized_verbosity not in ("answers", "verbose"):
-        raise ValueError("verbosity must be 'answers' or 'verbose'")
+    if normalized_verbosity not in VALID_AGENT_VERBOSITIES:
+        raise ValueError("verbosity must be one of " + ", ".join(VALID_AGENT_VERBOSITIES))
     normalized_reasoning_effort = str(entry["reasoning_effort"]).strip().lower()
     if normalized_reasoning_effort not in VALID_REASONING_EFFORTS:
         raise ValueError(
@@ -153,6 +355,10 @@ def normalize_persisted_spawn(spawn_id: str, entry: dict) -> dict:
     chat_message_count = entry.get("chat_message_count", 0)
     if isinstance(chat_message_count, bool) or not isinstance(chat_message_count, int) or chat_message_count < 0:
         raise ValueError("chat_message_count must be a non-negative integer")
+    checkpoints = entry.get("checkpoints", [])
+    if not isinstance(checkpoints, list) or not all(isinstance(c, dict) for c in checkpoints):
+        raise ValueError("checkpoints must be a list of objects")
+    checkpoints = checkpoints[-MAX_CHECKPOINTS_PER_AGENT:]
 
     # Persisted files should not contain live process handles; ensure we start empty.
     entry["processes"] = []
@@ -162,47 +368,153 @@ def normalize_persisted_spawn(spawn_id: str, entry: dict) -> dict:
     entry["model"] = entry["model"].strip()
     entry["leak_env"] = bool(entry["leak_env"])
     entry["chat_message_count"] = chat_message_count
+    entry["checkpoints"] = checkpoints
     return entry
 
 
-try:
-    with open("spawns.json") as f:
-        loaded_spawns = json.load(f)
-        if not isinstance(loaded_spawns, dict):
-            raise ValueError("spawns.json root must be an object")
-        invalid_spawn_ids = []
-        for spawn_id, entry in loaded_spawns.items():
-            try:
-                spawns[spawn_id] = normalize_persisted_spawn(spawn_id, entry)
-            except Exception as e:
-                invalid_spawn_ids.append((spawn_id, str(e)))
-        for spawn_id, reason in invalid_spawn_ids:
-            if LOG_LEVEL:
-                print(
-                    f"Dropping incompatible agent '{spawn_id}' from spawns.json: {reason}",
-                    file=sys.stderr,
-                )
-except json.JSONDecodeError:
-    spawns = {}
-except ValueError:
-    spawns = {}
-except FileNotFoundError:
-    pass
+def read_persisted_spawns_snapshot() -> dict:
+    try:
+        with open(SPAWNS_FILE) as f:
+            loaded_spawns = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(loaded_spawns, dict):
+        return {}
+    return loaded_spawns
+
+
+def replay_spawns_journal(loaded_spawns: dict) -> int:
+    """Applies the journal records on top of the snapshot. Returns the number of applied records."""
+    try:
+        with open(SPAWNS_JOURNAL_FILE, encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return 0
+
+    applied = 0
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # A torn record (crash mid-append) is only ever the last line; everything before it is intact.
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get("spawn_id"), str):
+            continue
+        op = record.get("op")
+        previous = loaded_spawns.get(record["spawn_id"])
+        previous_checkpoints = previous.get("checkpoints") if isinstance(previous, dict) else None
+        if op == "put":
+            entry = record.get("entry")
+            # The checkpoints are journaled on their own (see save_spawn_checkpoint)
+            if isinstance(entry, dict) and "checkpoints" not in entry:
+                entry["checkpoints"] = previous_checkpoints if isinstance(previous_checkpoints, list) else []
+            loaded_spawns[record["spawn_id"]] = entry
+        elif op == "delete":
+            loaded_spawns.pop(record["spawn_id"], None)
+        elif op == "add_checkpoint" and isinstance(previous_checkpoints, list):
+            previous_checkpoints.append(record.get("checkpoint"))
+            del previous_checkpoints[:-MAX_CHECKPOINTS_PER_AGENT]
+        elif op == "drop_checkpoints" and isinstance(previous_checkpoints, list):
+            count = record.get("count")
+            if isinstance(count, int) and count > 0:
+                del previous_checkpoints[-count:]
+        else:
+            continue
+        applied += 1
+    return applied
 
-# Used by the kill command to communicate to the process reader that the process was killed and
-# that the process reader should not save the aborted session updates to the session file (i.e. revert)
-newly_killed_procs = []
+
+def load_persisted_spawns() -> tuple[dict[str, dict], int]:
+    loaded_spawns = read_persisted_spawns_snapshot()
+    num_journal_records = replay_spawns_journal(loaded_spawns)
+    result = {}
+    invalid_spawn_ids = []
+    for spawn_id, entry in loaded_spawns.items():
+        try:
+            result[spawn_id] = normalize_persisted_spawn(spawn_id, entry)
+        except Exception as e:
+            invalid_spawn_ids.append((spawn_id, str(e)))
+    for spawn_id, reason in invalid_spawn_ids:
+        log(f"Dropping incompatible agent '{spawn_id}' from {SPAWNS_FILE}: {reason}", level=logging.WARNING)
+    return result, num_journal_records
+
+
+persisted_spawns, spawns_journal_record_count = load_persisted_spawns()
+spawns.update(persisted_spawns)
+
+# Lazily created HTTP session for the Docker Engine API
+docker_api_session: Optional[aiohttp.ClientSession] = None
+
+# Docker containers that are started (warm), their pending idle stops, and locks that serialize starting/stopping them
+running_agent_docker_containers: set[str] = set()
+agent_docker_container_idle_stop_tasks: dict[str, asyncio.Task] = {}
+agent_docker_container_locks: dict[str, asyncio.Lock] = {}
+
+# Started pool containers that are ready to be claimed, and stats about the pool
+docker_pool_ready_containers: list[str] = []
+docker_pool_refill_semaphore = asyncio.Semaphore(DOCKER_POOL_REFILL_CONCURRENCY)
+docker_pool_refill_tasks: set[asyncio.Task] = set()
+docker_pool_stats = {
+    "claims": 0,
+    "misses": 0,
+    "failed_claims": 0,
+    "refills_in_flight": 0,
+    "last_claim_seconds": None,
+    "total_claim_seconds": 0.0,
+}
+
+# Whether the persisted agents have been matched against the existing containers (done once, on startup)
+docker_containers_reconciled = False
+
+# Admission control: the agents that currently run a turn, and the turns waiting for a slot in FIFO order
+# (dicts with spawn_id, enqueue_time and a future that resolves to whether the turn was admitted or dropped)
+active_turn_spawn_ids: set[str] = set()
+queued_turns: list[dict] = []
+
+# Per-agent inboxes of messages ({"message", "prompt"}) that are waiting for the next turn of the agent and get merged
+# into a single prompt, and the messages of the turns whose codex process is currently running (see /interrupt)
+agent_inboxes: dict[str, list[dict]] = {}
+running_turn_messages: dict[str, list[dict]] = {}
+
+# Event bus per agent, and the sinks that subscribe to the bus of every agent (see register_agent_event_sink)
+agent_event_buses: dict[str, "AgentEventBus"] = {}
+agent_event_sinks: list[dict] = []
+
+# Running ref pruning + gc of the checkpoint repo per agent, and checkpoints dropped since its last gc
+# (see prune_workspace_checkpoints)
+workspace_checkpoints_prune_tasks: dict[str, asyncio.Task] = {}
+workspace_checkpoints_dropped_counts: dict[str, int] = {}
+
+# Open archive files per agent, only used by the archive writer thread (see archive_agent_event)
+event_archive_writers: dict[str, dict] = {}
+event_archive_queue: queue.SimpleQueue = queue.SimpleQueue()
+event_archive_writer_thread: Optional[threading.Thread] = None
+
+# Start time, model and provider of the running turn per agent (see record_turn_usage)
+usage_ledger_turns: dict[str, dict] = {}
+
+# Outbound message queue, rate limit bucket and sender task per Discord channel id
+outbound_channel_queues: dict[int, dict] = {}
 
 instructions = "You are Codex, a highly autonomous AI coding agent that lives in the terminal. You help users by completing tasks they assign you, e.g. writing, testing or debugging code or doing research for them."
 
 DOT_CODEX_DIR = os.path.expanduser("~/.codex")
 os.makedirs(DOT_CODEX_DIR, exist_ok=True)
 os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
-
-
-def log(*args, **kwargs):
-    if LOG_LEVEL:
-        print(*args, **kwargs, file=sys.stderr)
+CODEX_SESSION_CHECKPOINTS_DIR = os.path.join(DOT_CODEX_DIR, "codexmaster-checkpoints")
+os.makedirs(CODEX_SESSION_CHECKPOINTS_DIR, exist_ok=True)
+
+# Index of Codex session files (session id -> path), kept up to date by re-listing only the directories whose
+# mtime changed. Persisted so that a restart does not have to walk the whole sessions tree again.
+CODEX_SESSIONS_DIR = os.path.join(DOT_CODEX_DIR, "sessions")
+CODEX_SESSION_INDEX_FILE = "codex_session_index.json"
+CODEX_SESSION_FILENAME_ID_PATTERN = re.compile(
+    r"([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})\.jsonl$"
+)
+codex_session_file_index: dict[str, str] = {}
+codex_session_index_dirs: dict[str, dict] = {}
 
 
 def log_command_usage(func):
@@ -216,9 +528,9 @@ def log_command_usage(func):
 
 def notify_on_internal_error(func):
     @functools.wraps(func)
-    async def wrapper(message: discord.Message):
+    async def wrapper(message: discord.Message, *args, **kwargs):
         try:
-            return await func(message)
+            return await func(message, *args, **kwargs)
         except Exception:
             await message.channel.send("Internal error", reference=message)
             raise
@@ -226,32 +538,318 @@ def notify_on_internal_error(func):
     return wrapper
 
 
+# Metric name -> {"type", "help", "label_names", "values"}, where values maps a tuple of label values to the value
+# (or, for histograms, to a dict with the per-bucket counts, sum and count)
+metrics: dict[str, dict] = {}
+METRIC_HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 600.0)
+
+# The aiohttp runner of the metrics endpoint (None = not started)
+metrics_server_runner: Optional[web.AppRunner] = None
+
+
+def define_metric(name: str, metric_type: str, help_text: str, label_names: tuple[str, ...] = ()):
+    assert metric_type in ("counter", "gauge", "histogram")
+    metrics[name] = {"type": metric_type, "help": help_text, "label_names": label_names, "values": {}}
+
+
+def inc_metric(name: str, *label_values: str, value: float = 1):
+    if not METRICS_PORT:
+        return
+    values = metrics[name]["values"]
+    values[label_values] = values.get(label_values, 0) + value
+
+
+def set_metric(name: str, value: float, *label_values: str):
+    if not METRICS_PORT:
+        return
+    metrics[name]["values"][label_values] = value
+
+
+def observe_metric(name: str, value: float, *label_values: str):
+    if not METRICS_PORT:
+        return
+    values = metrics[name]["values"]
+    histogram = values.get(label_values)
+    if histogram is None:
+        histogram = values[label_values] = {"buckets": [0] * len(METRIC_HISTOGRAM_BUCKETS), "sum": 0.0, "count": 0}
+    bucket = bisect.bisect_left(METRIC_HISTOGRAM_BUCKETS, value)
+    if bucket < len(METRIC_HISTOGRAM_BUCKETS):
+        histogram["buckets"][bucket] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+
+def get_agent_metric_labels(spawn_id: str) -> tuple[str, str]:
+    entry = spawns.get(spawn_id)
+    return spawn_id, entry["execution_mode"] if entry is not None else "unknown"
+
+
+def delete_agent_metrics(spawn_id: str):
+    """Drops the label series of a deleted agent, so agents that come and go do not pile up series."""
+    for metric in metrics.values():
+        if metric["label_names"][:1] == ("agent",):
+            for label_values in [label_values for label_values in metric["values"] if label_values[0] == spawn_id]:
+                del metric["values"][label_values]
+
+
+def format_metric_labels(label_names: tuple[str, ...], label_values: tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in label_values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped)) + "}"
+
+
+define_metric("codexmaster_launch_agent_seconds", "histogram", "Time to start the codex process of a turn (including starting the container)", ("agent", "mode"))
+define_metric("codexmaster_docker_container_start_seconds", "histogram", "Time to start a stopped agent container", ("agent", "mode"))
+define_metric("codexmaster_turn_queue_wait_seconds", "histogram", "Time turns waited for admission", ("agent", "mode"))
+define_metric("codexmaster_turn_first_event_seconds", "histogram", "Time from launching a turn to its first codex event", ("agent", "mode"))
+define_metric("codexmaster_turn_seconds", "histogram", "Time from launching a turn until its codex process exited", ("agent", "mode"))
+define_metric("codexmaster_turns_total", "counter", "Finished turns", ("agent", "mode", "outcome"))
+define_metric("codexmaster_codex_events_total", "counter", "Codex events read", ("agent", "mode"))
+define_metric("codexmaster_codex_event_bytes_total", "counter", "Bytes of codex events read", ("agent", "mode"))
+define_metric("codexmaster_send_notification_seconds", "histogram", "Time spent formatting and queueing a notification", ("agent", "mode"))
+define_metric("codexmaster_discord_send_seconds", "histogram", "Latency of sending a message to Discord")
+define_metric("codexmaster_discord_send_errors_total", "counter", "Messages that could not be sent to Discord")
+define_metric("codexmaster_discord_messages_dropped_total", "counter", "Droppable messages dropped because a channel's send queue was full")
+define_metric("codexmaster_save_spawns_seconds", "histogram", "Time to write the spawns.json snapshot")
+define_metric("codexmaster_spawns_journal_append_seconds", "histogram", "Time to append a record to the spawns journal")
+define_metric("codexmaster_agents", "gauge", "Agents")
+define_metric("codexmaster_active_turns", "gauge", "Turns that are running")
+define_metric("codexmaster_queued_turns", "gauge", "Turns waiting for admission")
+define_metric("codexmaster_discord_send_queue_depth", "gauge", "Messages waiting to be sent to Discord (all channels)")
+define_metric("codexmaster_running_docker_containers", "gauge", "Started agent containers")
+define_metric("codexmaster_docker_pool_ready_containers", "gauge", "Pool containers ready to be claimed")
+define_metric("codexmaster_docker_pool_refills_in_flight", "gauge", "Pool containers being created")
+define_metric("codexmaster_docker_pool_claims_total", "counter", "Pool containers claimed by agents")
+define_metric("codexmaster_docker_pool_misses_total", "counter", "Pool claims that found the pool empty")
+define_metric("codexmaster_docker_pool_claim_seconds", "histogram", "Time to claim a pool container (the time to deploy of a pool hit)")
+define_metric("codexmaster_docker_pool_failed_claims_total", "counter", "Pool containers that could not be claimed and were removed")
+
+
+def update_state_metrics():
+    """Metrics that mirror the bot's state are taken when they are scraped."""
+    set_metric("codexmaster_agents", len(spawns))
+    set_metric("codexmaster_active_turns", len(active_turn_spawn_ids))
+    set_metric("codexmaster_queued_turns", len(queued_turns))
+    set_metric("codexmaster_discord_send_queue_depth", sum(len(state["items"]) for state in outbound_channel_queues.values()))
+    set_metric("codexmaster_running_docker_containers", len(running_agent_docker_containers))
+    set_metric("codexmaster_docker_pool_ready_containers", len(docker_pool_ready_containers))
+    set_metric("codexmaster_docker_pool_refills_in_flight", docker_pool_stats["refills_in_flight"])
+    set_metric("codexmaster_docker_pool_claims_total", docker_pool_stats["claims"])
+    set_metric("codexmaster_docker_pool_misses_total", docker_pool_stats["misses"])
+    set_metric("codexmaster_docker_pool_failed_claims_total", docker_pool_stats["failed_claims"])
+
+
+def render_metrics() -> str:
+    """The metrics in the Prometheus text exposition format."""
+    update_state_metrics()
+    lines = []
+    for name, metric in metrics.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        label_names = metric["label_names"]
+        for label_values, value in metric["values"].items():
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{format_metric_labels(label_names, label_values)} {value}")
+                continue
+            cumulative_count = 0
+            for bound, count in zip(METRIC_HISTOGRAM_BUCKETS, value["buckets"]):
+                cumulative_count += count
+                labels = format_metric_labels(label_names + ("le",), label_values + (str(bound),))
+                lines.append(f"{name}_bucket{labels} {cumulative_count}")
+            labels = format_metric_labels(label_names + ("le",), label_values + ("+Inf",))
+            lines.append(f"{name}_bucket{labels} {value['count']}")
+            labels = format_metric_labels(label_names, label_values)
+            lines.append(f"{name}_sum{labels} {value['sum']}")
+            lines.append(f"{name}_count{labels} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics_request(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server():
+    global metrics_server_runner
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics_request)
+    metrics_server_runner = web.AppRunner(app, access_log=None)
+    await metrics_server_runner.setup()
+    await web.TCPSite(metrics_server_runner, METRICS_HOST, METRICS_PORT).start()
+    log(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+# Loop lag monitor: the last heartbeat of the event loop, the stack of the loop thread sampled by the watchdog thread
+# during a stall (as (heartbeat time, stack)), and the most recent stalls ({"time", "seconds", "stack"})
+loop_heartbeat_time = time.monotonic()
+loop_stall_sample: Optional[tuple[float, str]] = None
+loop_stalls: collections.deque = collections.deque(maxlen=100)
+loop_lag_watchdog_thread: Optional[threading.Thread] = None
+
+# The profiler of the running /profile command
+active_profiler: Optional[cProfile.Profile] = None
+
+define_metric("codexmaster_event_loop_lag_seconds", "histogram", "How late the event loop heartbeat ran")
+
+
+def run_loop_lag_watchdog(loop_thread_id: int):
+    """Runs in its own thread: samples the stack of the loop thread once the loop missed its heartbeat for too long."""
+    global loop_stall_sample
+    while True:
+        time.sleep(LOOP_LAG_CHECK_INTERVAL)
+        heartbeat_time = loop_heartbeat_time
+        if time.monotonic() - heartbeat_time < LOOP_LAG_STALL_THRESHOLD:
+            continue
+        if loop_stall_sample is not None and loop_stall_sample[0] == heartbeat_time:
+            # already sampled this stall
+            continue
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is not None:
+            loop_stall_sample = (heartbeat_time, "".join(traceback.format_stack(frame)))
+
+
+async def run_loop_heartbeat():
+    global loop_heartbeat_time, loop_stall_sample
+    while True:
+        loop_heartbeat_time = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_CHECK_INTERVAL)
+        lag = max(0.0, time.monotonic() - loop_heartbeat_time - LOOP_LAG_CHECK_INTERVAL)
+        observe_metric("codexmaster_event_loop_lag_seconds", lag)
+        if lag < LOOP_LAG_STALL_THRESHOLD:
+            continue
+        sample = loop_stall_sample
+        stack = sample[1] if sample is not None and sample[0] == loop_heartbeat_time else None
+        loop_stall_sample = None
+        loop_stalls.append({
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "seconds": lag,
+            "stack": stack,
+        })
+        log(f"Event loop was blocked for {lag:.3f}s, in:\n{stack or '(no stack sampled)'}", level=logging.WARNING)
+
+
+def start_loop_lag_monitor():
+    global loop_lag_watchdog_thread
+    # must be called on the loop thread
+    loop_lag_watchdog_thread = threading.Thread(
+        target=run_loop_lag_watchdog, args=(threading.get_ident(),), name="loop-lag-watchdog", daemon=True
+    )
+    loop_lag_watchdog_thread.start()
+    bot.loop.create_task(run_loop_heartbeat())
+
+
+def format_loop_stalls(stalls: list[dict]) -> str:
+    return "\n".join(
+        f"{stall['time']}: blocked for {stall['seconds']:.3f}s\n{stall['stack'] or '(no stack sampled)'}"
+        for stall in stalls
+    )
+
+
+def serialize_spawn(spawn: dict) -> dict:
+    # the live process handles, channel and user cannot be saved
+    return {
+        **spawn,
+        "processes": [],
+        "channel": None,
+        "user": None,
+    }
+
+
+def write_file_atomically(path: str, content: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 def save_spawns():
+    """Compacts the journal: atomically writes a full snapshot of all agents and truncates the journal."""
+    global spawns_journal_record_count
     log("Saving spawns")
-    spawns_to_save = {}
-    for spawn_id, spawn in spawns.items():
-        # temporarily remove the stuff that cannot be saved (and also not deepcopy'd)
-        procs, chan, user = spawn['processes'], spawn['channel'], spawn['user']
-        spawn['processes'] = []
-        spawn['channel'] = None
-        spawn['user'] = None
+    start_time = time.perf_counter()
+    spawns_to_save = {spawn_id: serialize_spawn(spawn) for spawn_id, spawn in spawns.items()}
+    write_file_atomically(SPAWNS_FILE, json.dumps(spawns_to_save))
+    with open(SPAWNS_JOURNAL_FILE, "w"):
+        pass
+    spawns_journal_record_count = 0
+    observe_metric("codexmaster_save_spawns_seconds", time.perf_counter() - start_time)
+
+
+def append_spawns_journal_record(record: dict):
+    global spawns_journal_record_count
+    # A single O_APPEND write per record, so a crash can at most tear the last line (which replay skips).
+    start_time = time.perf_counter()
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    with open(SPAWNS_JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write(line)
+        f.flush()
+        if SPAWNS_JOURNAL_FSYNC:
+            os.fsync(f.fileno())
+    spawns_journal_record_count += 1
+    observe_metric("codexmaster_spawns_journal_append_seconds", time.perf_counter() - start_time)
+    if spawns_journal_record_count >= SPAWNS_JOURNAL_COMPACTION_THRESHOLD:
+        save_spawns()
+
+
+def save_spawn(spawn_id: str):
+    """Persists only the given agent by appending its new state to the journal."""
+    if spawn_id not in spawns:
+        # the agent was deleted in the meantime
+        return
+    log(f"Saving spawn {spawn_id}")
+    # the checkpoints only change once per turn, so they are journaled on their own instead of with every put
+    entry = {k: v for k, v in serialize_spawn(spawns[spawn_id]).items() if k != "checkpoints"}
+    append_spawns_journal_record({"op": "put", "spawn_id": spawn_id, "entry": entry})
 
-        spawns_to_save[spawn_id] = deepcopy(spawn)
 
-        # restore spawn attributes
-        spawn['processes'] = procs
-        spawn['channel'] = chan
-        spawn['user'] = user
+def save_spawn_checkpoint(spawn_id: str, checkpoint: dict):
+    """Journals a new checkpoint of the agent (replaying it drops the oldest ones beyond MAX_CHECKPOINTS_PER_AGENT)."""
+    append_spawns_journal_record({"op": "add_checkpoint", "spawn_id": spawn_id, "checkpoint": checkpoint})
 
-    with open("spawns.json", "w") as f:
-        json.dump(spawns_to_save, f)
+
+def save_dropped_spawn_checkpoints(spawn_id: str, count: int):
+    """Journals that the agent's last `count` checkpoints were removed."""
+    append_spawns_journal_record({"op": "drop_checkpoints", "spawn_id": spawn_id, "count": count})
+
+
+def delete_saved_spawn(spawn_id: str):
+    log(f"Deleting saved spawn {spawn_id}")
+    append_spawns_journal_record({"op": "delete", "spawn_id": spawn_id})
+
+
+def delete_saved_spawns_files():
+    global spawns_journal_record_count
+    for path in (SPAWNS_FILE, SPAWNS_JOURNAL_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    spawns_journal_record_count = 0
+
+
+# Fold whatever the previous run journaled into a fresh snapshot (this also drops a torn trailing record)
+if os.path.exists(SPAWNS_JOURNAL_FILE) and os.path.getsize(SPAWNS_JOURNAL_FILE):
+    save_spawns()
 
 
 @bot.event
 async def on_ready():
     """Called when the bot is ready and connected to Discord."""
+    global docker_containers_reconciled
     log(f"Logged in as {bot.user} (ID: {bot.user.id})")
     log("------")
+    # on_ready fires again after reconnects
+    if ALLOW_DOCKER_EXECUTION and not docker_containers_reconciled:
+        docker_containers_reconciled = True
+        await reconcile_docker_containers()
+        if DOCKER_POOL_SIZE:
+            refill_docker_pool()
+        if DOCKER_CACHE_VOLUMES:
+            bot.loop.create_task(prune_docker_cache_volumes_periodically())
+    if METRICS_PORT and metrics_server_runner is None:
+        await start_metrics_server()
+    if LOOP_LAG_CHECK_INTERVAL and loop_lag_watchdog_thread is None:
+        start_loop_lag_monitor()
 
 
 # Global pre-check: only allow listed users to run slash commands
@@ -284,36 +882,429 @@ async def hello(
     await ctx.respond(greeting)
 
 
+def load_codex_session_index():
+    try:
+        with open(CODEX_SESSION_INDEX_FILE) as f:
+            loaded = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if not isinstance(loaded, dict) or not isinstance(loaded.get("dirs"), dict):
+        return
+    for dir_path, dir_entry in loaded["dirs"].items():
+        if not isinstance(dir_entry, dict):
+            continue
+        mtime, subdirs, files = dir_entry.get("mtime"), dir_entry.get("subdirs"), dir_entry.get("files")
+        if not isinstance(mtime, (int, float)) or not isinstance(subdirs, list) or not isinstance(files, dict):
+            continue
+        codex_session_index_dirs[dir_path] = dir_entry
+        for session_id, path in files.items():
+            index_codex_session_file(session_id, path)
+
+
+def save_codex_session_index():
+    write_file_atomically(CODEX_SESSION_INDEX_FILE, json.dumps({"dirs": codex_session_index_dirs}))
+
+
+def index_codex_session_file(session_id: str, path: str):
+    prev_path = codex_session_file_index.get(session_id)
+    if prev_path is not None and prev_path != path:
+        # Same session id in multiple files; prefer the most recently modified one (like the previous glob-based lookup)
+        try:
+            if os.path.getmtime(prev_path) >= os.path.getmtime(path):
+                return
+        except OSError:
+            pass
+    codex_session_file_index[session_id] = path
+
+
+def scan_codex_session_dir(dir_path: str) -> bool:
+    """
+    Incrementally re-indexes the directory tree under dir_path. Only directories whose mtime changed since
+    the last scan get listed, so a refresh costs one stat per directory instead of a walk over all files.
+    Returns whether the index changed.
+    """
+    try:
+        mtime = os.stat(dir_path).st_mtime
+    except OSError:
+        dir_entry = codex_session_index_dirs.pop(dir_path, None)
+        if dir_entry is None:
+            return False
+        for session_id, path in dir_entry["files"].items():
+            if codex_session_file_index.get(session_id) == path:
+                del codex_session_file_index[session_id]
+        for subdir in dir_entry["subdirs"]:
+            scan_codex_session_dir(subdir)
+        return True
+
+    changed = False
+    dir_entry = codex_session_index_dirs.get(dir_path)
+    if dir_entry is None or dir_entry["mtime"] != mtime:
+        changed = True
+        subdirs = []
+        files = {}
+        try:
+            with os.scandir(dir_path) as it:
+                for dirent in it:
+                    if dirent.is_dir(follow_symlinks=False):
+                        subdirs.append(dirent.path)
+                    elif dirent.name.endswith(".jsonl"):
+                        match = CODEX_SESSION_FILENAME_ID_PATTERN.search(dirent.name)
+                        session_id = match.group(1) if match else dirent.name[:-len(".jsonl")]
+                        files[session_id] = dirent.path
+        except OSError:
+            log(traceback.format_exc(), level=logging.ERROR)
+            return False
+
+        if dir_entry is not None:
+            for session_id, path in dir_entry["files"].items():
+                if session_id not in files and codex_session_file_index.get(session_id) == path:
+                    del codex_session_file_index[session_id]
+            for subdir in dir_entry["subdirs"]:
+                if subdir not in subdirs:
+                    scan_codex_session_dir(subdir)
+        for session_id, path in files.items():
+            index_codex_session_file(session_id, path)
+        if time.time() - mtime < 2:
+            # "Racy" mtime: entries could still be added within the same timestamp granularity, so rescan next time
+            mtime = -1
+        dir_entry = {"mtime": mtime, "subdirs": subdirs, "files": files}
+        codex_session_index_dirs[dir_path] = dir_entry
+
+    for subdir in dir_entry["subdirs"]:
+        changed = scan_codex_session_dir(subdir) or changed
+    return changed
+
+
+def refresh_codex_session_file_index():
+    if scan_codex_session_dir(CODEX_SESSIONS_DIR):
+        save_codex_session_index()
+
+
 def find_codex_session_file_path(session_id: Optional[str]) -> Optional[str]:
     if not session_id:
         return None
-    pattern = os.path.join(DOT_CODEX_DIR, "sessions", "**", f"*{session_id}*.jsonl")
-    matches = glob.glob(pattern, recursive=True)
+    path = codex_session_file_index.get(session_id)
+    if path is not None and os.path.exists(path):
+        return path
+    refresh_codex_session_file_index()
+    path = codex_session_file_index.get(session_id)
+    if path is not None:
+        return path
+    # Session ids that are not part of the file name's id suffix (matches the old `*{session_id}*.jsonl` glob)
+    matches = [
+        p for p in codex_session_file_index.values()
+        if session_id in os.path.basename(p)
+    ]
     if not matches:
         return None
     matches.sort(key=lambda p: os.path.getmtime(p), reverse=True)
     return matches[0]
 
 
-def read_text_file(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+load_codex_session_index()
 
 
-def restore_codex_session_file(session_id: Optional[str], previous_content: Optional[str]) -> bool:
+def create_codex_session_checkpoint(session_id: Optional[str]) -> Optional[dict]:
+    """
+    Records the state of the session file at the start of a turn. Session files are append-only, so the byte
+    length and inode are enough to undo a turn. A hardlink to the inode is kept as whole-file fallback in case
+    the file gets rewritten (replaced by a new inode) during the turn. Returns None if there is no session file yet.
+    """
     path = find_codex_session_file_path(session_id)
-    if previous_content is None:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    backup_path = os.path.join(CODEX_SESSION_CHECKPOINTS_DIR, f"{session_id}-{st.st_ino}.jsonl")
+    if not os.path.exists(backup_path):
+        try:
+            os.link(path, backup_path)
+        except OSError:
+            # e.g. hardlinks not permitted; fall back to a full copy on disk (still keeps it out of memory)
+            try:
+                shutil.copyfile(path, backup_path)
+            except OSError:
+                log(traceback.format_exc(), level=logging.ERROR)
+                backup_path = None
+    return {"path": path, "size": st.st_size, "inode": st.st_ino, "backup_path": backup_path}
+
+
+def release_codex_session_checkpoint(checkpoint: Optional[dict]):
+    if checkpoint is None or checkpoint["backup_path"] is None:
+        return
+    try:
+        os.remove(checkpoint["backup_path"])
+    except FileNotFoundError:
+        pass
+
+
+def restore_codex_session_file(session_id: Optional[str], checkpoint: Optional[dict]) -> bool:
+    if checkpoint is None:
+        # The session did not exist before the turn, so remove it entirely
+        path = find_codex_session_file_path(session_id)
         if path and os.path.exists(path):
             os.remove(path)
             return True
         return False
-    if path is None:
+
+    path, size = checkpoint["path"], checkpoint["size"]
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if st is not None and st.st_ino == checkpoint["inode"]:
+        if st.st_size >= size:
+            os.truncate(path, size)
+            return True
+        # Truncating would extend the file with zeros, so only a backup that is a copy (not a link to this inode,
+        # which shrank as well) can restore it
+        log(f"Session file {path} shrank below its checkpoint ({st.st_size} < {size} bytes)", level=logging.WARNING)
+
+    # The file was rewritten, removed or shrank, so restore it from the whole-file backup
+    backup_path = checkpoint["backup_path"]
+    try:
+        backup_size = os.path.getsize(backup_path) if backup_path is not None else -1
+    except FileNotFoundError:
+        backup_size = -1
+    if backup_size < size:
         return False
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(previous_content)
+    tmp_path = f"{path}.restore.tmp"
+    try:
+        os.link(backup_path, tmp_path)
+    except OSError:
+        shutil.copyfile(backup_path, tmp_path)
+    os.truncate(tmp_path, size)
+    os.replace(tmp_path, path)
     return True
 
 
+def release_unreferenced_codex_session_checkpoints(dropped_checkpoints: list[dict], kept_checkpoints: list[dict]):
+    # Multiple turn checkpoints can share the same backup link (same session file inode)
+    kept_backup_paths = {c["session"]["backup_path"] for c in kept_checkpoints if c["session"] is not None}
+    for checkpoint in dropped_checkpoints:
+        session_checkpoint = checkpoint["session"]
+        if session_checkpoint is not None and session_checkpoint["backup_path"] not in kept_backup_paths:
+            release_codex_session_checkpoint(session_checkpoint)
+
+
+def get_workspace_checkpoints_git_dir(spawn_id: str) -> str:
+    return os.path.join(WORKSPACE_CHECKPOINTS_DIR, f"{spawn_id}.git")
+
+
+async def run_workspace_checkpoints_git(spawn_id: str, working_dir: Optional[str], *args) -> str:
+    """Runs git on the agent's working dir, but with a separate git dir (and index) owned by the bot."""
+    git_args = [
+        "git",
+        "-c", "safe.directory=*",
+        "-c", "core.autocrlf=false",
+        "--git-dir", get_workspace_checkpoints_git_dir(spawn_id),
+    ]
+    if working_dir is not None:
+        git_args.extend(["--work-tree", working_dir])
+    git_args.extend(args)
+    proc = await asyncio.create_subprocess_exec(
+        *git_args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={
+            **os.environ,
+            "GIT_AUTHOR_NAME": "CodexMaster",
+            "GIT_AUTHOR_EMAIL": "codexmaster@localhost",
+            "GIT_COMMITTER_NAME": "CodexMaster",
+            "GIT_COMMITTER_EMAIL": "codexmaster@localhost",
+        },
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(
+            f"`{' '.join(git_args)}` failed with exit code {proc.returncode}: "
+            + stderr.decode("utf-8", errors="replace").strip()
+        )
+    return stdout.decode("utf-8", errors="replace").strip()
+
+
+def write_workspace_checkpoints_excludes(spawn_id: str, working_dir: str):
+    """
+    Keeps the bot's own state out of the snapshots of a working dir that contains it (e.g. an agent working in the
+    directory the bot runs in), most importantly the checkpoint repos themselves, which would otherwise snapshot
+    themselves on every turn and be overwritten by /rewind.
+    """
+    working_dir = os.path.realpath(working_dir)
+    bot_state_paths = [
+        WORKSPACE_CHECKPOINTS_DIR,
+        SPAWNS_FILE,
+        f"{SPAWNS_FILE}.tmp",
+        SPAWNS_JOURNAL_FILE,
+        CODEX_SESSION_INDEX_FILE,
+        f"{CODEX_SESSION_INDEX_FILE}.tmp",
+        DOT_CODEX_DIR,
+        CODEX_EVENT_SPILL_DIR,
+        EVENT_ARCHIVE_DIR,
+        USAGE_LEDGER_DIR,
+    ]
+    patterns = []
+    for path in bot_state_paths:
+        if path is None:
+            continue
+        path = os.path.realpath(path)
+        if path != working_dir and os.path.commonpath([working_dir, path]) == working_dir:
+            patterns.append("/" + os.path.relpath(path, working_dir).replace(os.sep, "/"))
+    info_dir = os.path.join(get_workspace_checkpoints_git_dir(spawn_id), "info")
+    os.makedirs(info_dir, exist_ok=True)
+    with open(os.path.join(info_dir, "exclude"), "w") as f:
+        f.write("".join(f"{pattern}\n" for pattern in patterns))
+
+
+def get_workspace_checkpoint_ref(commit: str) -> str:
+    return f"refs/checkpoints/{commit}"
+
+
+async def wait_for_workspace_checkpoints_prune(spawn_id: str):
+    # gc --prune=now would delete the objects of a snapshot that is being written and not referenced yet
+    task = workspace_checkpoints_prune_tasks.get(spawn_id)
+    if task is not None:
+        await asyncio.wait([task])
+
+
+async def create_workspace_checkpoint(spawn_id: str, working_dir: str) -> Optional[str]:
+    """
+    Snapshots the working dir into the agent's checkpoint repo and returns the commit id. Only files whose stat
+    info changed since the last snapshot get hashed, and git only stores new blobs, so a checkpoint costs
+    roughly O(changed files). Files ignored by the working dir's .gitignore are not checkpointed.
+    """
+    if not WORKSPACE_CHECKPOINTS:
+        return None
+    git_dir = get_workspace_checkpoints_git_dir(spawn_id)
+    try:
+        await wait_for_workspace_checkpoints_prune(spawn_id)
+        if not os.path.exists(git_dir):
+            os.makedirs(WORKSPACE_CHECKPOINTS_DIR, exist_ok=True)
+            await run_workspace_checkpoints_git(spawn_id, None, "init", "-q", "--bare")
+        write_workspace_checkpoints_excludes(spawn_id, working_dir)
+        await run_workspace_checkpoints_git(spawn_id, working_dir, "add", "-A")
+        tree = await run_workspace_checkpoints_git(spawn_id, working_dir, "write-tree")
+        # No parent: every checkpoint has its own ref, so the ones that are dropped become unreachable and get pruned
+        commit = await run_workspace_checkpoints_git(spawn_id, working_dir, "commit-tree", tree, "-m", f"checkpoint of {spawn_id}")
+        await run_workspace_checkpoints_git(spawn_id, working_dir, "update-ref", get_workspace_checkpoint_ref(commit), commit)
+        return commit
+    except Exception:
+        log(traceback.format_exc(), level=logging.ERROR)
+        return None
+
+
+async def prune_workspace_checkpoints(entry: dict):
+    """
+    Makes the refs of the agent's checkpoint repo match its retained checkpoints and, once MAX_CHECKPOINTS_PER_AGENT
+    checkpoints were dropped, runs git gc to delete what only the dropped ones referenced.
+    """
+    spawn_id = entry["spawn_id"]
+    if not os.path.exists(get_workspace_checkpoints_git_dir(spawn_id)):
+        return
+    kept_commits = {c["workspace_commit"] for c in entry["checkpoints"] if c["workspace_commit"] is not None}
+    # refs/heads: the parent chain of checkpoints created by older versions, which kept all of them reachable
+    refs = await run_workspace_checkpoints_git(
+        spawn_id, None, "for-each-ref", "--format=%(refname)", "refs/checkpoints", "refs/heads"
+    )
+    referenced_commits = set()
+    dropped_count = 0
+    for ref in refs.splitlines():
+        commit = ref.removeprefix("refs/checkpoints/")
+        if commit in kept_commits:
+            referenced_commits.add(commit)
+        else:
+            await run_workspace_checkpoints_git(spawn_id, None, "update-ref", "-d", ref)
+            # the old chain may hold on to any number of checkpoints, so gc right away
+            dropped_count += MAX_CHECKPOINTS_PER_AGENT if ref.startswith("refs/heads/") else 1
+    for commit in kept_commits - referenced_commits:
+        try:
+            await run_workspace_checkpoints_git(spawn_id, None, "update-ref", get_workspace_checkpoint_ref(commit), commit)
+        except RuntimeError:
+            # e.g. the checkpoint repo was deleted by hand, /rewind to it fails either way
+            log(traceback.format_exc(), level=logging.ERROR)
+
+    dropped_count += workspace_checkpoints_dropped_counts.get(spawn_id, 0)
+    if dropped_count >= MAX_CHECKPOINTS_PER_AGENT:
+        log(f"Pruning {dropped_count} dropped workspace checkpoints of {spawn_id}")
+        await run_workspace_checkpoints_git(spawn_id, None, "gc", "-q", "--prune=now")
+        dropped_count = 0
+    workspace_checkpoints_dropped_counts[spawn_id] = dropped_count
+
+
+def schedule_workspace_checkpoints_prune(entry: dict):
+    """Runs prune_workspace_checkpoints in the background after checkpoints were dropped."""
+    spawn_id = entry["spawn_id"]
+    if spawn_id in workspace_checkpoints_prune_tasks:
+        # the running prune may have missed the latest drops, the next one picks them up
+        return
+
+    async def prune():
+        try:
+            await prune_workspace_checkpoints(entry)
+        except Exception:
+            log(traceback.format_exc(), level=logging.ERROR)
+        finally:
+            if workspace_checkpoints_prune_tasks.get(spawn_id) is asyncio.current_task():
+                del workspace_checkpoints_prune_tasks[spawn_id]
+
+    workspace_checkpoints_prune_tasks[spawn_id] = asyncio.create_task(prune())
+
+
+async def restore_workspace_checkpoint(spawn_id: str, working_dir: str, commit: str):
+    await wait_for_workspace_checkpoints_prune(spawn_id)
+    write_workspace_checkpoints_excludes(spawn_id, working_dir)
+    # Sync the index with the current working dir first, so read-tree only touches files that differ from the checkpoint
+    await run_workspace_checkpoints_git(spawn_id, working_dir, "add", "-A")
+    await run_workspace_checkpoints_git(spawn_id, working_dir, "read-tree", "-u", "--reset", commit)
+
+
+async def create_turn_checkpoint(entry: dict) -> dict:
+    spawn_id = entry["spawn_id"]
+    checkpoint = {
+        "time": datetime.datetime.now().isoformat(),
+        "chat_message_count": entry["chat_message_count"],
+        "codex_session_id": entry["codex_session_id"],
+        "session": create_codex_session_checkpoint(entry["codex_session_id"]),
+        "workspace_commit": await create_workspace_checkpoint(spawn_id, entry["working_dir"]),
+    }
+    checkpoints = entry["checkpoints"]
+    checkpoints.append(checkpoint)
+    if len(checkpoints) > MAX_CHECKPOINTS_PER_AGENT:
+        dropped = checkpoints[:-MAX_CHECKPOINTS_PER_AGENT]
+        del checkpoints[:-MAX_CHECKPOINTS_PER_AGENT]
+        release_unreferenced_codex_session_checkpoints(dropped, checkpoints)
+        schedule_workspace_checkpoints_prune(entry)
+    save_spawn_checkpoint(spawn_id, checkpoint)
+    return checkpoint
+
+
+def drop_turn_checkpoint(entry: dict, checkpoint: dict):
+    """Removes the checkpoint of a turn that was reverted, so /rewind counts only the turns that happened."""
+    checkpoints = entry["checkpoints"]
+    if not checkpoints or checkpoints[-1] is not checkpoint:
+        # already dropped (by the cap or by /rewind)
+        return
+    checkpoints.pop()
+    release_unreferenced_codex_session_checkpoints([checkpoint], checkpoints)
+    schedule_workspace_checkpoints_prune(entry)
+    save_dropped_spawn_checkpoints(entry["spawn_id"], 1)
+
+
+def delete_agent_checkpoints(entry: dict):
+    release_unreferenced_codex_session_checkpoints(entry["checkpoints"], [])
+    entry["checkpoints"] = []
+    prune_task = workspace_checkpoints_prune_tasks.pop(entry["spawn_id"], None)
+    if prune_task is not None:
+        prune_task.cancel()
+    workspace_checkpoints_dropped_counts.pop(entry["spawn_id"], None)
+    git_dir = get_workspace_checkpoints_git_dir(entry["spawn_id"])
+    if os.path.exists(git_dir):
+        shutil.rmtree(git_dir, ignore_errors=True)
+
+
 def get_host_proc_env(leak_env: bool) -> Optional[dict[str, str]]:
     if leak_env:
         return None
@@ -366,10 +1357,22 @@ async def run_proc_and_wait(
                 # Only log the message, not the traceback
                 log(str(e))
             else:
-                log(traceback.format_exc())
+                log(traceback.format_exc(), level=logging.ERROR)
     return proc if proc.returncode is None else None
 
 
+async def run_proc_and_check(*args, silent_errors: bool = False) -> bool:
+    """Like run_proc_and_wait, but returns whether the command succeeded."""
+    returncodes = []
+
+    async def proc_completion_waiter(proc: asyncio.subprocess.Process):
+        await proc.communicate()
+        returncodes.append(proc.returncode)
+
+    await run_proc_and_wait(*args, proc_completion_waiter=proc_completion_waiter, silent_errors=silent_errors)
+    return returncodes == [0]
+
+
 def get_docker_container_name(spawn_id: str):
     return f"{CODEX_DOCKER_IMAGE_NAME}-agent-container-{spawn_id}"
 
@@ -402,7 +1405,7 @@ def normalize_agent_verbosity(verbosity: Optional[str]) -> str:
     if verbosity is None:
         return DEFAULT_AGENT_VERBOSITY
     verbosity = str(verbosity).strip().lower()
-    if verbosity not in ("answers", "verbose"):
+    if verbosity not in VALID_AGENT_VERBOSITIES:
         return DEFAULT_AGENT_VERBOSITY
     return verbosity
 
@@ -411,123 +1414,851 @@ def is_verbose_agent_verbosity(verbosity: str) -> bool:
     return normalize_agent_verbosity(verbosity) == "verbose"
 
 
-async def create_agent_docker_container(spawn_id: str, working_dir: str, leak_env: bool = False):
-    log(
-        f"Creating agent container for {spawn_id} and mounting to {working_dir}."
-        + (" WARNING: env leak enabled." if leak_env else "")
-    )
-    auto_gen_env_vars = get_auto_gen_env_vars()
-    env_var_setters = env_var_dict_to_setters(auto_gen_env_vars)
+def is_live_agent_verbosity(verbosity: str) -> bool:
+    return normalize_agent_verbosity(verbosity) == "live"
 
-    if leak_env:
-        filtered_environ = {k: v for k, v in os.environ.items() if k not in auto_gen_env_vars}
-        env_var_setters.extend(env_var_dict_to_setters(filtered_environ))
-    if CODEX_ENV_FILE is not None:
-        env_var_setters.extend(["--env-file", CODEX_ENV_FILE])
 
-    dot_codex_dir_in_docker = os.path.join(auto_gen_env_vars["CODEX_HOME"], ".codex")
-    mounts = [
-        "-v", f"{working_dir}:{working_dir}",
-        "-v", f"{DOT_CODEX_DIR}:{dot_codex_dir_in_docker}",
-        "-v", f"{ATTACHMENTS_DIR}:{ATTACHMENTS_DIR}",
-    ]
+class DockerEngineApiError(RuntimeError):
+    pass
 
-    docker_args = [
-        "docker",
-        "create",
-        "--name", get_docker_container_name(spawn_id),
-        "--cap-add=NET_ADMIN",  # required for setting up firewall rules
-        "--cpus", str(MAX_CPU_USAGE),
-        "--memory", f"{MAX_RAM_USAGE_GB}g",
-    ] + mounts + [
-        "-w", working_dir,
-        *env_var_setters,
-        CODEX_DOCKER_IMAGE_NAME,
-    ]
-    await run_proc_and_wait(*docker_args)
-    log("DONE: docker create")
 
+def get_docker_socket_path() -> str:
+    docker_host = os.getenv("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://"):]
+    xdg_runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if xdg_runtime_dir and os.path.exists(os.path.join(xdg_runtime_dir, "docker.sock")):
+        # rootless docker
+        return os.path.join(xdg_runtime_dir, "docker.sock")
+    return "/var/run/docker.sock"
 
-async def start_agent_docker_container_proc_completion_waiter(proc: asyncio.subprocess.Process):
-    """Special logic that awaits the completion of the start command. Instead of waiting forever, we wait until it prints '[==== DONE ====]'."""
-    async for line in proc.stdout:
-        log("New line from entrypoint.sh:", line.decode('utf-8', errors="replace"))
-        if b"[==== DONE ====]" in line:
-            return
-    raise RuntimeError("`docker start -a spawn_id` exited unexpectedly")
 
+def use_docker_engine_api() -> bool:
+    """Whether to talk to the Docker Engine API directly instead of forking the docker CLI (the fallback)."""
+    return bool(DOCKER_ENGINE_API) and os.path.exists(get_docker_socket_path())
 
-async def start_agent_docker_container(spawn_id: str):
-    log(f"Starting docker container for {spawn_id}")
-    docker_args = [
-        "docker",
-        "start",
-        # This would, per se, wait forever, but we have a special completion waiter that
-        # waits for a sentinel echo.
-        "-a",
-        get_docker_container_name(spawn_id),
-    ]
-    await run_proc_and_wait(
-        *docker_args,
-        proc_completion_waiter=start_agent_docker_container_proc_completion_waiter
+
+def get_docker_api_session() -> aiohttp.ClientSession:
+    global docker_api_session
+    if docker_api_session is None or docker_api_session.closed:
+        docker_api_session = aiohttp.ClientSession(
+            connector=aiohttp.UnixConnector(path=get_docker_socket_path()),
+            base_url="http://docker",
+        )
+    return docker_api_session
+
+
+async def docker_api_request(method: str, path: str, params: Optional[dict] = None, body: Optional[dict] = None):
+    log(f"Docker Engine API: {method} {path} {params or ''}")
+    async with get_docker_api_session().request(method, path, params=params, json=body) as response:
+        content = await response.read()
+        if response.status >= 400:
+            try:
+                message = json.loads(content).get("message")
+            except Exception:
+                message = content.decode("utf-8", errors="replace")
+            raise DockerEngineApiError(f"{method} {path} failed with HTTP {response.status}: {message}")
+        if response.content_type == "application/json" and content:
+            return json.loads(content)
+        return None
+
+
+async def open_docker_api_hijacked_stream(path: str, body: Optional[dict] = None) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Sends a request that upgrades the connection to a raw (multiplexed) stream, like attach and exec start do.
+    aiohttp cannot hand out hijacked connections, so this speaks HTTP/1.1 over the unix socket itself.
+    """
+    reader, writer = await asyncio.open_unix_connection(get_docker_socket_path())
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write(
+        (
+            f"POST {path} HTTP/1.1\r\n"
+            "Host: docker\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: Upgrade\r\n"
+            "Upgrade: tcp\r\n"
+            "\r\n"
+        ).encode("ascii")
+        + payload
     )
-    log(f"DONE: docker start")
+    await writer.drain()
 
+    status_line = await reader.readline()
+    headers = {}
+    while (header_line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        key, _, value = header_line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        writer.close()
+        raise DockerEngineApiError(f"POST {path}: malformed response {status_line!r}")
+    if status not in (101, 200):
+        content_length = int(headers.get("content-length", 0))
+        content = await reader.read(content_length) if content_length else b""
+        writer.close()
+        raise DockerEngineApiError(
+            f"POST {path} failed with HTTP {status}: {content.decode('utf-8', errors='replace').strip()}"
+        )
+    return reader, writer
 
-async def stop_agent_docker_container(spawn_id: str, silent_errors: bool = False):
-    log(f"Force-stopping docker container for {spawn_id}")
-    docker_args = [
-        "docker",
-        "stop",
-        "-t", "5",
-        get_docker_container_name(spawn_id),
-    ]
-    await run_proc_and_wait(*docker_args, silent_errors=True)
-    log(f"DONE: docker stop")
 
+async def read_docker_stream_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Reads one frame of a multiplexed stdout/stderr stream (8 byte header, then payload). Returns None at EOF."""
+    try:
+        header = await reader.readexactly(8)
+        return await reader.readexactly(int.from_bytes(header[4:8], "big"))
+    except asyncio.IncompleteReadError:
+        return None
 
-async def delete_agent_docker_container(spawn_id: str):
-    log(f"Removing docker container for {spawn_id}")
-    docker_args = [
-        "docker",
-        "rm",
-        get_docker_container_name(spawn_id),
-    ]
-    await run_proc_and_wait(*docker_args)
-    log("DONE: docker rm")
 
+def docker_container_spec_to_api_body(spec: dict) -> dict:
+    env = dict(spec["env"])
+    if spec["env_file"] is not None:
+        env.update({k: v for k, v in dotenv_values(spec["env_file"]).items() if v is not None})
+    return {
+        "Image": spec["image"],
+        "Env": [f"{k}={v}" for k, v in env.items()],
+        "WorkingDir": spec["working_dir"],
+        "Labels": spec["labels"],
+        "HostConfig": {
+            "Binds": spec["binds"],
+            "CapAdd": spec["cap_add"],
+            "NanoCpus": int(spec["cpus"] * 1e9),
+            "Memory": int(spec["memory_gb"] * 1024 ** 3),
+        },
+    }
 
-async def launch_agent(
-    spawn_id: str,
-    prompt: str,
-    codex_session_id: Optional[str],
-    provider: str,
-    model: str,
-    reasoning_effort: str,
-    working_dir: str,
-    leak_env: bool = False,
-    execution_mode: str = DEFAULT_EXECUTION_MODE,
-):
-    assert not leak_env or ALLOW_LEAK_ENV
-    codex_working_dir = working_dir
 
-    if is_host_execution_mode(execution_mode):
-        log(f"Launching agent {spawn_id} on host...")
-        optional_docker_prefix = []
-        proc_env = get_host_proc_env(leak_env)
-        subprocess_cwd = working_dir
-    elif is_docker_execution_mode(execution_mode):
-        log(f"Launching agent {spawn_id} in docker container...")
-        proc_env = None  # docker itself gets all host env vars
+async def docker_api_create_container(spec: dict):
+    await docker_api_request(
+        "POST", "/containers/create", params={"name": spec["name"]}, body=docker_container_spec_to_api_body(spec)
+    )
 
-        # Start docker container first (non-blocking)
-        await start_agent_docker_container(spawn_id)
 
-        optional_docker_prefix = [
-            "docker",
-            "exec",
+async def docker_api_start_container(container_name: str):
+    """Attaches to the container before starting it and waits for the entrypoint's sentinel in its output."""
+    reader, writer = await open_docker_api_hijacked_stream(
+        f"/containers/{container_name}/attach?stream=1&stdout=1&stderr=1"
+    )
+    try:
+        await docker_api_request("POST", f"/containers/{container_name}/start")
+        pending = b""
+        while (frame := await read_docker_stream_frame(reader)) is not None:
+            *lines, pending = (pending + frame).split(b"\n")
+            for line in lines:
+                log("New line from entrypoint.sh:", line.decode('utf-8', errors="replace"), category="entrypoint")
+                if b"[==== DONE ====]" in line:
+                    return
+        raise RuntimeError(f"container {container_name} exited unexpectedly")
+    finally:
+        writer.close()
+
+
+async def docker_api_is_container_running(container_name: str) -> bool:
+    try:
+        info = await docker_api_request("GET", f"/containers/{container_name}/json")
+    except DockerEngineApiError:
+        return False
+    return bool(info and info.get("State", {}).get("Running"))
+
+
+class DockerStreamFlowControl:
+    """
+    Stands in for the transport of a StreamReader that is fed by hand: the reader pauses it when its buffer is over
+    the limit and resumes it once the consumer drained it, so whoever feeds the reader can wait for `resumed`.
+    """
+
+    def __init__(self):
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+
+    def pause_reading(self):
+        self.resumed.clear()
+
+    def resume_reading(self):
+        self.resumed.set()
+
+
+class DockerApiExecProcess:
+    """
+    A `docker exec -i` run through the Engine API. Mimics the parts of asyncio.subprocess.Process the bot uses:
+    stdout (stderr is merged into it), pid, returncode, kill() and wait().
+    """
+
+    def __init__(self, exec_id: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.exec_id = exec_id
+        self.pid = None
+        self.returncode = None
+        self.stdout = asyncio.StreamReader()
+        # Backpressure: the socket is not read while stdout's buffer is full, like a subprocess pipe is not read
+        self._flow_control = DockerStreamFlowControl()
+        self.stdout.set_transport(self._flow_control)
+        # stdin stays open (but unused) for as long as the connection is (required by codex cli)
+        self._writer = writer
+        self._demux_task = asyncio.get_running_loop().create_task(self._demux(reader))
+
+    async def _demux(self, reader: asyncio.StreamReader):
+        try:
+            while (frame := await read_docker_stream_frame(reader)) is not None:
+                self.stdout.feed_data(frame)
+                if not self._writer.is_closing():
+                    await self._flow_control.resumed.wait()
+        except Exception:
+            log(traceback.format_exc(), level=logging.ERROR)
+        finally:
+            self.stdout.feed_eof()
+            self._writer.close()
+
+    def kill(self):
+        # Only detaches; the process inside the container is killed through its process group (see kill_agent_docker_container_turn)
+        self._writer.close()
+        self._flow_control.resume_reading()
+
+    async def wait(self) -> int:
+        if self.returncode is None:
+            await self._demux_task
+            info = await docker_api_request("GET", f"/exec/{self.exec_id}/json")
+            exit_code = info.get("ExitCode") if info else None
+            self.returncode = exit_code if exit_code is not None and not info.get("Running") else -9
+        return self.returncode
+
+
+async def docker_api_exec(container_name: str, cmd: list[str], working_dir: Optional[str] = None, attach: bool = True):
+    body = {
+        "AttachStdin": attach,
+        "AttachStdout": attach,
+        "AttachStderr": attach,
+        "Tty": False,
+        "Cmd": cmd,
+    }
+    if working_dir is not None:
+        body["WorkingDir"] = working_dir
+    exec_id = (await docker_api_request("POST", f"/containers/{container_name}/exec", body=body))["Id"]
+    if not attach:
+        await docker_api_request("POST", f"/exec/{exec_id}/start", body={"Detach": True, "Tty": False})
+        return None
+    reader, writer = await open_docker_api_hijacked_stream(f"/exec/{exec_id}/start", {"Detach": False, "Tty": False})
+    proc = DockerApiExecProcess(exec_id, reader, writer)
+    try:
+        proc.pid = (await docker_api_request("GET", f"/exec/{exec_id}/json")).get("Pid")
+    except Exception:
+        log(traceback.format_exc(), level=logging.ERROR)
+    return proc
+
+
+async def docker_api_list_containers(name_filter: str) -> dict[str, bool]:
+    containers = await docker_api_request(
+        "GET", "/containers/json", params={"all": "1", "filters": json.dumps({"name": [name_filter]})}
+    )
+    return {c["Names"][0].lstrip("/"): c.get("State") == "running" for c in containers or [] if c.get("Names")}
+
+
+async def run_docker_api_call(coro, silent_errors: bool = False):
+    """Runs a Docker Engine API call with the same error semantics as run_proc_and_wait (log, don't raise)."""
+    try:
+        return await coro
+    except (DockerEngineApiError, aiohttp.ClientError, OSError) as e:
+        if silent_errors:
+            log(str(e))
+        else:
+            log(traceback.format_exc(), level=logging.ERROR)
+        return None
+
+
+def get_docker_cache_volume_name(cache_name: str) -> str:
+    return f"{CODEX_DOCKER_IMAGE_NAME}-cache-{cache_name}"
+
+
+def get_docker_cache_volume_definition(cache_name: str) -> tuple[str, dict[str, str]]:
+    """Returns where a shared cache volume is mounted in agent containers, and the env vars that point the tool at it."""
+    if cache_name == "pip":
+        return "/var/cache/codexmaster/pip", {"PIP_CACHE_DIR": "/var/cache/codexmaster/pip"}
+    if cache_name == "npm":
+        return "/var/cache/codexmaster/npm", {"npm_config_cache": "/var/cache/codexmaster/npm"}
+    if cache_name == "cargo":
+        # only the registry (downloaded crates + index) is shared, not the installed binaries in ~/.cargo/bin
+        return os.path.join(get_auto_gen_env_vars()["CODEX_HOME"], ".cargo", "registry"), {}
+    if cache_name == "apt":
+        # requires an image that keeps downloaded packages (see the Dockerfiles)
+        return "/var/cache/apt/archives", {}
+    raise ValueError(f"Unknown cache volume '{cache_name}'")
+
+
+# Evicts the least recently accessed files of a cache volume (mounted at /cache) until it is below $1 bytes
+DOCKER_CACHE_PRUNE_SCRIPT = r"""
+cap="$1"
+used=$(du -sb /cache | cut -f1)
+[ "$used" -le "$cap" ] && exit 0
+find /cache -type f -printf '%A@ %s %p\n' \
+    | sort -n \
+    | awk -v excess="$((used - cap))" '{ if (freed >= excess) exit; freed += $2; sub(/^[^ ]+ [^ ]+ /, ""); print }' \
+    | tr '\n' '\0' \
+    | xargs -0 -r rm -f
+find /cache -mindepth 1 -type d -empty -delete
+"""
+
+
+async def run_docker_maintenance_container(cmd: list[str], binds: list[str]):
+    """Runs a short-lived helper container from the agent image, bypassing its entrypoint (no firewall setup needed)."""
+    if not use_docker_engine_api():
+        mounts = []
+        for bind in binds:
+            mounts.extend(["-v", bind])
+        await run_proc_and_wait(
+            "docker", "run", "--rm", "--entrypoint", cmd[0], *mounts, CODEX_DOCKER_IMAGE_NAME, *cmd[1:]
+        )
+        return
+
+    async def run():
+        container_id = (await docker_api_request("POST", "/containers/create", body={
+            "Image": CODEX_DOCKER_IMAGE_NAME,
+            "Entrypoint": cmd,
+            "Labels": {"codexmaster.managed": "true"},
+            "HostConfig": {"Binds": binds},
+        }))["Id"]
+        try:
+            await docker_api_request("POST", f"/containers/{container_id}/start")
+            await docker_api_request("POST", f"/containers/{container_id}/wait")
+        finally:
+            await docker_api_request("DELETE", f"/containers/{container_id}", params={"force": "1"})
+
+    await run_docker_api_call(run())
+
+
+async def prune_docker_cache_volumes():
+    for cache_name, max_size_gb in DOCKER_CACHE_VOLUMES.items():
+        log(f"Pruning cache volume {cache_name} to at most {max_size_gb}GB")
+        await run_docker_maintenance_container(
+            ["sh", "-c", DOCKER_CACHE_PRUNE_SCRIPT, "sh", str(int(max_size_gb * 1024 ** 3))],
+            [f"{get_docker_cache_volume_name(cache_name)}:/cache"],
+        )
+
+
+async def prune_docker_cache_volumes_periodically():
+    while True:
+        try:
+            await prune_docker_cache_volumes()
+        except Exception:
+            log(traceback.format_exc(), level=logging.ERROR)
+        await asyncio.sleep(DOCKER_CACHE_PRUNE_INTERVAL)
+
+
+def build_docker_container_spec(container_name: str, mounted_dir: str, working_dir: str, leak_env: bool = False) -> dict:
+    auto_gen_env_vars = get_auto_gen_env_vars()
+    env = dict(auto_gen_env_vars)
+    cache_binds = []
+    for cache_name in DOCKER_CACHE_VOLUMES:
+        cache_path, cache_env = get_docker_cache_volume_definition(cache_name)
+        cache_binds.append(f"{get_docker_cache_volume_name(cache_name)}:{cache_path}")
+        env.update(cache_env)
+    if leak_env:
+        env.update({k: v for k, v in os.environ.items() if k not in auto_gen_env_vars})
+
+    dot_codex_dir_in_docker = os.path.join(auto_gen_env_vars["CODEX_HOME"], ".codex")
+    return {
+        "name": container_name,
+        "image": CODEX_DOCKER_IMAGE_NAME,
+        "env": env,
+        "env_file": CODEX_ENV_FILE,
+        "binds": [
+            f"{mounted_dir}:{mounted_dir}",
+            f"{DOT_CODEX_DIR}:{dot_codex_dir_in_docker}",
+            f"{ATTACHMENTS_DIR}:{ATTACHMENTS_DIR}",
+            *cache_binds,
+        ],
+        "working_dir": working_dir,
+        "labels": {"codexmaster.managed": "true"},
+        "cap_add": ["NET_ADMIN"],  # required for setting up firewall rules
+        "cpus": MAX_CPU_USAGE,
+        "memory_gb": MAX_RAM_USAGE_GB,
+    }
+
+
+def docker_container_spec_to_cli_args(spec: dict) -> list[str]:
+    env_var_setters = env_var_dict_to_setters(spec["env"])
+    if spec["env_file"] is not None:
+        env_var_setters.extend(["--env-file", spec["env_file"]])
+    mounts = []
+    for bind in spec["binds"]:
+        mounts.extend(["-v", bind])
+    return [
+        "docker",
+        "create",
+        "--name", spec["name"],
+        *(f"--label={k}={v}" for k, v in spec["labels"].items()),
+        *(f"--cap-add={cap}" for cap in spec["cap_add"]),
+        "--cpus", str(spec["cpus"]),
+        "--memory", f"{spec['memory_gb']}g",
+    ] + mounts + [
+        "-w", spec["working_dir"],
+        *env_var_setters,
+        spec["image"],
+    ]
+
+
+async def create_docker_container(container_name: str, mounted_dir: str, working_dir: str, leak_env: bool = False):
+    spec = build_docker_container_spec(container_name, mounted_dir, working_dir, leak_env)
+    if use_docker_engine_api():
+        await run_docker_api_call(docker_api_create_container(spec))
+    else:
+        await run_proc_and_wait(*docker_container_spec_to_cli_args(spec))
+    log("DONE: docker create")
+
+
+async def create_agent_docker_container(spawn_id: str, working_dir: str, leak_env: bool = False):
+    if not leak_env and await claim_docker_pool_container(spawn_id, working_dir):
+        return
+    log(
+        f"Creating agent container for {spawn_id} and mounting to {working_dir}."
+        + (" WARNING: env leak enabled." if leak_env else "")
+    )
+    await create_docker_container(get_docker_container_name(spawn_id), working_dir, working_dir, leak_env)
+
+
+async def start_agent_docker_container_proc_completion_waiter(proc: asyncio.subprocess.Process):
+    """Special logic that awaits the completion of the start command. Instead of waiting forever, we wait until it prints '[==== DONE ====]'."""
+    async for line in proc.stdout:
+        log("New line from entrypoint.sh:", line.decode('utf-8', errors="replace"), category="entrypoint")
+        if b"[==== DONE ====]" in line:
+            return
+    raise RuntimeError("`docker start -a spawn_id` exited unexpectedly")
+
+
+async def start_docker_container(container_name: str):
+    if use_docker_engine_api():
+        await docker_api_start_container(container_name)
+        log(f"DONE: docker start")
+        return
+    docker_args = [
+        "docker",
+        "start",
+        # This would, per se, wait forever, but we have a special completion waiter that
+        # waits for a sentinel echo.
+        "-a",
+        container_name,
+    ]
+    await run_proc_and_wait(
+        *docker_args,
+        proc_completion_waiter=start_agent_docker_container_proc_completion_waiter
+    )
+    log(f"DONE: docker start")
+
+
+async def start_agent_docker_container(spawn_id: str):
+    log(f"Starting docker container for {spawn_id}")
+    start_time = time.perf_counter()
+    await start_docker_container(get_docker_container_name(spawn_id))
+    running_agent_docker_containers.add(spawn_id)
+    observe_metric("codexmaster_docker_container_start_seconds", time.perf_counter() - start_time, *get_agent_metric_labels(spawn_id))
+
+
+# Makes the agent's working dir ($1) a link to the workspace of a claimed pool container ($0), inside the container
+DOCKER_POOL_LINK_SCRIPT = 'mkdir -p "$(dirname "$1")" && { rmdir "$1" 2>/dev/null; ln -s "$0" "$1"; }'
+
+
+def get_docker_pool_workspace(container_name: str) -> str:
+    """The host dir a pool container mounts (at the same path), instead of a working dir."""
+    return os.path.join(DOCKER_POOL_WORKSPACES_ROOT, ".codexmaster-pool", container_name)
+
+
+def is_docker_pool_eligible_working_dir(working_dir: str) -> bool:
+    if DOCKER_POOL_WORKSPACES_ROOT is None:
+        return False
+    working_dir = os.path.abspath(working_dir)
+    if os.path.commonpath([DOCKER_POOL_WORKSPACES_ROOT, working_dir]) != DOCKER_POOL_WORKSPACES_ROOT:
+        return False
+    if working_dir == DOCKER_POOL_WORKSPACES_ROOT or working_dir.startswith(get_docker_pool_workspace("")):
+        return False
+    # The working dir is replaced by a link to the pool container's workspace
+    return not os.path.lexists(working_dir) or (
+        os.path.isdir(working_dir) and not os.path.islink(working_dir) and not os.listdir(working_dir)
+    )
+
+
+def link_working_dir_to_docker_pool_workspace(working_dir: str, workspace: str):
+    if os.path.isdir(working_dir):
+        os.rmdir(working_dir)
+    os.makedirs(os.path.dirname(working_dir), exist_ok=True)
+    os.symlink(workspace, working_dir)
+
+
+async def add_docker_pool_container():
+    try:
+        async with docker_pool_refill_semaphore:
+            container_name = f"{CODEX_DOCKER_IMAGE_NAME}-pool-container-{uuid.uuid4().hex[:12]}"
+            log(f"Adding {container_name} to the docker pool")
+            workspace = get_docker_pool_workspace(container_name)
+            os.makedirs(workspace)
+            await create_docker_container(container_name, workspace, workspace)
+            await start_docker_container(container_name)
+            docker_pool_ready_containers.append(container_name)
+    except Exception:
+        log(traceback.format_exc(), level=logging.ERROR)
+    finally:
+        docker_pool_stats["refills_in_flight"] -= 1
+
+
+async def remove_docker_pool_container(container_name: str):
+    await force_remove_docker_container(container_name)
+    shutil.rmtree(get_docker_pool_workspace(container_name), ignore_errors=True)
+
+
+def refill_docker_pool():
+    missing = DOCKER_POOL_SIZE - len(docker_pool_ready_containers) - docker_pool_stats["refills_in_flight"]
+    for _ in range(max(0, missing)):
+        docker_pool_stats["refills_in_flight"] += 1
+        # the loop only keeps weak references to tasks
+        task = bot.loop.create_task(add_docker_pool_container())
+        docker_pool_refill_tasks.add(task)
+        task.add_done_callback(docker_pool_refill_tasks.discard)
+
+
+async def claim_docker_pool_container(spawn_id: str, working_dir: str) -> bool:
+    """
+    Turns a pre-created, already started pool container into the agent's container. A pool container only mounts its
+    own workspace, so the agent's (empty) working dir is replaced by a link to it, both inside the container and on
+    the host. Returns False if no container could be claimed, so a new one has to be created.
+    """
+    if not DOCKER_POOL_SIZE or not is_docker_pool_eligible_working_dir(working_dir):
+        return False
+    if not docker_pool_ready_containers:
+        docker_pool_stats["misses"] += 1
+        refill_docker_pool()
+        return False
+
+    start_time = time.perf_counter()
+    container_name = docker_pool_ready_containers.pop(0)
+    agent_container_name = get_docker_container_name(spawn_id)
+    workspace = get_docker_pool_workspace(container_name)
+    working_dir = os.path.abspath(working_dir)
+    log(f"Claiming docker pool container {container_name} for {spawn_id}")
+    refill_docker_pool()
+    claimed = renamed = False
+    if await exec_in_docker_container(container_name, ["sh", "-c", DOCKER_POOL_LINK_SCRIPT, workspace, working_dir]):
+        renamed = await rename_docker_container(container_name, agent_container_name)
+    if renamed:
+        try:
+            link_working_dir_to_docker_pool_workspace(working_dir, workspace)
+            claimed = True
+        except OSError:
+            log(traceback.format_exc(), level=logging.ERROR)
+    if not claimed:
+        log(f"Could not claim docker pool container {container_name} for {spawn_id}, creating a new container")
+        docker_pool_stats["failed_claims"] += 1
+        await force_remove_docker_container(agent_container_name if renamed else container_name)
+        shutil.rmtree(workspace, ignore_errors=True)
+        return False
+    running_agent_docker_containers.add(spawn_id)
+    schedule_agent_docker_container_idle_stop(spawn_id)
+
+    claim_seconds = time.perf_counter() - start_time
+    docker_pool_stats["claims"] += 1
+    docker_pool_stats["last_claim_seconds"] = claim_seconds
+    docker_pool_stats["total_claim_seconds"] += claim_seconds
+    observe_metric("codexmaster_docker_pool_claim_seconds", claim_seconds)
+    return True
+
+
+async def list_docker_containers(name_prefix: str) -> Optional[dict[str, bool]]:
+    """
+    Lists all containers whose name starts with name_prefix, mapped to whether they are running. Returns None if
+    the containers could not be listed (which is not the same as there being none).
+    """
+    if use_docker_engine_api():
+        containers = await run_docker_api_call(docker_api_list_containers(name_prefix))
+        if containers is None:
+            return None
+    else:
+        output = []
+
+        async def proc_completion_waiter(proc: asyncio.subprocess.Process):
+            stdout, _ = await proc.communicate()
+            if proc.returncode == 0:
+                output.append(stdout)
+
+        try:
+            await run_proc_and_wait(
+                "docker",
+                "ps",
+                "-a",
+                "--filter", f"name={name_prefix}",
+                "--format", "{{.Names}}\t{{.State}}",
+                proc_completion_waiter=proc_completion_waiter,
+            )
+        except OSError:
+            # e.g. no docker CLI
+            log(traceback.format_exc(), level=logging.ERROR)
+        if not output:
+            return None
+        containers = {}
+        for line in output[0].decode("utf-8", errors="replace").splitlines():
+            name, _, state = line.partition("\t")
+            containers[name] = state.strip() == "running"
+    # The name filter matches substrings anywhere in the name
+    return {name: running for name, running in containers.items() if name.startswith(name_prefix)}
+
+
+async def force_remove_docker_container(container_name: str):
+    if use_docker_engine_api():
+        await run_docker_api_call(
+            docker_api_request("DELETE", f"/containers/{container_name}", params={"force": "1"}), silent_errors=True
+        )
+    else:
+        await run_proc_and_wait("docker", "rm", "-f", container_name, silent_errors=True)
+
+
+async def rename_docker_container(container_name: str, new_container_name: str) -> bool:
+    if not use_docker_engine_api():
+        return await run_proc_and_check("docker", "rename", container_name, new_container_name)
+
+    async def rename():
+        await docker_api_request("POST", f"/containers/{container_name}/rename", params={"name": new_container_name})
+        return True
+
+    return bool(await run_docker_api_call(rename()))
+
+
+async def exec_in_docker_container(container_name: str, cmd: list[str]) -> bool:
+    """Runs a command in a running container and returns whether it succeeded."""
+    if not use_docker_engine_api():
+        return await run_proc_and_check("docker", "exec", container_name, *cmd)
+
+    async def run():
+        proc = await docker_api_exec(container_name, cmd)
+        output = await proc.stdout.read()
+        if await proc.wait() != 0:
+            raise DockerEngineApiError(
+                f"`{' '.join(cmd)}` failed in {container_name}: {output.decode('utf-8', errors='replace').strip()}"
+            )
+        return True
+
+    return bool(await run_docker_api_call(run()))
+
+
+async def gather_bounded(coros: list[Awaitable], limit: int) -> list:
+    """Like asyncio.gather, but runs at most `limit` of the awaitables at once. Failures are logged, not raised."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro: Awaitable):
+        async with semaphore:
+            return await coro
+
+    results = await asyncio.gather(*(run(coro) for coro in coros), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            log("".join(traceback.format_exception(result)))
+    return results
+
+
+async def reconcile_docker_containers():
+    """
+    Matches the persisted agents against the containers that actually exist, using a single listing:
+    orphaned containers (and leftover pool containers, which are only tracked in memory) are removed, missing ones
+    are recreated and still running ones are adopted as warm containers.
+    """
+    container_name_prefix = f"{CODEX_DOCKER_IMAGE_NAME}-"
+    agent_container_name_prefix = get_docker_container_name("")
+    containers = await list_docker_containers(container_name_prefix)
+    if containers is None:
+        # Recreating every agent's container would only run into name conflicts with the ones that do exist
+        log("Could not list the docker containers, skipping the reconciliation", level=logging.WARNING)
+        return
+
+    tasks = []
+    spawn_ids_with_container = set()
+    for container_name, running in containers.items():
+        if not container_name.startswith(agent_container_name_prefix):
+            if container_name.startswith(f"{CODEX_DOCKER_IMAGE_NAME}-pool-container-"):
+                log(f"Removing stale pool container {container_name}")
+                tasks.append(remove_docker_pool_container(container_name))
+            continue
+        spawn_id = container_name[len(agent_container_name_prefix):]
+        entry = spawns.get(spawn_id)
+        if entry is None or not is_docker_execution_mode(entry["execution_mode"]):
+            log(f"Removing orphaned container {container_name}")
+            tasks.append(force_remove_docker_container(container_name))
+            continue
+        spawn_ids_with_container.add(spawn_id)
+        if running:
+            running_agent_docker_containers.add(spawn_id)
+            schedule_agent_docker_container_idle_stop(spawn_id)
+
+    for spawn_id, entry in spawns.items():
+        if is_docker_execution_mode(entry["execution_mode"]) and spawn_id not in spawn_ids_with_container:
+            log(f"Recreating missing container for {spawn_id}")
+            working_dir = entry["working_dir"]
+            tasks.append(create_docker_container(
+                get_docker_container_name(spawn_id), working_dir, working_dir, entry["leak_env"] and ALLOW_LEAK_ENV
+            ))
+
+    await gather_bounded(tasks, DOCKER_BULK_PARALLELISM)
+    log(f"Reconciled docker containers: {len(containers)} found, {len(tasks)} removed or recreated")
+
+
+async def shutdown_docker_containers():
+    """Stops the warm agent containers and removes the pool containers (concurrently) when the bot exits."""
+    tasks = [stop_agent_docker_container(spawn_id, silent_errors=True) for spawn_id in list(running_agent_docker_containers)]
+    tasks.extend(remove_docker_pool_container(container_name) for container_name in docker_pool_ready_containers)
+    docker_pool_ready_containers.clear()
+    await gather_bounded(tasks, DOCKER_BULK_PARALLELISM)
+    if docker_api_session is not None:
+        await docker_api_session.close()
+
+
+async def stop_agent_docker_container(spawn_id: str, silent_errors: bool = False):
+    log(f"Force-stopping docker container for {spawn_id}")
+    cancel_agent_docker_container_idle_stop(spawn_id)
+    running_agent_docker_containers.discard(spawn_id)
+    container_name = get_docker_container_name(spawn_id)
+    if use_docker_engine_api():
+        await run_docker_api_call(
+            docker_api_request("POST", f"/containers/{container_name}/stop", params={"t": "5"}), silent_errors=True
+        )
+        log(f"DONE: docker stop")
+        return
+    docker_args = [
+        "docker",
+        "stop",
+        "-t", "5",
+        container_name,
+    ]
+    await run_proc_and_wait(*docker_args, silent_errors=True)
+    log(f"DONE: docker stop")
+
+
+async def is_agent_docker_container_running(spawn_id: str) -> bool:
+    if use_docker_engine_api():
+        return await docker_api_is_container_running(get_docker_container_name(spawn_id))
+
+    output = []
+
+    async def proc_completion_waiter(proc: asyncio.subprocess.Process):
+        stdout, _ = await proc.communicate()
+        output.append(stdout)
+
+    await run_proc_and_wait(
+        "docker",
+        "inspect",
+        "-f", "{{.State.Running}}",
+        get_docker_container_name(spawn_id),
+        proc_completion_waiter=proc_completion_waiter,
+        silent_errors=True,
+    )
+    return bool(output) and output[0].strip() == b"true"
+
+
+def get_agent_docker_container_lock(spawn_id: str) -> asyncio.Lock:
+    if spawn_id not in agent_docker_container_locks:
+        agent_docker_container_locks[spawn_id] = asyncio.Lock()
+    return agent_docker_container_locks[spawn_id]
+
+
+async def ensure_agent_docker_container_running(spawn_id: str):
+    """Starts the agent's container unless it is still warm from a previous turn."""
+    cancel_agent_docker_container_idle_stop(spawn_id)
+    async with get_agent_docker_container_lock(spawn_id):
+        if spawn_id in running_agent_docker_containers:
+            log(f"Docker container for {spawn_id} is still warm")
+            return
+        # The container may have been left running by a previous instance of the bot. In that case, `docker start -a`
+        # would wait forever for a sentinel that has already been printed.
+        if await is_agent_docker_container_running(spawn_id):
+            running_agent_docker_containers.add(spawn_id)
+            return
+        await start_agent_docker_container(spawn_id)
+
+
+def cancel_agent_docker_container_idle_stop(spawn_id: str):
+    task = agent_docker_container_idle_stop_tasks.pop(spawn_id, None)
+    if task is not None:
+        task.cancel()
+
+
+def schedule_agent_docker_container_idle_stop(spawn_id: str):
+    """Keeps the container warm for the next turn and stops it once it has been idle for DOCKER_CONTAINER_IDLE_TIMEOUT seconds."""
+    cancel_agent_docker_container_idle_stop(spawn_id)
+
+    async def stop_when_idle():
+        await asyncio.sleep(DOCKER_CONTAINER_IDLE_TIMEOUT)
+        async with get_agent_docker_container_lock(spawn_id):
+            # From here on, we cannot be cancelled anymore by a new turn (it waits for the lock and restarts the container)
+            if agent_docker_container_idle_stop_tasks.get(spawn_id) is not asyncio.current_task():
+                return
+            agent_docker_container_idle_stop_tasks.pop(spawn_id)
+            entry = spawns.get(spawn_id)
+            if entry is not None and entry["processes"]:
+                # A new turn is running; it schedules the idle stop again when it completes.
+                return
+            log(f"Docker container for {spawn_id} has been idle for {DOCKER_CONTAINER_IDLE_TIMEOUT}s")
+            await stop_agent_docker_container(spawn_id, silent_errors=True)
+
+    agent_docker_container_idle_stop_tasks[spawn_id] = bot.loop.create_task(stop_when_idle())
+
+
+async def kill_agent_docker_container_turn(spawn_id: str):
+    """Kills the Codex process (group) of the current turn inside the container, but leaves the container running."""
+    log(f"Killing the running turn in the docker container for {spawn_id}")
+    kill_cmd = ["sh", "-c", f'kill -KILL -- -"$(cat {AGENT_TURN_PID_FILE})"']
+    if use_docker_engine_api():
+        await run_docker_api_call(
+            docker_api_exec(get_docker_container_name(spawn_id), kill_cmd, attach=False), silent_errors=True
+        )
+        log("DONE: docker exec kill")
+        return
+    docker_args = [
+        "docker",
+        "exec",
+        get_docker_container_name(spawn_id),
+        *kill_cmd,
+    ]
+    await run_proc_and_wait(*docker_args, silent_errors=True)
+    log("DONE: docker exec kill")
+
+
+async def remove_agent_docker_container(spawn_id: str):
+    """Kills and deletes the agent's container in one go (docker rm -f)."""
+    log(f"Removing docker container for {spawn_id}")
+    cancel_agent_docker_container_idle_stop(spawn_id)
+    running_agent_docker_containers.discard(spawn_id)
+    await force_remove_docker_container(get_docker_container_name(spawn_id))
+    log("DONE: docker rm")
+
+
+async def launch_agent(
+    spawn_id: str,
+    prompt: str,
+    codex_session_id: Optional[str],
+    provider: str,
+    model: str,
+    reasoning_effort: str,
+    working_dir: str,
+    leak_env: bool = False,
+    execution_mode: str = DEFAULT_EXECUTION_MODE,
+):
+    assert not leak_env or ALLOW_LEAK_ENV
+    codex_working_dir = working_dir
+
+    use_docker = is_docker_execution_mode(execution_mode)
+    if is_host_execution_mode(execution_mode):
+        log(f"Launching agent {spawn_id} on host...", agent=spawn_id)
+        optional_docker_prefix = []
+        proc_env = get_host_proc_env(leak_env)
+        subprocess_cwd = working_dir
+    elif use_docker:
+        log(f"Launching agent {spawn_id} in docker container...", agent=spawn_id)
+        proc_env = None  # docker itself gets all host env vars
+
+        # Start docker container first (non-blocking), unless it is still warm
+        await ensure_agent_docker_container_running(spawn_id)
+
+        optional_docker_prefix = [
+            "docker",
+            "exec",
             "-i",  # leaves stdin open (required by codex cli even in quiet mode for whatever reason)
             # "-u", getpass.getuser(),
+            "-w", working_dir,  # containers claimed from the pool are not created with the agent's working dir
             get_docker_container_name(spawn_id),
         ]
         subprocess_cwd = None  # launch docker itself in current working dir
@@ -549,7 +2280,7 @@ async def launch_agent(
         codex_options.extend(["-c", f'model_reasoning_effort="{reasoning_effort}"'])
 
     if codex_session_id:
-        args = optional_docker_prefix + [
+        cmd = [
             "codex",
             "exec",
             "resume",
@@ -558,15 +2289,22 @@ async def launch_agent(
             prompt,
         ]
     else:
-        args = optional_docker_prefix + [
+        cmd = [
             "codex",
             "exec",
             *codex_options,
             "-C", codex_working_dir,
             prompt,
         ]
-
-    log(f"launch_agent: running async command `{' '.join(args)}`")
+    if use_docker:
+        # Run codex in its own process group and remember its pid, so a turn can be killed without stopping the container
+        cmd = ["setsid", "-w", "sh", "-c", 'echo $$ > "$0" && exec "$@"', AGENT_TURN_PID_FILE, *cmd]
+        if use_docker_engine_api():
+            log(f"launch_agent: running `{' '.join(cmd)}` in container through the Docker Engine API", agent=spawn_id)
+            return await docker_api_exec(get_docker_container_name(spawn_id), cmd, working_dir)
+
+    args = optional_docker_prefix + cmd
+    log(f"launch_agent: running async command `{' '.join(args)}`", agent=spawn_id)
     proc = await asyncio.create_subprocess_exec(
         *args,
         stdin=asyncio.subprocess.PIPE,  # leaves stdin open (required by codex cli even in quiet mode when running in docker for whatever reason)
@@ -594,7 +2332,7 @@ async def set_instructions(ctx: discord.ApplicationContext, new_instructions: st
 @option("provider", description="The Provider to use")
 @option("model", description="The model to use")
 @option("execution_mode", choices=["docker", "host"], description="Run Codex in Docker or directly on the host")
-@option("verbosity", choices=["answers", "verbose"], description="Only answers+token usage, or include tool calls and thoughts")
+@option("verbosity", choices=list(VALID_AGENT_VERBOSITIES), description="Only answers+token usage, include tool calls and thoughts, or a live status message")
 @option("reasoning_effort", choices=list(VALID_REASONING_EFFORTS), description="Reasoning/thinking effort override for the agent")
 @option("leak_env", description="If set to true, leaks host environment variables into the Codex runtime")
 @option("allow_create_working_dir", description="If set to true, it will create the working dir if it does not exist")
@@ -684,8 +2422,9 @@ async def spawn(
         "user": ctx.author,
         "processes": [],
         "chat_message_count": 0,
+        "checkpoints": [],
     }
-    save_spawns()
+    save_spawn(spawn_id)
     await ctx.respond(
         f"✅ Spawn ID **{spawn_id}** registered. Mention me with 'to {spawn_id}: <message>' to send prompts."
     )
@@ -705,162 +2444,986 @@ async def set_provider(ctx: discord.ApplicationContext, spawn_id: str, provider:
         return
     entry = spawns[spawn_id]
     entry["provider"] = provider
-    save_spawns()
+    save_spawn(spawn_id)
     await ctx.respond(f"✅ Provider for **{spawn_id}** set to '{provider}'.")
 
 
-@bot.slash_command(name="set_model", description="Change the model for an already existing Agent")
-@option("spawn_id", description="The ID of the Agent")
-@option("model", description="The model to use")
-@log_command_usage
-async def set_model(ctx: discord.ApplicationContext, spawn_id: str, model: str = DEFAULT_MODEL):
-    if spawn_id not in spawns:
-        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
-        return
-    entry = spawns[spawn_id]
-    entry["model"] = model
-    save_spawns()
-    await ctx.respond(f"✅ Model for **{spawn_id}** set to '{model}'.")
+@bot.slash_command(name="set_model", description="Change the model for an already existing Agent")
+@option("spawn_id", description="The ID of the Agent")
+@option("model", description="The model to use")
+@log_command_usage
+async def set_model(ctx: discord.ApplicationContext, spawn_id: str, model: str = DEFAULT_MODEL):
+    if spawn_id not in spawns:
+        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
+        return
+    entry = spawns[spawn_id]
+    entry["model"] = model
+    save_spawn(spawn_id)
+    await ctx.respond(f"✅ Model for **{spawn_id}** set to '{model}'.")
+
+
+def can_admit_turn(spawn_id: str) -> bool:
+    return spawn_id not in active_turn_spawn_ids and (
+        not MAX_CONCURRENT_TURNS or len(active_turn_spawn_ids) < MAX_CONCURRENT_TURNS
+    )
+
+
+def admit_queued_turns():
+    """Admits queued turns in FIFO order. A turn of a busy agent does not block the turns of other agents behind it."""
+    i = 0
+    while i < len(queued_turns):
+        turn = queued_turns[i]
+        if can_admit_turn(turn["spawn_id"]):
+            queued_turns.pop(i)
+            active_turn_spawn_ids.add(turn["spawn_id"])
+            turn["future"].set_result(True)
+        else:
+            i += 1
+
+
+async def acquire_turn_slot(spawn_id: str, message: discord.Message) -> Optional[float]:
+    """
+    Waits until the agent may run a turn and returns how many seconds that took, or None if the turn was dropped
+    (see cancel_queued_turns) while it was queued. Must be followed by release_turn_slot once the turn is over.
+    """
+    has_queued_turns = any(turn["spawn_id"] == spawn_id for turn in queued_turns)
+    if not has_queued_turns and can_admit_turn(spawn_id):
+        active_turn_spawn_ids.add(spawn_id)
+        return 0.0
+
+    turn = {"spawn_id": spawn_id, "enqueue_time": time.monotonic(), "future": bot.loop.create_future()}
+    queued_turns.append(turn)
+    if spawn_id in active_turn_spawn_ids or has_queued_turns:
+        reason = f"agent **{spawn_id}** is still busy with a previous message"
+    else:
+        reason = f"all {MAX_CONCURRENT_TURNS} turn slots are in use"
+    try:
+        await message.channel.send(f"⏳ Queued at position {len(queued_turns)} ({reason}).", reference=message)
+        admitted = await turn["future"]
+    except BaseException:
+        # don't leave a turn in the queue that nobody waits for, or a slot that nobody releases
+        if turn in queued_turns:
+            queued_turns.remove(turn)
+        elif turn["future"].done() and turn["future"].result():
+            release_turn_slot(spawn_id)
+        raise
+    if not admitted:
+        return None
+    return time.monotonic() - turn["enqueue_time"]
+
+
+def release_turn_slot(spawn_id: str):
+    active_turn_spawn_ids.discard(spawn_id)
+    admit_queued_turns()
+
+
+def cancel_queued_turns(spawn_id: str) -> int:
+    """Drops all queued turns of an agent and returns how many were dropped."""
+    dropped = [turn for turn in queued_turns if turn["spawn_id"] == spawn_id]
+    for turn in dropped:
+        queued_turns.remove(turn)
+        turn["future"].set_result(False)
+    return len(dropped)
+
+
+async def kill_agent_processes(spawn_id: str, revert_chat_state: bool = True) -> int:
+    """Kills all active processes of an agent and returns how many were killed."""
+    entry = spawns[spawn_id]
+    # copy, the readers remove their procs from the entry while we wait for them
+    procs = list(entry["processes"])
+    if not procs:
+        return 0
+
+    if revert_chat_state:
+        # Mark the procs before killing anything: their readers see the kill as soon as codex dies (in docker mode,
+        # that is while the container turn is still being killed) and then decide whether to revert the turn
+        for item in procs:
+            item["killed"] = True
+
+    if is_docker_execution_mode(entry["execution_mode"]):
+        # Only kill the turn, the container stays warm (unless the agent gets deleted)
+        await kill_agent_docker_container_turn(spawn_id)
+
+    for item in procs:
+        proc = item["proc"]
+        try:
+            proc.kill()
+        except Exception:
+            pass
+        try:
+            await proc.wait()
+        except Exception:
+            pass
+
+    entry["processes"] = []
+    return len(procs)
+
+
+async def delete_agent(spawn_id: str, persist: bool = True):
+    entry = spawns[spawn_id]
+    agent_inboxes.pop(spawn_id, None)
+    cancel_queued_turns(spawn_id)
+    if is_docker_execution_mode(entry["execution_mode"]):
+        await remove_agent_docker_container(spawn_id)
+    delete_agent_checkpoints(entry)
+    delete_agent_event_spills(spawn_id)
+    await close_agent_event_bus(spawn_id)
+    delete_agent_event_archive(spawn_id)
+    delete_agent_metrics(spawn_id)
+    del spawns[spawn_id]
+    if persist:
+        delete_saved_spawn(spawn_id)
+
+
+async def kill_impl(ctx: discord.ApplicationContext, spawn_id: str, delete: bool = False, revert_chat_state: bool = True):
+    """Kills all active processes associated with the given spawn ID."""
+    if spawn_id not in spawns:
+        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
+        return
+    # Drop the queued turns first, otherwise the next one would be admitted as soon as the running turn is killed
+    dropped_count = len(agent_inboxes.pop(spawn_id, []))
+    cancel_queued_turns(spawn_id)
+    count = await kill_agent_processes(spawn_id, revert_chat_state)
+    if delete:
+        await delete_agent(spawn_id)
+    dropped_msg = f" and dropped {dropped_count} queued message(s)" if dropped_count else ""
+    if not count:
+        append_msg = f" (permanently deleted agent **{spawn_id}**)." if delete else "."
+        await ctx.respond(f"ℹ️  No active processes for spawn ID **{spawn_id}**{dropped_msg}" + append_msg)
+        return
+    await ctx.respond(f"✅ Killed {count} process(es){dropped_msg} for spawn ID **{spawn_id}**.")
+
+
+@bot.slash_command(name="kill", description="Kill active processes for a spawn ID")
+@option("spawn_id", description="The spawn ID to kill processes for")
+@option("delete", description="Delete it fully?", type=bool)
+@option("revert_chat_state", description="Revert the chat state to before you sent your last message?", type=bool)
+@log_command_usage
+async def kill(ctx: discord.ApplicationContext, spawn_id: str, delete: bool = False, revert_chat_state: bool = True):
+    return await kill_impl(ctx, spawn_id, delete, revert_chat_state)
+
+
+@bot.slash_command(name="interrupt", description="Kill the running turn of an agent and restart it together with the queued messages")
+@option("spawn_id", description="The ID of the Agent")
+@log_command_usage
+async def interrupt(ctx: discord.ApplicationContext, spawn_id: str):
+    """Reverts the running turn and re-sends its messages merged with the inbox, so corrections apply right away."""
+    if spawn_id not in spawns:
+        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
+        return
+    interrupted_messages = running_turn_messages.get(spawn_id)
+    if interrupted_messages is None:
+        await ctx.respond(f"ℹ️  Agent **{spawn_id}** has no running turn to interrupt.")
+        return
+
+    inbox = agent_inboxes.get(spawn_id)
+    if inbox is None:
+        submit_agent_inbox(spawn_id, list(interrupted_messages))
+        inbox = agent_inboxes[spawn_id]
+    else:
+        inbox[:0] = interrupted_messages
+    await kill_agent_processes(spawn_id, revert_chat_state=True)
+    await ctx.respond(f"✅ Interrupted agent **{spawn_id}**, restarting it with {len(inbox)} message(s).")
+
+
+@bot.slash_command(name="rewind", description="Rewind the chat and the working dir of an agent by some turns")
+@option("spawn_id", description="The ID of the Agent")
+@option("turns", description="How many turns (messages you sent) to undo", type=int)
+@log_command_usage
+async def rewind(ctx: discord.ApplicationContext, spawn_id: str, turns: int = 1):
+    """Restores the session file and the working dir to the checkpoint taken before the n-th last turn."""
+    if spawn_id not in spawns:
+        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
+        return
+    entry = spawns[spawn_id]
+    if spawn_id in active_turn_spawn_ids:
+        await ctx.respond(f"❌ Agent **{spawn_id}** is busy. Kill its active processes before rewinding.")
+        return
+    checkpoints = entry["checkpoints"]
+    if turns < 1 or turns > len(checkpoints):
+        await ctx.respond(f"❌ Can rewind agent **{spawn_id}** by 1 to {len(checkpoints)} turns, but not {turns}.")
+        return
+
+    checkpoint = checkpoints[-turns]
+    if checkpoint["workspace_commit"] is not None:
+        try:
+            await restore_workspace_checkpoint(spawn_id, entry["working_dir"], checkpoint["workspace_commit"])
+        except Exception:
+            log(traceback.format_exc(), level=logging.ERROR)
+            await ctx.respond(f"❌ Failed to restore the working dir of agent **{spawn_id}**.")
+            return
+    else:
+        await ctx.respond("⚠️ No working dir checkpoint was recorded for that turn, only rewinding the chat.")
+
+    session_id = checkpoint["codex_session_id"] or entry["codex_session_id"]
+    if not restore_codex_session_file(session_id, checkpoint["session"]):
+        log(f"Could not restore session file for {session_id}")
+    entry["codex_session_id"] = checkpoint["codex_session_id"] if checkpoint["session"] is not None else None
+    entry["chat_message_count"] = checkpoint["chat_message_count"]
+
+    dropped = checkpoints[-turns:]
+    del checkpoints[-turns:]
+    release_unreferenced_codex_session_checkpoints(dropped, checkpoints)
+    schedule_workspace_checkpoints_prune(entry)
+    save_dropped_spawn_checkpoints(spawn_id, turns)
+    save_spawn(spawn_id)
+    await ctx.respond(f"✅ Rewound agent **{spawn_id}** by {turns} turn(s) (to {checkpoint['time']}).")
+
+
+@bot.slash_command(name="delete_all_agents", description="Delete spawns.json")
+@option("confirmation", description="Type CONFIRM to confirm the action")
+@log_command_usage
+async def del_spawns_file(ctx: discord.ApplicationContext, confirmation: str):
+    if confirmation != "CONFIRM":
+        await ctx.respond("❌ You must confirm this action by typing CONFIRM in the confirmation field")
+        return
+
+    async def kill_and_delete_agent(spawn_id: str):
+        agent_inboxes.pop(spawn_id, None)
+        cancel_queued_turns(spawn_id)
+        await kill_agent_processes(spawn_id)
+        await delete_agent(spawn_id, persist=False)
+
+    # Tear down all agents concurrently (bounded), instead of one stop + rm after the other
+    await gather_bounded([kill_and_delete_agent(spawn_id) for spawn_id in list(spawns)], DOCKER_BULK_PARALLELISM)
+    delete_saved_spawns_files()
+    if ALLOW_DOCKER_EXECUTION:
+        # Also catch containers that were not (or no longer) tracked as agents
+        leftover_containers = await list_docker_containers(get_docker_container_name("")) or {}
+        await gather_bounded([force_remove_docker_container(name) for name in leftover_containers], DOCKER_BULK_PARALLELISM)
+    await ctx.respond("✅ Killed and deleted all agents and docker containers - EVERYTHING!")
+
+
+@bot.slash_command(name="list", description="List active workers and their processes with PID and runtime")
+@log_command_usage
+async def list_spawns(ctx: discord.ApplicationContext):
+    """Lists all spawn IDs and their active processes, showing PID and runtime."""
+    if not spawns:
+        await ctx.respond("ℹ️  No spawn workers registered.")
+        return
+    now = datetime.datetime.now()
+    lines: list[str] = []
+    for sid, entry in spawns.items():
+        procs = entry["processes"]
+        execution_mode = entry["execution_mode"]
+        verbosity = entry["verbosity"]
+        if procs:
+            reasoning_effort = entry["reasoning_effort"]
+            lines.append(f"**{sid}** ({execution_mode}, {verbosity}, effort={reasoning_effort}):")
+            for item in procs:
+                p = item["proc"]
+                elapsed = format_duration((now - item["start_time"]).total_seconds())
+                lines.append(f" • PID {p.pid} – running for {elapsed}")
+        else:
+            reasoning_effort = entry["reasoning_effort"]
+            lines.append(f"**{sid}** ({execution_mode}, {verbosity}, effort={reasoning_effort}): no active processes")
+    if queued_turns:
+        turn_limit = MAX_CONCURRENT_TURNS or "unlimited"
+        lines.append(f"**Queued messages** ({len(active_turn_spawn_ids)}/{turn_limit} turns running):")
+        for position, turn in enumerate(queued_turns, 1):
+            waited = int(time.monotonic() - turn["enqueue_time"])
+            lines.append(f" {position}. **{turn['spawn_id']}** – waiting for {waited}s")
+    await ctx.respond("\n".join(lines))
+
+
+@bot.slash_command(name="usage", description="Show the token usage, prompt cache hit rate and estimated cost of the agents")
+@option("spawn_id", description="Only show this agent (default: all agents)")
+@option("days", description="How many days to include (including today)", type=int)
+@log_command_usage
+async def usage(ctx: discord.ApplicationContext, spawn_id: Optional[str] = None, days: int = 7):
+    if not USAGE_LEDGER_DIR:
+        await ctx.respond("ℹ️  The usage ledger is disabled (`USAGE_LEDGER_DIR` is blank).")
+        return
+    if days < 1:
+        await ctx.respond("❌ `days` must be at least 1.")
+        return
+    spawn_id = (spawn_id or "").strip() or None
+    if spawn_id is not None and not all(c in VALID_SPAWN_ID_CHARS for c in spawn_id):
+        await ctx.respond(f"❌ Spawn ID **{spawn_id}** contains invalid characters - only '{VALID_SPAWN_ID_CHARS}' allowed.")
+        return
+    records = await asyncio.to_thread(read_usage_ledger, days, spawn_id)
+    if not records:
+        await ctx.respond(f"ℹ️  No token usage recorded in the last {days} day(s).")
+        return
+
+    lines = [f"📊 Token usage of the last {days} day(s):"]
+    agent_totals = {sid: sum_usage_records(agent_records) for sid, agent_records in records.items()}
+    for sid, totals in sorted(agent_totals.items(), key=lambda item: -item[1]["input_tokens"]):
+        lines.append(f"**{sid}**{'' if sid in spawns else ' (deleted)'}: {format_usage_totals(totals)}")
+    records_by_model: dict[str, list[dict]] = {}
+    for agent_records in records.values():
+        for record in agent_records:
+            records_by_model.setdefault(str(record.get("model")), []).append(record)
+    lines.append("")
+    lines.append("**Per model:**")
+    for model, model_records in sorted(records_by_model.items()):
+        lines.append(f"`{model}`: {format_usage_totals(sum_usage_records(model_records))}")
+    if len(records) > 1:
+        all_records = [record for agent_records in records.values() for record in agent_records]
+        lines.append("")
+        lines.append(f"**Total:** {format_usage_totals(sum_usage_records(all_records))}")
+    for chunk in split_message_into_chunks("\n".join(lines)):
+        await ctx.respond(chunk)
+
+
+@bot.slash_command(name="replay", description="Re-render a past turn of an agent from its event archive")
+@option("spawn_id", description="The ID of the Agent")
+@option("turn", description="The turn number (1 = first turn, negative = counted from the end, e.g. -1 = last turn)", type=int)
+@log_command_usage
+async def replay(ctx: discord.ApplicationContext, spawn_id: str, turn: int = -1):
+    if not EVENT_ARCHIVE_DIR:
+        await ctx.respond("ℹ️  The event archive is disabled (`EVENT_ARCHIVE_DIR` is blank).")
+        return
+    if spawn_id not in spawns:
+        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
+        return
+    index, _ = await asyncio.to_thread(read_event_archive_index, spawn_id)
+    if not index:
+        await ctx.respond(f"ℹ️  No archived turns for agent **{spawn_id}** yet.")
+        return
+    if turn == 0 or abs(turn) > len(index):
+        await ctx.respond(f"❌ Agent **{spawn_id}** has {len(index)} archived turn(s), there is no turn {turn}.")
+        return
+    record = index[turn - 1] if turn > 0 else index[turn]
+
+    events = await asyncio.to_thread(read_archived_turn_events, spawn_id, record)
+    header = (
+        f"📼 Replay of turn {record['turn']}/{len(index)} of **{spawn_id}** "
+        f"({record['start_time']} – {record['end_time']}, {record['events']} events)"
+    )
+    transcript = render_archived_turn(spawn_id, events) or "(nothing to show)"
+    if DISCORD_SPILL_THRESHOLD_CHARS and len(transcript) > DISCORD_SPILL_THRESHOLD_CHARS:
+        filename, content = build_spill_file(transcript, f"{spawn_id}-turn{record['turn']}")
+        await ctx.respond(
+            f"{header}\n{build_spill_preview(transcript)}",
+            file=discord.File(fp=io.BytesIO(content), filename=filename),
+        )
+        return
+    for chunk in split_message_into_chunks(f"{header}\n{transcript}"):
+        await ctx.respond(chunk)
+
+
+@bot.slash_command(name="profile", description="Profile the bot for some seconds and upload the profile (admins only)")
+@option("seconds", description=f"How long to profile (at most {PROFILE_MAX_SECONDS}s)", type=int)
+@log_command_usage
+async def profile(ctx: discord.ApplicationContext, seconds: int = 10):
+    """Profiles everything that runs on the event loop (commands, readers, notifications) with cProfile."""
+    global active_profiler
+    if ctx.author.id not in ADMIN_USER_IDS:
+        await ctx.respond("⛔ Only the users in `ADMIN_USER_IDS` may profile the bot.")
+        return
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        await ctx.respond(f"❌ `seconds` must be between 1 and {PROFILE_MAX_SECONDS}.")
+        return
+    if active_profiler is not None:
+        await ctx.respond("❌ A profile is already being captured.")
+        return
+
+    start = datetime.datetime.now()
+    active_profiler = cProfile.Profile()
+    try:
+        active_profiler.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        active_profiler.disable()
+        profiler = active_profiler
+        active_profiler = None
+
+    stats_text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_text)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(100)
+    basename = f"profile-{start:%Y%m%d-%H%M%S}"
+    files = [
+        discord.File(fp=io.BytesIO(stats_text.getvalue().encode("utf-8")), filename=f"{basename}.txt"),
+        # the same format as pstats.Stats.dump_stats, for snakeviz and friends
+        discord.File(fp=io.BytesIO(marshal.dumps(stats.stats)), filename=f"{basename}.prof"),
+    ]
+    stalls = [stall for stall in loop_stalls if stall["time"] >= start.isoformat(timespec="seconds")]
+    if stalls:
+        stalls_text = format_loop_stalls(stalls).encode("utf-8")
+        files.append(discord.File(fp=io.BytesIO(stalls_text), filename=f"{basename}-loop-stalls.txt"))
+    await ctx.respond(
+        f"🩺 Profiled the bot for {seconds}s: {stats.total_calls} function calls, "
+        f"{len(stalls)} event loop stall(s) over {LOOP_LAG_STALL_THRESHOLD}s.",
+        files=files,
+    )
+
+
+@bot.slash_command(name="pool_status", description="Show the state of the warm docker container pool")
+@log_command_usage
+async def pool_status(ctx: discord.ApplicationContext):
+    if not DOCKER_POOL_SIZE:
+        await ctx.respond("ℹ️  The docker container pool is disabled (`DOCKER_POOL_SIZE=0`).")
+        return
+    claims = docker_pool_stats["claims"]
+    last_claim_seconds = docker_pool_stats["last_claim_seconds"]
+    lines = [
+        f"**Docker pool** (target size {DOCKER_POOL_SIZE}, refill concurrency {DOCKER_POOL_REFILL_CONCURRENCY}):",
+        f" • ready: {len(docker_pool_ready_containers)}",
+        f" • refills in flight: {docker_pool_stats['refills_in_flight']}",
+        f" • claims: {claims}, misses (pool empty): {docker_pool_stats['misses']}, "
+        f"failed claims: {docker_pool_stats['failed_claims']}",
+    ]
+    if claims:
+        lines.append(
+            f" • time to claim: last {last_claim_seconds * 1000:.0f}ms, "
+            f"avg {docker_pool_stats['total_claim_seconds'] / claims * 1000:.0f}ms"
+        )
+    await ctx.respond("\n".join(lines))
+
+
+def format_response(msg: str) -> str:
+    return msg
+
+
+def format_thought(msg: str) -> str:
+    indicator = "💭💭💭💭💭"
+    return f"{indicator}\n{msg}\n{indicator}"
+
+
+def format_command(msg: str) -> str:
+    return f'`{msg}`'
+
+
+def format_code_block(msg: str) -> str:
+    return f'```\n{msg}\n```'
+
+
+def format_command_output(msg: str) -> str:
+    return format_code_block(msg)
+
+
+def get_json_loads(backend: str) -> tuple[str, Callable]:
+    """Returns (name, loads) of the JSON backend, falling back to the stdlib for 'auto' if nothing faster is installed."""
+    if backend in ("auto", "orjson"):
+        try:
+            import orjson
+            return "orjson", orjson.loads
+        except ImportError:
+            if backend == "orjson":
+                raise
+    if backend in ("auto", "msgspec"):
+        try:
+            import msgspec
+            return "msgspec", msgspec.json.Decoder().decode
+        except ImportError:
+            if backend == "msgspec":
+                raise
+    return "json", json.loads
+
+
+codex_event_json_backend, codex_event_json_loads = get_json_loads(CODEX_EVENT_JSON_BACKEND)
+
+
+class CodexEvent:
+    """
+    One decoded line of `codex exec --json` output. The fields the bot dispatches on are extracted and type checked
+    once here, the rest of the event is available as `raw`.
+    """
+    __slots__ = ("type", "item", "item_type", "raw", "line")
+
+    def __init__(self, raw: dict, line: Optional[bytes] = None):
+        event_type = raw.get("type")
+        item = raw.get("item")
+        self.type: str = event_type if isinstance(event_type, str) else ""
+        self.item: Optional[dict] = item if isinstance(item, dict) else None
+        self.item_type: Optional[str] = self.item.get("type") if self.item is not None else None
+        self.raw = raw
+        # the line the event was decoded from (None for events created by the bot)
+        self.line = line
+
+    def __repr__(self):
+        return f"CodexEvent({self.raw!r})"
+
+
+def decode_codex_event(line: bytes, loads: Callable = None) -> Optional[CodexEvent]:
+    """Decodes a raw stdout line, returns None for blank lines and lines that are not JSON objects."""
+    if not line or line.isspace():
+        return None
+    try:
+        raw = (loads or codex_event_json_loads)(line)
+    except ValueError:
+        # json.JSONDecodeError, orjson.JSONDecodeError and msgspec.DecodeError are all ValueErrors
+        log("Could not decode line from process:", line.decode("utf-8", errors="replace").strip(), level=logging.ERROR)
+        return None
+    if not isinstance(raw, dict):
+        return None
+    return CodexEvent(raw, line)
+
+
+def find_json_string_field(text: str, field: str, start: int = 0) -> Optional[str]:
+    """Finds the first `"field": "..."` in (possibly cut off) JSON text and returns the (possibly cut off) value."""
+    match = re.compile(rf'"{field}"\s*:\s*"((?:[^"\\]|\\.)*)').search(text, start)
+    if match is None:
+        return None
+    value = match.group(1)
+    for end in range(len(value), max(len(value) - 6, -1), -1):
+        # a value cut off in the middle of an escape sequence can't be decoded, so try dropping its last few chars
+        try:
+            return json.loads(f'"{value[:end]}"')
+        except ValueError:
+            pass
+    return value
+
+
+def build_truncated_codex_event(head: bytes, size: int, spill_path: Optional[str]) -> bytes:
+    """
+    Builds a small event line that replaces an oversized one, from its first bytes. The event type, item id and item
+    type are kept, so the event is dispatched (and e.g. completes the turn or sets the session id) like the original.
+    """
+    text = head.decode("utf-8", errors="replace")
+    event_type = find_json_string_field(text, "type")
+    notice = f"[CodexMaster: this event was truncated because it is {size} bytes large"
+    notice += f", the full event was saved to {spill_path}]" if spill_path else "]"
+    event = {"type": event_type, "codexmaster_truncated": {"size": size, "spill_path": spill_path}}
+
+    item_start = text.find('"item"')
+    if item_start != -1:
+        item = {
+            "id": find_json_string_field(text, "id", item_start),
+            "type": find_json_string_field(text, "type", item_start),
+        }
+        command = find_json_string_field(text, "command", item_start)
+        if command is not None:
+            item["command"] = command
+        item_text = find_json_string_field(text, "text", item_start)
+        if item_text is not None:
+            item["text"] = f"{item_text[:DISCORD_CHARACTER_LIMIT]}\n\n{notice}"
+        else:
+            item["text"] = notice
+        event["item"] = item
+    elif event_type == "thread.started":
+        event["thread_id"] = find_json_string_field(text, "thread_id")
+    else:
+        event["message"] = notice
+    log(f"Truncated oversized codex event of type {event_type} ({size} bytes)")
+    return json.dumps(event).encode("utf-8")
+
+
+async def iter_codex_event_lines(stream: asyncio.StreamReader, spawn_id: str):
+    """
+    Yields the lines of a codex event stream, like `async for line in stream` but without the line length limit of
+    StreamReader (which raises on long lines and ends the stream). Memory use is bounded: the part of a line beyond
+    CODEX_EVENT_MAX_LINE_BYTES is streamed to a spill file, and the line is replaced by a truncated event.
+    """
+    buffer = bytearray()
+    # state of the oversized line currently being read
+    oversized = None
+
+    async def start_oversized_line(data: bytes):
+        nonlocal oversized
+        oversized = {"head": bytes(data[:CODEX_EVENT_TRUNCATED_HEAD_BYTES]), "size": 0, "file": None, "path": None}
+        if CODEX_EVENT_SPILL_DIR:
+            spill_dir = os.path.join(CODEX_EVENT_SPILL_DIR, spawn_id)
+            os.makedirs(spill_dir, exist_ok=True)
+            oversized["path"] = os.path.join(
+                spill_dir, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl"
+            )
+            oversized["file"] = await aiofiles.open(oversized["path"], "wb")
+        await add_to_oversized_line(data)
+
+    async def add_to_oversized_line(data: bytes):
+        oversized["size"] += len(data)
+        if oversized["file"] is not None:
+            await oversized["file"].write(data)
+
+    async def finish_oversized_line() -> bytes:
+        nonlocal oversized
+        if oversized["file"] is not None:
+            await oversized["file"].close()
+        line = build_truncated_codex_event(oversized["head"], oversized["size"], oversized["path"])
+        oversized = None
+        return line
+
+    while chunk := await stream.read(CODEX_EVENT_READ_CHUNK_BYTES):
+        start = 0
+        while True:
+            newline = chunk.find(b"\n", start)
+            end = newline if newline != -1 else len(chunk)
+            if oversized is not None:
+                await add_to_oversized_line(chunk[start:end])
+            elif newline != -1 and not buffer:
+                # fast path: the whole line is in this chunk
+                if end - start > CODEX_EVENT_MAX_LINE_BYTES:
+                    await start_oversized_line(chunk[start:end])
+            else:
+                buffer += chunk[start:end]
+                if len(buffer) > CODEX_EVENT_MAX_LINE_BYTES:
+                    await start_oversized_line(buffer)
+                    buffer = bytearray()
+            if newline == -1:
+                break
+            if oversized is not None:
+                yield await finish_oversized_line()
+            elif buffer:
+                yield bytes(buffer)
+                buffer = bytearray()
+            else:
+                yield chunk[start:end]
+            start = newline + 1
+
+    if oversized is not None:
+        yield await finish_oversized_line()
+    elif buffer:
+        yield bytes(buffer)
+
+
+def delete_agent_event_spills(spawn_id: str):
+    if CODEX_EVENT_SPILL_DIR:
+        shutil.rmtree(os.path.join(CODEX_EVENT_SPILL_DIR, spawn_id), ignore_errors=True)
+
+
+def get_event_archive_paths(spawn_id: str) -> tuple[str, str]:
+    """The events file (concatenated gzip members, so `zcat` reads it in one go) and the index of an agent."""
+    agent_dir = os.path.join(EVENT_ARCHIVE_DIR, spawn_id)
+    return os.path.join(agent_dir, "events.jsonl.gz"), os.path.join(agent_dir, "index.jsonl")
+
 
+def read_event_archive_index(spawn_id: str) -> tuple[list[dict], bool]:
+    """Returns the index records ({turn, offset, length, events, start_time, end_time, killed}) and if none was torn."""
+    _, index_path = get_event_archive_paths(spawn_id)
+    records = []
+    if not os.path.exists(index_path):
+        return records, True
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # torn write of the last record
+                return records, False
+    return records, True
+
+
+def open_event_archive_writer(spawn_id: str) -> dict:
+    events_path, index_path = get_event_archive_paths(spawn_id)
+    os.makedirs(os.path.dirname(events_path), exist_ok=True)
+    index, index_intact = read_event_archive_index(spawn_id)
+    if not index_intact:
+        write_file_atomically(index_path, "".join(json.dumps(record) + "\n" for record in index))
+    return {
+        "events_file": open(events_path, "r+b" if os.path.exists(events_path) else "wb"),
+        "index_file": open(index_path, "a", encoding="utf-8"),
+        "turn": len(index),
+        # where the last indexed turn ends, everything after it belongs to a turn that never finished
+        "indexed_end": index[-1]["offset"] + index[-1]["length"] if index else 0,
+        "compressor": None,
+        "offset": None,
+        "event_count": 0,
+        "start_time": None,
+    }
 
-async def kill_impl(ctx: discord.ApplicationContext, spawn_id: str, delete: bool = False, revert_chat_state: bool = True):
-    """Kills all active processes associated with the given spawn ID."""
-    if spawn_id not in spawns:
-        await ctx.respond(f"❌ Unknown spawn ID **{spawn_id}**.")
-        return
-    entry = spawns[spawn_id]
-    procs = entry["processes"]
-    execution_mode = entry["execution_mode"]
-    use_docker = is_docker_execution_mode(execution_mode)
-    if not procs:
-        append_msg = "."
-        if delete:
-            append_msg = f" (permanently deleted agent **{spawn_id}**)."
-            if use_docker:
-                # Stop container (without printing a full-blown traceback if not running)
-                await stop_agent_docker_container(spawn_id, silent_errors=True)
-                await delete_agent_docker_container(spawn_id)
-            del spawns[spawn_id]
-        save_spawns()
-        await ctx.respond(f"ℹ️  No active processes for spawn ID **{spawn_id}**" + append_msg)
-        return
 
-    if use_docker:
-        await stop_agent_docker_container(spawn_id)
+def write_archived_event(spawn_id: str, event: CodexEvent):
+    writer = event_archive_writers.get(spawn_id)
+    if writer is None:
+        writer = event_archive_writers[spawn_id] = open_event_archive_writer(spawn_id)
+    events_file = writer["events_file"]
+
+    if event.type == "codexmaster.turn.started":
+        # drop the partial member of a turn that never finished (e.g. its reader failed, or the bot was killed)
+        events_file.truncate(writer["indexed_end"])
+        events_file.seek(writer["indexed_end"])
+        writer["compressor"] = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        writer["offset"] = writer["indexed_end"]
+        writer["event_count"] = 0
+        writer["start_time"] = datetime.datetime.now().isoformat(timespec="seconds")
+    compressor = writer["compressor"]
+    if compressor is None:
+        return
 
-    count = 0
-    for item in procs:
-        proc = item["proc"]
-        try:
-            proc.kill()
-        except Exception:
-            pass
+    line = event.line.rstrip(b"\r\n") if event.line is not None else json.dumps(event.raw).encode("utf-8")
+    events_file.write(compressor.compress(line + b"\n"))
+    writer["event_count"] += 1
+
+    if event.type == "codexmaster.turn.finished":
+        events_file.write(compressor.flush())
+        events_file.flush()
+        writer["compressor"] = None
+        writer["turn"] += 1
+        writer["indexed_end"] = events_file.tell()
+        record = {
+            "turn": writer["turn"],
+            "offset": writer["offset"],
+            "length": writer["indexed_end"] - writer["offset"],
+            "events": writer["event_count"],
+            "start_time": writer["start_time"],
+            "end_time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "killed": bool(event.raw.get("killed")),
+        }
+        writer["index_file"].write(json.dumps(record) + "\n")
+        writer["index_file"].flush()
+
+
+def run_event_archive_writer():
+    """Compresses and writes the archive on its own thread, in the order the events were published."""
+    while True:
+        op, spawn_id, event = event_archive_queue.get()
         try:
-            await proc.wait()
+            if op == "event":
+                write_archived_event(spawn_id, event)
+            elif op == "delete":
+                close_event_archive_writer(spawn_id)
+                shutil.rmtree(os.path.join(EVENT_ARCHIVE_DIR, spawn_id), ignore_errors=True)
+            elif op == "sync":
+                event.set()
         except Exception:
-            pass
+            log(f"Archiving the events of agent {spawn_id} failed:")
+            log(traceback.format_exc(), level=logging.ERROR)
 
-        await ctx.respond(f"✅ Killed a process for agent **{spawn_id}**.")
-        if revert_chat_state:
-            # Signals to the reader of the proc that the proc was killed
-            newly_killed_procs.append(proc)
-        count += 1
 
-    entry["processes"] = []
-    if delete:
-        if use_docker:
-            await delete_agent_docker_container(spawn_id)
-        del spawns[spawn_id]
-    save_spawns()
-    await ctx.respond(f"✅ Killed {count} process(es) for spawn ID **{spawn_id}**.")
+def start_event_archive_writer():
+    global event_archive_writer_thread
+    event_archive_writer_thread = threading.Thread(target=run_event_archive_writer, name="event-archive-writer", daemon=True)
+    event_archive_writer_thread.start()
+    # write what is still queued before the bot exits
+    atexit.register(wait_for_event_archive_writer, 10)
 
 
-@bot.slash_command(name="kill", description="Kill active processes for a spawn ID")
-@option("spawn_id", description="The spawn ID to kill processes for")
-@option("delete", description="Delete it fully?", type=bool)
-@option("revert_chat_state", description="Revert the chat state to before you sent your last message?", type=bool)
-@log_command_usage
-async def kill(ctx: discord.ApplicationContext, spawn_id: str, delete: bool = False, revert_chat_state: bool = True):
-    return await kill_impl(ctx, spawn_id, delete, revert_chat_state)
+def archive_agent_event(spawn_id: str, event: CodexEvent):
+    """Event sink that streams the events of every turn into a new gzip member of the agent's archive."""
+    event_archive_queue.put(("event", spawn_id, event))
 
 
-@bot.slash_command(name="delete_all_agents", description="Delete spawns.json")
-@option("confirmation", description="Type CONFIRM to confirm the action")
-@log_command_usage
-async def del_spawns_file(ctx: discord.ApplicationContext, confirmation: str):
-    if confirmation != "CONFIRM":
-        await ctx.respond("❌ You must confirm this action by typing CONFIRM in the confirmation field")
-        return
-    spawn_ids = set(spawns)
-    for spawn_id in spawn_ids:
-        await kill_impl(ctx, spawn_id, delete=True)
-    if os.path.exists("spawns.json"):
-        os.remove("spawns.json")
-    await ctx.respond("✅ Killed and deleted all agents and docker containers - EVERYTHING!")
+def wait_for_event_archive_writer(timeout: Optional[float] = None) -> bool:
+    """Blocks until everything archived so far is written. Returns False on timeout."""
+    done = threading.Event()
+    event_archive_queue.put(("sync", None, done))
+    return done.wait(timeout)
 
 
-@bot.slash_command(name="list", description="List active workers and their processes with PID and runtime")
-@log_command_usage
-async def list_spawns(ctx: discord.ApplicationContext):
-    """Lists all spawn IDs and their active processes, showing PID and runtime."""
-    if not spawns:
-        await ctx.respond("ℹ️  No spawn workers registered.")
+def read_archived_turn_events(spawn_id: str, record: dict) -> list[CodexEvent]:
+    """Reads only the gzip member of the turn, so the cost depends on the size of the turn, not of the archive."""
+    events_path, _ = get_event_archive_paths(spawn_id)
+    with open(events_path, "rb") as f:
+        f.seek(record["offset"])
+        member = f.read(record["length"])
+    events = []
+    for line in gzip.decompress(member).splitlines():
+        event = decode_codex_event(line)
+        if event is not None:
+            events.append(event)
+    return events
+
+
+def close_event_archive_writer(spawn_id: str):
+    writer = event_archive_writers.pop(spawn_id, None)
+    if writer is not None:
+        writer["events_file"].close()
+        writer["index_file"].close()
+
+
+def delete_agent_event_archive(spawn_id: str):
+    if EVENT_ARCHIVE_DIR:
+        # after the events of the agent that are still queued
+        event_archive_queue.put(("delete", spawn_id, None))
+
+
+async def record_turn_usage(spawn_id: str, event: CodexEvent):
+    """Event sink that appends the token usage of every completed turn to the agent's ledger of the day."""
+    if event.type == "codexmaster.turn.started":
+        entry = spawns.get(spawn_id)
+        model = entry["model"] if entry is not None else "default"
+        provider = entry["provider"] if entry is not None else "openai"
+        usage_ledger_turns[spawn_id] = {"start_time": time.monotonic(), "model": model, "provider": provider}
+        return
+    if event.type == "codexmaster.turn.finished":
+        usage_ledger_turns.pop(spawn_id, None)
+        return
+    usage = event.raw.get("usage") if event.type == "turn.completed" else None
+    turn = usage_ledger_turns.get(spawn_id)
+    if not isinstance(usage, dict) or turn is None:
         return
     now = datetime.datetime.now()
-    lines: list[str] = []
-    for sid, entry in spawns.items():
-        procs = entry["processes"]
-        execution_mode = entry["execution_mode"]
-        verbosity = entry["verbosity"]
-        if procs:
-            reasoning_effort = entry["reasoning_effort"]
-            lines.append(f"**{sid}** ({execution_mode}, {verbosity}, effort={reasoning_effort}):")
-            for item in procs:
-                p = item["proc"]
-                delta = now - item["start_time"]
-                secs = int(delta.total_seconds())
-                h, rem = divmod(secs, 3600)
-                m, s = divmod(rem, 60)
-                if h:
-                    elapsed = f"{h}h{m}m{s}s"
-                elif m:
-                    elapsed = f"{m}m{s}s"
-                else:
-                    elapsed = f"{s}s"
-                lines.append(f" • PID {p.pid} – running for {elapsed}")
-        else:
-            reasoning_effort = entry["reasoning_effort"]
-            lines.append(f"**{sid}** ({execution_mode}, {verbosity}, effort={reasoning_effort}): no active processes")
-    await ctx.respond("\n".join(lines))
+    record = {
+        "time": now.isoformat(timespec="seconds"),
+        "model": turn["model"],
+        "provider": turn["provider"],
+        "seconds": round(time.monotonic() - turn["start_time"], 3),
+    }
+    for key in ("input_tokens", "cached_input_tokens", "output_tokens", "reasoning_output_tokens"):
+        value = usage.get(key)
+        record[key] = value if isinstance(value, int) and not isinstance(value, bool) else 0
+    # off the loop; the sink handles the events of an agent one after the other, so the records stay in order
+    await asyncio.to_thread(append_usage_ledger_record, spawn_id, f"{now:%Y-%m-%d}", record)
+
+
+def append_usage_ledger_record(spawn_id: str, day: str, record: dict):
+    ledger_dir = os.path.join(USAGE_LEDGER_DIR, spawn_id)
+    os.makedirs(ledger_dir, exist_ok=True)
+    with open(os.path.join(ledger_dir, f"{day}.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_usage_ledger(days: int, spawn_id: Optional[str] = None) -> dict[str, list[dict]]:
+    """The ledger records of the last `days` days (including today) per agent."""
+    if not os.path.isdir(USAGE_LEDGER_DIR):
+        return {}
+    first_day = f"{datetime.date.today() - datetime.timedelta(days=days - 1):%Y-%m-%d}"
+    spawn_ids = [spawn_id] if spawn_id is not None else sorted(os.listdir(USAGE_LEDGER_DIR))
+    records: dict[str, list[dict]] = {}
+    for sid in spawn_ids:
+        ledger_dir = os.path.join(USAGE_LEDGER_DIR, sid)
+        if not os.path.isdir(ledger_dir):
+            continue
+        for filename in sorted(os.listdir(ledger_dir)):
+            if not filename.endswith(".jsonl") or filename[:-len(".jsonl")] < first_day:
+                continue
+            with open(os.path.join(ledger_dir, filename), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.setdefault(sid, []).append(json.loads(line))
+                    except ValueError:
+                        # torn write of the last record
+                        continue
+    return records
+
+
+def sum_usage_records(records: list[dict]) -> dict:
+    totals = {
+        "turns": len(records),
+        "input_tokens": 0,
+        "cached_input_tokens": 0,
+        "output_tokens": 0,
+        "reasoning_output_tokens": 0,
+        "seconds": 0.0,
+        "cost": 0.0,
+        "unpriced_models": set(),
+    }
+    for record in records:
+        for key in ("input_tokens", "cached_input_tokens", "output_tokens", "reasoning_output_tokens", "seconds"):
+            totals[key] += record.get(key, 0)
+        prices = MODEL_PRICES.get(record.get("model"))
+        if prices is None:
+            totals["unpriced_models"].add(record.get("model"))
+            continue
+        input_price, cached_input_price, output_price = prices
+        # codex counts cached input tokens as part of the input tokens (and reasoning tokens as output tokens)
+        uncached_input_tokens = record.get("input_tokens", 0) - record.get("cached_input_tokens", 0)
+        totals["cost"] += (
+            uncached_input_tokens * input_price
+            + record.get("cached_input_tokens", 0) * cached_input_price
+            + record.get("output_tokens", 0) * output_price
+        ) / 1_000_000
+    return totals
+
+
+def format_usage_totals(totals: dict) -> str:
+    parts = [
+        f"{totals['turns']} turn(s)",
+        f"in={totals['input_tokens']:,}",
+        f"cached_in={totals['cached_input_tokens']:,}",
+    ]
+    if totals["input_tokens"]:
+        parts[-1] += f" ({totals['cached_input_tokens'] / totals['input_tokens']:.0%} cached)"
+    parts.append(f"out={totals['output_tokens']:,}")
+    parts.append(f"reasoning_out={totals['reasoning_output_tokens']:,}")
+    if totals["seconds"]:
+        parts.append(f"{totals['output_tokens'] / totals['seconds']:.1f} out tokens/s")
+    if totals["unpriced_models"]:
+        unpriced = ", ".join(sorted(str(m) for m in totals["unpriced_models"]))
+        parts.append(f"cost ≥ ${totals['cost']:.2f} (no price for {unpriced})")
+    else:
+        parts.append(f"cost ≈ ${totals['cost']:.2f}")
+    return ", ".join(parts)
 
 
-def format_response(msg: str) -> str:
-    return msg
+def extract_codex_session_id_from_event(event: CodexEvent) -> Optional[str]:
+    if event.type == "thread.started":
+        thread_id = event.raw.get("thread_id")
+        return thread_id if isinstance(thread_id, str) else None
+    return None
 
 
-def format_thought(msg: str) -> str:
-    indicator = "💭💭💭💭💭"
-    return f"{indicator}\n{msg}\n{indicator}"
+class AgentEventBus:
+    """
+    Publishes the CodexEvents of an agent to its subscribers. Every subscriber has its own bounded queue and task, so a
+    slow subscriber never blocks the others or the reader of the codex output: lossy subscribers drop events when their
+    queue is full, and publishing only waits for lossless ones (which must be fast, e.g. state tracking).
+    Besides the codex events, the bus carries codexmaster.turn.started and codexmaster.turn.finished events.
+    """
 
+    def __init__(self, spawn_id: str):
+        self.spawn_id = spawn_id
+        self.subscriptions: list[dict] = []
+
+    def subscribe(self, name: str, handler: Callable, max_queue_size: int = AGENT_EVENT_QUEUE_SIZE, lossless: bool = False) -> dict:
+        """`handler(event)` may be a function or a coroutine function."""
+        subscription = {
+            "name": name,
+            "handler": handler,
+            "queue": asyncio.Queue(max_queue_size),
+            "lossless": lossless,
+            "dropped": 0,
+        }
+        subscription["task"] = bot.loop.create_task(self._run_subscription(subscription))
+        self.subscriptions.append(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription: dict):
+        """Waits until the subscriber has handled all events it got so far, then removes it."""
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+            await subscription["queue"].put(None)
+        await subscription["task"]
+
+    async def close(self):
+        for subscription in list(self.subscriptions):
+            await self.unsubscribe(subscription)
+
+    async def publish(self, event: CodexEvent):
+        for subscription in list(self.subscriptions):
+            if subscription["lossless"]:
+                await subscription["queue"].put(event)
+                continue
+            try:
+                subscription["queue"].put_nowait(event)
+            except asyncio.QueueFull:
+                subscription["dropped"] += 1
 
-def format_command(msg: str) -> str:
-    return f'`{msg}`'
+    async def _run_subscription(self, subscription: dict):
+        queue = subscription["queue"]
+        while (event := await queue.get()) is not None:
+            try:
+                result = subscription["handler"](event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                log(f"Event sink '{subscription['name']}' of agent {self.spawn_id} failed:")
+                log(traceback.format_exc(), level=logging.ERROR)
+        if subscription["dropped"]:
+            log(f"Event sink '{subscription['name']}' of agent {self.spawn_id} dropped {subscription['dropped']} events (queue full)")
 
 
-def format_code_block(msg: str) -> str:
-    return f'```\n{msg}\n```'
+def register_agent_event_sink(name: str, handler: Callable, max_queue_size: int = AGENT_EVENT_QUEUE_SIZE, lossless: bool = False):
+    """Subscribes `handler(spawn_id, event)` to the event bus of every agent, including agents created later."""
+    sink = {"name": name, "handler": handler, "max_queue_size": max_queue_size, "lossless": lossless}
+    agent_event_sinks.append(sink)
+    for spawn_id, bus in agent_event_buses.items():
+        bus.subscribe(name, functools.partial(handler, spawn_id), max_queue_size, lossless)
 
 
-def format_command_output(msg: str) -> str:
-    return format_code_block(msg)
+def get_agent_event_bus(spawn_id: str) -> AgentEventBus:
+    bus = agent_event_buses.get(spawn_id)
+    if bus is None:
+        bus = agent_event_buses[spawn_id] = AgentEventBus(spawn_id)
+        for sink in agent_event_sinks:
+            bus.subscribe(sink["name"], functools.partial(sink["handler"], spawn_id), sink["max_queue_size"], sink["lossless"])
+    return bus
 
 
-def extract_codex_session_id_from_event(event: dict) -> Optional[str]:
-    event_type = event.get("type")
-    if event_type == "thread.started":
-        thread_id = event.get("thread_id")
-        return thread_id if isinstance(thread_id, str) else None
-    return None
+async def close_agent_event_bus(spawn_id: str):
+    bus = agent_event_buses.pop(spawn_id, None)
+    if bus is not None:
+        await bus.close()
+
+
+if EVENT_ARCHIVE_DIR:
+    # lossless, the archive has to be complete (the sink only hands the events to the writer thread)
+    register_agent_event_sink("archive", archive_agent_event, lossless=True)
+    start_event_archive_writer()
+if USAGE_LEDGER_DIR:
+    register_agent_event_sink("usage_ledger", record_turn_usage, lossless=True)
 
 
 def format_token_usage_summary(usage: dict) -> str:
@@ -904,7 +3467,7 @@ def format_codex_item_tool(item: dict) -> str:
             return format_command(f"web_search {query}")
         return format_command("web_search")
 
-    if item_type in ("local_shell_call", "shell"):
+    if item_type in ("local_shell_call", "shell", "command_execution"):
         cmd = item.get("command")
         if isinstance(cmd, list):
             return format_command(" ".join(map(str, cmd)))
@@ -977,74 +3540,101 @@ def resolve_attachment_paths(worker_entry: dict, attachment_paths: list[str]) ->
     return resolved_files, errors
 
 
-def send_codex_notification(worker_entry: dict, event: dict, verbosity: str, reference=None):
-    action = ""
-    messages: list[str] = []
-    verbosity = normalize_agent_verbosity(verbosity)
+def notify_error_event(event: CodexEvent, verbosity: str) -> Optional[tuple[str, list[str]]]:
+    msg = event.raw.get("message")
+    if isinstance(msg, str) and msg:
+        return " error", [format_code_block(msg)]
+    return None
+
+
+def notify_turn_failed_event(event: CodexEvent, verbosity: str) -> Optional[tuple[str, list[str]]]:
+    err = event.raw.get("error") or {}
+    msg = err.get("message") if isinstance(err, dict) else None
+    if isinstance(msg, str) and msg:
+        return " error", [format_code_block(msg)]
+    return None
+
+
+def notify_turn_completed_event(event: CodexEvent, verbosity: str) -> Optional[tuple[str, list[str]]]:
+    if is_live_agent_verbosity(verbosity):
+        # shown in the live status message
+        return None
+    usage = event.raw.get("usage")
+    if isinstance(usage, dict):
+        return " used tokens", [format_token_usage_summary(usage)]
+    return None
+
+
+def notify_item_event(event: CodexEvent, verbosity: str) -> Optional[tuple[str, list[str]]]:
+    item = event.item
+    if item is None:
+        return None
     verbose = is_verbose_agent_verbosity(verbosity)
+    item_completed = event.type == "item.completed"
+    if event.item_type == "agent_message":
+        msg = item.get("text")
+        if item_completed and isinstance(msg, str) and msg:
+            return " responded", [format_response(msg)]
+        return None
+    if event.item_type == "reasoning":
+        msg = item.get("text")
+        if verbose and item_completed and isinstance(msg, str) and msg:
+            return " thought", [format_thought(msg)]
+        return None
+    if not verbose:
+        return None
+    tool = format_codex_item_tool(item)
+    output = item.get("aggregated_output")
+    if item_completed and isinstance(output, str) and output.strip():
+        # long output is spilled into an attachment by send_notification
+        tool = f"{tool}\n{format_command_output(output.rstrip())}"
+    return (" tool" if item_completed else " started tool"), [tool]
+
+
+# Event type -> handler that returns the (action, messages) to notify the user about, or None.
+# Events without a handler (thread.started, turn.started, turn.cancelled, unknown ones) are not shown.
+CODEX_EVENT_NOTIFICATION_HANDLERS: dict[str, Callable[[CodexEvent, str], Optional[tuple[str, list[str]]]]] = {
+    "error": notify_error_event,
+    "turn.failed": notify_turn_failed_event,
+    "turn.completed": notify_turn_completed_event,
+    "item.started": notify_item_event,
+    "item.completed": notify_item_event,
+}
+
+
+def render_archived_turn(spawn_id: str, events: list[CodexEvent]) -> str:
+    """Renders a turn like verbose notifications would have shown it, including the prompt."""
+    parts = []
+    for event in events:
+        if event.type == "codexmaster.turn.started":
+            prompt = event.raw.get("prompt")
+            if isinstance(prompt, str):
+                parts.append(f"**Prompt:**\n{prompt}")
+            continue
+        if event.type == "codexmaster.turn.finished":
+            if event.raw.get("killed"):
+                parts.append("**Killed** (the chat state was reverted)")
+            continue
+        handler = CODEX_EVENT_NOTIFICATION_HANDLERS.get(event.type)
+        notification = handler(event, "verbose") if handler is not None else None
+        if notification is not None:
+            action, messages = notification
+            parts.extend(f"**{spawn_id}**{action}:\n{m}" for m in messages)
+    return "\n\n".join(parts)
 
+
+def send_codex_notification(worker_entry: dict, event: CodexEvent, verbosity: str, reference=None):
+    handler = CODEX_EVENT_NOTIFICATION_HANDLERS.get(event.type)
+    if handler is None:
+        return
     try:
-        event_type = event.get("type")
-        if event_type == "error":
-            msg = event.get("message")
-            if isinstance(msg, str) and msg:
-                messages = [format_code_block(msg)]
-                action = " error"
-            else:
-                return
-        elif event_type == "turn.failed":
-            err = event.get("error") or {}
-            msg = err.get("message") if isinstance(err, dict) else None
-            if isinstance(msg, str) and msg:
-                messages = [format_code_block(msg)]
-                action = " error"
-            else:
-                return
-        elif event_type == "turn.completed":
-            usage = event.get("usage")
-            if isinstance(usage, dict):
-                messages = [format_token_usage_summary(usage)]
-                action = " used tokens"
-            else:
-                return
-        elif event_type in ("item.started", "item.completed"):
-            item = event.get("item")
-            if not isinstance(item, dict):
-                return
-            item_type = item.get("type")
-            item_completed = event_type == "item.completed"
-            if item_type == "agent_message":
-                if not item_completed:
-                    return
-                msg = item.get("text")
-                if isinstance(msg, str) and msg:
-                    messages = [format_response(msg)]
-                    action = " responded"
-                else:
-                    return
-            elif item_type == "reasoning":
-                if not (verbose and item_completed):
-                    return
-                msg = item.get("text")
-                if isinstance(msg, str) and msg:
-                    messages = [format_thought(msg)]
-                    action = " thought"
-                else:
-                    return
-            else:
-                if not verbose:
-                    return
-                messages = [format_codex_item_tool(item)]
-                action = " tool"
-                if not item_completed:
-                    action = " started tool"
-        elif event_type in ("thread.started", "turn.started", "turn.cancelled"):
-            return
-        else:
-            return
+        notification = handler(event, normalize_agent_verbosity(verbosity))
     except Exception:
-        log(traceback.format_exc())
+        log(traceback.format_exc(), level=logging.ERROR)
         return
+    if notification is None:
+        return
+    action, messages = notification
 
     for m in messages:
         attachment_paths: list[str] = []
@@ -1065,6 +3655,8 @@ def send_codex_notification(worker_entry: dict, event: dict, verbosity: str, ref
             reference=reference,
             action=action,
             attachment_paths=attachment_paths,
+            # only these may be dropped when the agent produces output faster than it can be sent
+            droppable=action in (" thought", " tool", " started tool"),
         )
 
 
@@ -1095,6 +3687,224 @@ def close_unterminated_code_blocks(s: str) -> str:
     return s
 
 
+def get_outbound_channel_queue(channel) -> dict:
+    state = outbound_channel_queues.get(channel.id)
+    if state is None:
+        state = {
+            "channel": channel,
+            "items": collections.deque(),
+            "task": None,
+            "tokens": float(DISCORD_SEND_RATE_LIMIT_MESSAGES),
+            "last_refill": time.monotonic(),
+            # summary label -> how many messages with that label were dropped since the last send
+            "dropped": collections.Counter(),
+        }
+        outbound_channel_queues[channel.id] = state
+    return state
+
+
+def enqueue_outbound_message(
+    channel,
+    content: str,
+    reference=None,
+    files: Optional[list] = None,
+    droppable: bool = False,
+    summary_label: str = "",
+):
+    """
+    Queues a message for the sender task of the channel, which is started if it is not running.
+    `files` are file paths or (filename, content bytes) tuples.
+    """
+    state = get_outbound_channel_queue(channel)
+    items = state["items"]
+    items.append({
+        "content": content,
+        "reference": reference,
+        "files": files or [],
+        "droppable": droppable,
+        "summary_label": summary_label,
+    })
+
+    # Summarize-and-drop: the oldest droppable messages make room once the queue is over its bound
+    overflow = len(items) - DISCORD_SEND_QUEUE_MAX_MESSAGES
+    if overflow > 0:
+        for item in list(items):
+            if overflow <= 0:
+                break
+            if item["droppable"]:
+                items.remove(item)
+                state["dropped"][item["summary_label"]] += 1
+                inc_metric("codexmaster_discord_messages_dropped_total")
+                overflow -= 1
+
+    if state["task"] is None or state["task"].done():
+        state["task"] = bot.loop.create_task(run_outbound_channel_sender(state))
+
+
+async def take_outbound_send_token(state: dict):
+    """Token bucket per channel, so we stay below Discord's rate limit instead of running into 429s."""
+    while True:
+        now = time.monotonic()
+        refill = (now - state["last_refill"]) * DISCORD_SEND_RATE_LIMIT_MESSAGES / DISCORD_SEND_RATE_LIMIT_PERIOD
+        state["tokens"] = min(float(DISCORD_SEND_RATE_LIMIT_MESSAGES), state["tokens"] + refill)
+        state["last_refill"] = now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            return
+        await asyncio.sleep((1 - state["tokens"]) * DISCORD_SEND_RATE_LIMIT_PERIOD / DISCORD_SEND_RATE_LIMIT_MESSAGES)
+
+
+def pop_outbound_batch(state: dict) -> dict:
+    """Pops the next message, merged with the following small text-only messages that fit into the same message."""
+    items = state["items"]
+    if state["dropped"]:
+        dropped_text = ", ".join(f"{count}× {label}" for label, count in state["dropped"].items())
+        dropped_total = sum(state["dropped"].values())
+        state["dropped"].clear()
+        batch = {
+            "content": f"⚠️ Skipped {dropped_total} message(s) to keep up with the agents: {dropped_text}"[:DISCORD_CHARACTER_LIMIT],
+            "reference": items[0]["reference"],
+            "files": [],
+        }
+    else:
+        batch = dict(items.popleft())
+    while (
+        items
+        and not batch["files"]
+        and not items[0]["files"]
+        and items[0]["reference"] is batch["reference"]
+        and len(batch["content"]) + 1 + len(items[0]["content"]) <= DISCORD_CHARACTER_LIMIT
+    ):
+        batch["content"] += "\n" + items.popleft()["content"]
+    return batch
+
+
+def make_discord_file(file) -> discord.File:
+    if isinstance(file, str):
+        return discord.File(fp=file, filename=os.path.basename(file))
+    filename, content = file
+    return discord.File(fp=io.BytesIO(content), filename=filename)
+
+
+async def run_outbound_channel_sender(state: dict):
+    channel = state["channel"]
+    while state["items"]:
+        # Messages that arrive while we wait for the rate limit get merged into this send
+        await take_outbound_send_token(state)
+        batch = pop_outbound_batch(state)
+        kwargs = {"reference": batch["reference"]}
+        start_time = time.perf_counter()
+        try:
+            if batch["files"]:
+                kwargs["files"] = [make_discord_file(file) for file in batch["files"]]
+            await channel.send(batch["content"], **kwargs)
+            observe_metric("codexmaster_discord_send_seconds", time.perf_counter() - start_time)
+        except Exception:
+            inc_metric("codexmaster_discord_send_errors_total")
+            log(f"Failed to send a message to channel {channel.id}:")
+            log(traceback.format_exc(), level=logging.ERROR)
+
+
+def get_code_fence_header(line: str) -> str:
+    """The opening fence of a code block, e.g. ```python (language tags are capped so a header always fits)."""
+    tag = line.strip()[3:].strip()
+    return "```" + tag.split()[0][:32] if tag else "```"
+
+
+def split_message_into_chunks(msg: str, limit: int = DISCORD_CHARACTER_LIMIT, add_num_lines_left: bool = False) -> list[str]:
+    """
+    Splits a message into chunks of at most `limit` characters in a single pass over its lines. Chunks end at line
+    boundaries (overlong lines are split at whitespace where possible), and a code block that spans several chunks is
+    closed at the end of each chunk and reopened with its language tag at the start of the next one.
+    """
+    if len(msg) <= limit:
+        return [close_unterminated_code_blocks(msg)]
+
+    fence_close = "\n```"
+    lines_left = msg.count("\n") + 1
+    lines_left_reserve = len(f"\n\n... ({lines_left} lines left)") if add_num_lines_left else 0
+    budget = limit - len(fence_close) - lines_left_reserve
+
+    chunks: list[str] = []
+    parts: list[str] = []
+    size = 0  # == len("\n".join(parts))
+    open_fence: Optional[str] = None
+
+    def flush():
+        nonlocal parts, size
+        chunk = "\n".join(parts)
+        if open_fence is not None:
+            chunk += fence_close
+        if add_num_lines_left:
+            chunk += f"\n\n... ({lines_left} lines left)"
+        chunks.append(chunk)
+        parts = [open_fence] if open_fence is not None else []
+        size = len(open_fence) if open_fence is not None else 0
+
+    for line in msg.split("\n"):
+        is_fence_line = line.count("```") % 2 == 1
+        rest = line
+        while True:
+            added_size = len(rest) + (1 if parts else 0)
+            if size + added_size <= budget:
+                parts.append(rest)
+                size += added_size
+                break
+            if len(parts) > (1 if open_fence is not None else 0):
+                # the chunk has content, continue on a fresh one
+                flush()
+                continue
+            # the line does not even fit into an empty chunk, so split it (at whitespace if that doesn't waste much)
+            room = max(budget - size - (1 if parts else 0), 1)
+            cut = rest.rfind(" ", 0, room) + 1
+            if cut <= room // 2:
+                cut = room
+            parts.append(rest[:cut])
+            size += cut + (1 if len(parts) > 1 else 0)
+            rest = rest[cut:]
+            flush()
+        lines_left -= 1
+        if is_fence_line:
+            open_fence = get_code_fence_header(line) if open_fence is None else None
+
+    # nothing is left after the last chunk
+    add_num_lines_left = False
+    flush()
+    return chunks
+
+
+def build_spill_preview(text: str) -> str:
+    """Head and tail of a long text (cut at line boundaries where possible), with code blocks closed/reopened."""
+    # The first chunk only depends on the lines up to the first one that does not fit, which start within the preview
+    head = split_message_into_chunks(text[:DISCORD_SPILL_PREVIEW_CHARS * 2], DISCORD_SPILL_PREVIEW_CHARS)[0]
+    # where the head ends in the text (the chunker may have closed a code block after it)
+    head_end = len(os.path.commonprefix([head, text[:len(head)]]))
+    tail_start = len(text) - DISCORD_SPILL_PREVIEW_CHARS
+    next_line_start = text.find("\n", tail_start, tail_start + DISCORD_SPILL_PREVIEW_CHARS // 2) + 1
+    if next_line_start:
+        tail_start = next_line_start
+    tail = text[tail_start:]
+    if text.count("```", 0, tail_start) % 2 == 1:
+        # the tail starts inside a code block, so reopen it
+        fence_line_start = text.rfind("\n", 0, text.rfind("```", 0, tail_start)) + 1
+        fence_line_end = text.find("\n", fence_line_start)
+        tail = get_code_fence_header(text[fence_line_start:fence_line_end]) + "\n" + tail
+    # the lines between the one the head ends on and the one the tail starts on
+    omitted_lines = text.count("\n", head_end, tail_start) - 1
+    omitted = f"{omitted_lines} more lines" if omitted_lines > 0 else f"{tail_start - head_end} more characters"
+    return (
+        f"{head}\n\n*... {omitted}, the full output is attached ...*\n\n"
+        f"{close_unterminated_code_blocks(tail)}"
+    )
+
+
+def build_spill_file(text: str, basename: str) -> tuple[str, bytes]:
+    content = text.encode("utf-8")
+    if len(content) > DISCORD_SPILL_GZIP_THRESHOLD_BYTES:
+        return f"{basename}.txt.gz", gzip.compress(content, compresslevel=6)
+    return f"{basename}.txt", content
+
+
 def send_notification(
     worker_entry: dict,
     notification: str,
@@ -1102,9 +3912,11 @@ def send_notification(
     reference=None,
     action='',
     attachment_paths: Optional[list[str]] = None,
+    droppable: bool = False,
 ):
     channel, user_id, spawn_id = worker_entry["channel"], worker_entry["user"].id, worker_entry["spawn_id"]
     ping = f"<@{user_id}> " if critical else ""
+    start_time = time.perf_counter()
 
     resolved_attachments: list[str] = []
     attachment_errors: list[str] = []
@@ -1118,34 +3930,141 @@ def send_notification(
             else f"Attachment errors:\n{attachment_errors_text}"
         )
 
+    spill_files = []
+    if DISCORD_SPILL_THRESHOLD_CHARS and len(notification) > DISCORD_SPILL_THRESHOLD_CHARS:
+        # One message with a preview and one file, instead of dozens of messages
+        spill_basename = f"{spawn_id}{action.replace(' ', '-')}-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+        spill_files.append(build_spill_file(notification, spill_basename))
+        notification = build_spill_preview(notification)
+
     msg = f"{ping}**{spawn_id}**{action}:\n{notification}"
 
+    msg_pieces = collections.deque(
+        split_message_into_chunks(msg, DISCORD_CHARACTER_LIMIT, bool(DISCORD_LONG_RESPONSE_ADD_NUM_LINES_LEFT))
+    )
+    # the spill file goes with the preview, the files the agent attached follow (Discord allows 10 files per message)
+    files = spill_files + resolved_attachments
     is_first_iter = True
-    while msg or resolved_attachments:
-        msg_piece = close_unterminated_code_blocks(msg[:DISCORD_CHARACTER_LIMIT]) + (
-            f"\n\n... ({len(msg[DISCORD_CHARACTER_LIMIT:].splitlines())} lines left)"
-            if DISCORD_LONG_RESPONSE_ADD_NUM_LINES_LEFT and len(msg) >= DISCORD_CHARACTER_LIMIT
-            else ""
-        )
-        msg = msg[DISCORD_CHARACTER_LIMIT:]
-        if DISCORD_LONG_RESPONSE_BULK_AS_CODEBLOCK and not is_first_iter:
+    while msg_pieces or files:
+        msg_piece = msg_pieces.popleft() if msg_pieces else ""
+        if DISCORD_LONG_RESPONSE_BULK_AS_CODEBLOCK and not is_first_iter and msg_piece:
             # Put the bulk of long messages into code blocks
             msg_piece = f"```\n{msg_piece}\n```"
 
-        kwargs = {"reference": reference}
-        if resolved_attachments:
-            attachment_batch_paths = resolved_attachments[:10]
-            resolved_attachments = resolved_attachments[10:]
-            kwargs["files"] = [
-                discord.File(fp=attachment_path, filename=os.path.basename(attachment_path))
-                for attachment_path in attachment_batch_paths
-            ]
-            if not msg_piece:
-                msg_piece = f"{ping}**{spawn_id}**{action}:"
-
-        coro = channel.send(msg_piece, **kwargs)
-        asyncio.run_coroutine_threadsafe(coro, bot.loop)
+        files_batch = files[:10]
+        files = files[10:]
+        if files_batch and not msg_piece:
+            msg_piece = f"{ping}**{spawn_id}**{action}:"
+
+        enqueue_outbound_message(
+            channel,
+            msg_piece,
+            reference=reference,
+            files=files_batch,
+            droppable=droppable,
+            summary_label=f"**{spawn_id}**{action}",
+        )
         is_first_iter = False
+    observe_metric("codexmaster_send_notification_seconds", time.perf_counter() - start_time, *get_agent_metric_labels(spawn_id))
+
+
+def format_duration(seconds: float) -> str:
+    h, rem = divmod(int(seconds), 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return f"{h}h{m}m{s}s"
+    if m:
+        return f"{m}m{s}s"
+    return f"{s}s"
+
+
+def start_live_status(worker_entry: dict, reference=None) -> dict:
+    """Starts the status message of a turn in live verbosity mode, see update_live_status and finish_live_status."""
+    status = {
+        "entry": worker_entry,
+        "channel": worker_entry["channel"],
+        "reference": reference,
+        "start_time": time.monotonic(),
+        "current_tool": None,
+        "tool_count": 0,
+        "usage": {},
+        "message": None,
+        "last_content": None,
+        "finished": False,
+        "wakeup": asyncio.Event(),
+    }
+    status["task"] = bot.loop.create_task(run_live_status_editor(status))
+    return status
+
+
+def update_live_status(status: dict, event: CodexEvent):
+    """Only records the event, the message is edited by the editor task at most every LIVE_STATUS_EDIT_INTERVAL seconds."""
+    if event.type == "turn.completed":
+        usage = event.raw.get("usage")
+        if isinstance(usage, dict):
+            for key, value in usage.items():
+                if isinstance(value, int):
+                    status["usage"][key] = status["usage"].get(key, 0) + value
+    elif event.type in ("item.started", "item.completed"):
+        if event.item is None or event.item_type in ("agent_message", "reasoning"):
+            return
+        if event.type == "item.started":
+            status["current_tool"] = format_codex_item_tool(event.item)
+        else:
+            status["tool_count"] += 1
+            status["current_tool"] = None
+
+
+def format_live_status(status: dict) -> str:
+    spawn_id = status["entry"]["spawn_id"]
+    elapsed = format_duration(time.monotonic() - status["start_time"])
+    if status["finished"]:
+        lines = [f"🏁 **{spawn_id}** finished after {elapsed}"]
+    else:
+        lines = [f"⚙️ **{spawn_id}** is working... ({elapsed})"]
+    if status["current_tool"]:
+        current_tool = status["current_tool"]
+        if len(current_tool) > DISCORD_CHARACTER_LIMIT // 2:
+            current_tool = close_unterminated_code_blocks(current_tool[:DISCORD_CHARACTER_LIMIT // 2] + " ...")
+        lines.append(f"Current tool: {current_tool}")
+    lines.append(f"Tool calls: {status['tool_count']}")
+    if status["usage"]:
+        lines.append(format_token_usage_summary(status["usage"]))
+    return "\n".join(lines)
+
+
+async def edit_live_status(status: dict):
+    content = format_live_status(status)
+    if content == status["last_content"]:
+        return
+    # Sends and edits share the rate limit bucket of the channel with the outbound queue
+    await take_outbound_send_token(get_outbound_channel_queue(status["channel"]))
+    try:
+        if status["message"] is None:
+            status["message"] = await status["channel"].send(content, reference=status["reference"])
+        else:
+            await status["message"].edit(content=content)
+        status["last_content"] = content
+    except Exception:
+        log("Failed to update live status message:")
+        log(traceback.format_exc(), level=logging.ERROR)
+
+
+async def run_live_status_editor(status: dict):
+    while not status["finished"]:
+        await edit_live_status(status)
+        try:
+            await asyncio.wait_for(status["wakeup"].wait(), timeout=LIVE_STATUS_EDIT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    await edit_live_status(status)
+
+
+async def finish_live_status(status: dict):
+    status["finished"] = True
+    status["current_tool"] = None
+    status["wakeup"].set()
+    await status["task"]
 
 
 async def save_message_attachments(message, save_directory):
@@ -1237,23 +4156,11 @@ async def on_message(message: discord.Message):
         )
         return
 
-    log(f"Received valid and authorized request to send a message to agent {spawn_id}...")
+    log(f"Received valid and authorized request to send a message to agent {spawn_id}...", agent=spawn_id)
 
     entry = spawns[spawn_id]
-    entry['user'] = message.author
-    entry['channel'] = message.channel
-
-    codex_session_id = entry["codex_session_id"]
     provider = entry["provider"]
-    model = entry["model"]
-    reasoning_effort = entry["reasoning_effort"]
-    working_dir = entry["working_dir"]
-    leak_env = entry["leak_env"]
     execution_mode = entry["execution_mode"]
-    verbosity = entry["verbosity"]
-    chat_message_count = entry.get("chat_message_count", 0)
-    if isinstance(chat_message_count, bool) or not isinstance(chat_message_count, int) or chat_message_count < 0:
-        chat_message_count = 0
     if provider not in ALLOWED_PROVIDERS:
         await message.channel.send(
             f"❌ This agent uses provider '{provider}', which is not allowed by current bot config. Recreate the agent or update `ALLOWED_PROVIDERS`.",
@@ -1267,17 +4174,83 @@ async def on_message(message: discord.Message):
         await message.channel.send("❌ This agent is configured for host execution, but host execution is disabled.", reference=message)
         return
 
-    prev_session_file_content = None
-    if codex_session_id:
-        prev_session_file_path = find_codex_session_file_path(codex_session_id)
-        if prev_session_file_path and os.path.exists(prev_session_file_path):
-            prev_session_file_content = read_text_file(prev_session_file_path)
+    inbox = agent_inboxes.get(spawn_id)
+    if inbox is not None:
+        # The next turn of the agent has not started yet, so this message simply becomes part of it
+        inbox.append({"message": message, "prompt": prompt})
+        await message.channel.send(
+            f"📥 Added to the inbox of agent **{spawn_id}**, its next turn will handle all {len(inbox)} messages at once.",
+            reference=message,
+        )
+        return
+    submit_agent_inbox(spawn_id, [{"message": message, "prompt": prompt}])
+
+
+def submit_agent_inbox(spawn_id: str, inbox: list[dict]):
+    # The turn may have to wait for a slot, so it runs in its own task
+    agent_inboxes[spawn_id] = inbox
+    bot.loop.create_task(run_agent_turn(inbox[-1]["message"], spawn_id, inbox))
+
+
+def merge_inbox_prompts(inbox: list[dict]) -> str:
+    if len(inbox) == 1:
+        return inbox[0]["prompt"]
+    parts = [f"I sent you {len(inbox)} messages while you were busy, handle them together:"]
+    for i, item in enumerate(inbox, 1):
+        parts.append(f"Message {i}:\n{item['prompt']}")
+    return "\n\n".join(parts)
+
+
+@notify_on_internal_error
+async def run_agent_turn(message: discord.Message, spawn_id: str, inbox: list[dict]):
+    waited_seconds = await acquire_turn_slot(spawn_id, message)
+    if agent_inboxes.get(spawn_id) is not inbox:
+        # the inbox was dropped (/kill or agent deletion) while the turn was waiting
+        if waited_seconds is not None:
+            release_turn_slot(spawn_id)
+        return
+    # From now on, new messages go to the inbox of the following turn
+    del agent_inboxes[spawn_id]
+    try:
+        await run_admitted_agent_turn(message, spawn_id, inbox, waited_seconds)
+    finally:
+        running_turn_messages.pop(spawn_id, None)
+        release_turn_slot(spawn_id)
+
+
+async def run_admitted_agent_turn(message: discord.Message, spawn_id: str, inbox: list[dict], waited_seconds: float):
+    if spawn_id not in spawns:
+        # deleted while the turn was queued
+        return
+    entry = spawns[spawn_id]
+    prompt = merge_inbox_prompts(inbox)
+    entry['user'] = message.author
+    entry['channel'] = message.channel
+
+    # Read the config only now, it may have been changed while the turn was queued
+    codex_session_id = entry["codex_session_id"]
+    provider = entry["provider"]
+    model = entry["model"]
+    reasoning_effort = entry["reasoning_effort"]
+    working_dir = entry["working_dir"]
+    leak_env = entry["leak_env"]
+    execution_mode = entry["execution_mode"]
+    verbosity = entry["verbosity"]
+    chat_message_count = entry.get("chat_message_count", 0)
+    if isinstance(chat_message_count, bool) or not isinstance(chat_message_count, int) or chat_message_count < 0:
+        chat_message_count = 0
+
+    # Snapshot the session file and the working dir so this turn can be reverted or rewound later
+    turn_checkpoint = await create_turn_checkpoint(entry)
+    session_checkpoint = turn_checkpoint["session"]
 
-    # Save attachments into /tmp/attachments and append a notice to the prompt.
-    if message.attachments:
+    # Save attachments (of all merged messages) into /tmp/attachments and append a notice to the prompt.
+    if any(item["message"].attachments for item in inbox):
         attachments_dir = ATTACHMENTS_DIR
         log(f"Saving attachments to {attachments_dir}...")
-        saved_files = await save_message_attachments(message, attachments_dir)
+        saved_files = []
+        for item in inbox:
+            saved_files.extend(await save_message_attachments(item["message"], attachments_dir))
         log(f"Done saving attachments!")
         if saved_files:
             attached_filenames = ", ".join(os.path.basename(filepath) for filepath in saved_files)
@@ -1292,25 +4265,46 @@ async def on_message(message: discord.Message):
     elif chat_message_count > 0 and chat_message_count % ATTACHMENT_SEND_INSTRUCTION_INTERVAL == 0:
         prompt += f"\n\n{ATTACHMENT_SEND_INSTRUCTION_REMINDER}"
     entry["chat_message_count"] = chat_message_count + 1
-    save_spawns()
+    save_spawn(spawn_id)
 
     # Start the agent
+    user_prompt = prompt
+    # identifies the turn in the logs
+    turn_id = uuid.uuid4().hex[:8]
     prompt = build_codex_prompt(prompt)
-    proc = await launch_agent(
-        spawn_id,
-        prompt,
-        codex_session_id,
-        provider,
-        model,
-        reasoning_effort,
-        working_dir,
-        leak_env,
-        execution_mode,
-    )
-    await message.channel.send(f"✅ AGENT **{spawn_id}** DEPLOYED...", reference=message)
+    metric_labels = (spawn_id, execution_mode)
+    observe_metric("codexmaster_turn_queue_wait_seconds", waited_seconds, *metric_labels)
+    launch_start_time = time.perf_counter()
+    try:
+        proc = await launch_agent(
+            spawn_id,
+            prompt,
+            codex_session_id,
+            provider,
+            model,
+            reasoning_effort,
+            working_dir,
+            leak_env,
+            execution_mode,
+        )
+    except BaseException:
+        # The turn never ran, so there is nothing /rewind could undo
+        drop_turn_checkpoint(entry, turn_checkpoint)
+        raise
+    observe_metric("codexmaster_launch_agent_seconds", time.perf_counter() - launch_start_time, *metric_labels)
+    deploy_details = []
+    if len(inbox) > 1:
+        deploy_details.append(f"{len(inbox)} messages merged")
+    if waited_seconds >= 1:
+        deploy_details.append(f"after waiting {waited_seconds:.0f}s in the queue")
+    deploy_details_msg = f" ({', '.join(deploy_details)})" if deploy_details else ""
+    await message.channel.send(f"✅ AGENT **{spawn_id}** DEPLOYED{deploy_details_msg}...", reference=message)
 
     assert proc.stdout is not None
-    entry["processes"].append({"proc": proc, "start_time": datetime.datetime.now()})
+    # "killed" tells the reader that the proc was killed and that the aborted session updates must be reverted
+    proc_item = {"proc": proc, "start_time": datetime.datetime.now(), "killed": False}
+    entry["processes"].append(proc_item)
+    running_turn_messages[spawn_id] = inbox
 
     # This allows configuring the bot so the responses will not reference the original user message. This way,
     # the user will not be spammed with 'new message' notifications (and won't and up with 10s of unread messages).
@@ -1319,48 +4313,73 @@ async def on_message(message: discord.Message):
     else:
         reference = message
 
-    async def reader():
+    live_status = start_live_status(entry, reference) if is_live_agent_verbosity(verbosity) else None
+
+    def track_codex_session_id(event: CodexEvent):
         nonlocal codex_session_id
-        log(f"Spawning reader routine for agent {spawn_id}")
-        async for line in proc.stdout:
-            line = line.strip().decode('utf-8', errors='replace')
-            if not line:
-                continue
-            try:
-                line_json = json.loads(line)
-            except json.JSONDecodeError:
-                log("[ERROR] New line from process:", line)
-                log(traceback.format_exc())
-                continue
+        maybe_session_id = extract_codex_session_id_from_event(event)
+        if maybe_session_id and maybe_session_id != codex_session_id:
+            codex_session_id = maybe_session_id
+            entry["codex_session_id"] = maybe_session_id
+            save_spawn(spawn_id)
+
+    def notify_discord(event: CodexEvent):
+        send_codex_notification(entry, event, verbosity=verbosity, reference=reference)
+        if live_status is not None:
+            update_live_status(live_status, event)
+
+    # The reader only drains stdout and publishes the events, everything else happens in the subscribers. The Discord
+    # subscriber must not lose answers or errors; it only enqueues messages (the outbound queue summarizes droppable
+    # ones under load), so it is lossless.
+    bus = get_agent_event_bus(spawn_id)
+    turn_subscriptions = [
+        bus.subscribe("codex_session_id", track_codex_session_id, lossless=True),
+        bus.subscribe("discord", notify_discord, lossless=True),
+    ]
+    if LOG_LEVEL >= 2:
+        turn_subscriptions.append(bus.subscribe("log", lambda event: log(
+            "New event:", event.raw, category="raw_event", agent=spawn_id, turn=turn_id, event_type=event.type
+        )))
 
-            log("New line from process:", line)
-            maybe_session_id = extract_codex_session_id_from_event(line_json)
-            if maybe_session_id and maybe_session_id != codex_session_id:
-                codex_session_id = maybe_session_id
-                entry["codex_session_id"] = maybe_session_id
-                save_spawns()
+    async def reader():
+        log(f"Spawning reader routine for agent {spawn_id}", agent=spawn_id, turn=turn_id)
+        await bus.publish(CodexEvent({
+            "type": "codexmaster.turn.started", "spawn_id": spawn_id, "turn_id": turn_id, "prompt": user_prompt
+        }))
+        is_first_event = True
+        async for line in iter_codex_event_lines(proc.stdout, spawn_id):
+            if is_first_event:
+                is_first_event = False
+                observe_metric("codexmaster_turn_first_event_seconds", time.perf_counter() - launch_start_time, *metric_labels)
+            inc_metric("codexmaster_codex_events_total", *metric_labels)
+            inc_metric("codexmaster_codex_event_bytes_total", *metric_labels, value=len(line))
+            event = decode_codex_event(line)
+            if event is not None:
+                await bus.publish(event)
 
-            send_codex_notification(entry, line_json, verbosity=verbosity, reference=reference)
+        await proc.wait()
+        killed = proc_item["killed"]
+        observe_metric("codexmaster_turn_seconds", time.perf_counter() - launch_start_time, *metric_labels)
+        inc_metric("codexmaster_turns_total", *metric_labels, "killed" if killed else "completed")
+        await bus.publish(CodexEvent({"type": "codexmaster.turn.finished", "spawn_id": spawn_id, "killed": killed}))
+        # Let the subscribers of this turn catch up, so the completion message comes last and the session id is final
+        for subscription in turn_subscriptions:
+            await bus.unsubscribe(subscription)
 
         # Send termination notification
         send_notification(entry, f"AGENT **{spawn_id}** COMPLETED HIS MISSION!", critical=True, reference=reference)
-        log(f"Retiring reader routine for agent {spawn_id}")
+        log(f"Retiring reader routine for agent {spawn_id}", agent=spawn_id, turn=turn_id)
 
-        # Stop container
-        if is_docker_execution_mode(execution_mode):
-            await stop_agent_docker_container(spawn_id)
-
-        await proc.wait()
-        if proc in newly_killed_procs:
-            log(f"Reverting session file for Codex session ID {codex_session_id}")
-            newly_killed_procs.remove(proc)
-            restored = restore_codex_session_file(codex_session_id, prev_session_file_content)
+        if killed:
+            log(f"Reverting session file for Codex session ID {codex_session_id}", agent=spawn_id, turn=turn_id)
+            restored = restore_codex_session_file(codex_session_id, session_checkpoint)
             if not restored:
-                log(f"Could not restore session file for {codex_session_id}")
-            if prev_session_file_content is None:
+                log(f"Could not restore session file for {codex_session_id}", level=logging.WARNING, agent=spawn_id, turn=turn_id)
+            drop_turn_checkpoint(entry, turn_checkpoint)
+            if session_checkpoint is None:
                 # First run was reverted; drop the stored session id so the next prompt starts fresh.
                 entry["codex_session_id"] = None
-                save_spawns()
+                save_spawn(spawn_id)
 
         # Remove this process from entry["processes"]
         entry_procs = entry["processes"]
@@ -1370,7 +4389,17 @@ async def on_message(message: discord.Message):
                 entry_procs.pop(i)
                 break
 
-    asyncio.run_coroutine_threadsafe(reader(), bot.loop)
+        # Keep the container warm for the next turn, it will be stopped once idle
+        if is_docker_execution_mode(execution_mode) and spawn_id in spawns:
+            schedule_agent_docker_container_idle_stop(spawn_id)
+
+    try:
+        await reader()
+    finally:
+        for subscription in turn_subscriptions:
+            await bus.unsubscribe(subscription)
+        if live_status is not None:
+            await finish_live_status(live_status)
 
 
 if __name__ == "__main__":
@@ -1379,3 +4408,7 @@ if __name__ == "__main__":
         log("Error: DISCORD_BOT_TOKEN environment variable not set.")
         sys.exit(1)
     bot.run(token)
+    # bot.run() closes its event loop when it returns, so the containers are shut down on a fresh one
+    docker_api_session = None
+    if ALLOW_DOCKER_EXECUTION:
+        asyncio.run(shutdown_docker_containers())